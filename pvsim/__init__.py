@@ -9,11 +9,18 @@
 # Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
 
 try:
-    from pvsim.brokers import RabbitMQBroker  # NOQA
+    from pvsim.brokers import (  # NOQA
+        QueueBroker, RabbitMQBroker, UnixSocketBroker
+    )
 except ImportError:
     pass  # An ImportError is raised while pip hasn't installe pika yet
-from pvsim.measures import HPCMeasure  # NOQA
-from pvsim.meters import GenericMeter  # NOQA
-from pvsim.simulators import PVSimulator  # NOQA
+from pvsim.backfillers import Backfiller  # NOQA
+from pvsim.clocks import RealClock, SimulatedClock  # NOQA
+from pvsim.measures import ApplianceMeasure, HPCMeasure  # NOQA
+from pvsim.meters import FleetMeter, GenericMeter  # NOQA
+from pvsim.plotters import Plotter  # NOQA
+from pvsim.simulators import PVSimulator, SolarPVSimulator  # NOQA
 from pvsim.version import __version__  # NOQA
-from pvsim.writers import CSVWriter  # NOQA
+from pvsim.writers import (  # NOQA
+    CSVWriter, ParquetWriter, RotatingCSVWriter, ThreadedWriter
+)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of pvsim.
+# https://github.com/scorphus/pvism
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/MIT-license
+# Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
+
+'''An asyncio runtime alternative to the blocking meter and simulator loops.
+It requires Python 3.5+ and, for RabbitMQ, ``aio-pika``. All meters of a
+process share a single broker connection and everything runs in one thread.
+'''
+
+import asyncio
+import copy
+import logging
+
+from pvsim.main import (
+    instantiate_clock, instantiate_component, instantiate_writer
+)
+from pvsim.meters import GenericMeter, monotonic
+
+try:
+    import aio_pika
+except ImportError:
+    aio_pika = None  # aio-pika is only required by AsyncRabbitMQBroker
+
+
+class AsyncBroker(object):
+
+    async def connect(self):
+        raise NotImplementedError('connect should be implemented by subclass')
+
+    async def disconnect(self):
+        raise NotImplementedError(
+            'disconnect should be implemented by subclass'
+        )
+
+    async def publish(self, body):
+        raise NotImplementedError('publish should be implemented by subclass')
+
+    async def publish_many(self, bodies):
+        return all([await self.publish(body) for body in bodies])
+
+    async def start_consuming(self, callback):
+        raise NotImplementedError(
+            'start_consuming should be implemented by subclass'
+        )
+
+
+class AsyncRabbitMQBroker(AsyncBroker):
+    '''The asyncio counterpart of ``RabbitMQBroker``, built on ``aio-pika``.
+    It takes the same parameters; the ones that only make sense for the
+    blocking implementation (buffering, batch consuming) are ignored.
+
+    :param host: RabbitMQ server host
+    :param port: RabbitMQ server port
+    :param exchange: name of the exchange
+    :param routing_key: routing key used to publish and bind
+    :param confirm_delivery: enable publisher confirms
+    :param queue: name of the queue to consume from; if empty, an exclusive
+        server-named queue is used
+    :param durable: whether the named queue survives broker restarts
+    :param prefetch_count: maximum number of unacknowledged messages
+    '''
+
+    def __init__(self, host, port, exchange, routing_key,
+                 confirm_delivery=False, queue='', durable=False,
+                 prefetch_count=0, **ignored):
+        if aio_pika is None:
+            raise ImportError(
+                'AsyncRabbitMQBroker requires aio-pika to be installed'
+            )
+        self.host = host
+        self.port = port
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.confirm_delivery = confirm_delivery
+        self.queue = queue
+        self.durable = durable
+        self.prefetch_count = int(prefetch_count)
+        self.connection, self.channel, self._exchange = None, None, None
+
+    async def connect(self):
+        try:
+            self.connection = await aio_pika.connect_robust(
+                host=self.host, port=self.port
+            )
+        except (ConnectionError, aio_pika.exceptions.AMQPError) as e:
+            self.connection, self.channel, self._exchange = None, None, None
+            logging.error(
+                '[AsyncRabbitMQBroker] Unable to connect to RabbitMQ server: '
+                '%s', e
+            )
+            return
+        self.channel = await self.connection.channel(
+            publisher_confirms=self.confirm_delivery
+        )
+        if self.prefetch_count:
+            await self.channel.set_qos(prefetch_count=self.prefetch_count)
+        self._exchange = await self.channel.declare_exchange(
+            self.exchange, aio_pika.ExchangeType.DIRECT
+        )
+
+    async def disconnect(self):
+        if self.connection is not None and not self.connection.is_closed:
+            await self.connection.close()
+
+    async def publish(self, body):
+        if self._exchange is None:
+            await self.connect()
+        if self._exchange is None:
+            return False
+        if not isinstance(body, bytes):
+            body = body.encode()
+        try:
+            await self._exchange.publish(
+                aio_pika.Message(body=body), routing_key=self.routing_key
+            )
+        except (ConnectionError, asyncio.TimeoutError,
+                aio_pika.exceptions.AMQPError,
+                aio_pika.exceptions.ChannelInvalidStateError) as e:
+            # the robust connection reconnects by itself; this reading is lost
+            logging.error('[AsyncRabbitMQBroker] Unable to publish: %r', e)
+            return False
+        return True
+
+    async def start_consuming(self, callback):
+        if self._exchange is None:
+            await self.connect()
+        if self._exchange is None:
+            return
+        queue = await self.channel.declare_queue(
+            self.queue or None, durable=self.durable, exclusive=not self.queue
+        )
+        await queue.bind(self._exchange, routing_key=self.routing_key)
+
+        async def on_message(message):
+            callback(message.body)
+
+        await queue.consume(on_message, no_ack=True)
+        await asyncio.Future()  # consume until cancelled
+
+
+class AsyncMeter(GenericMeter):
+    '''The asyncio counterpart of ``GenericMeter``, with the same tick
+    alignment and missed tick policies. Ticks are awaited on the event loop,
+    so many meters can share a single thread.
+
+    :param measure: measure to read from
+    :param broker: an ``AsyncBroker`` where readings are published to
+    :param interval: interval between readings in seconds
+    :param missed_tick_policy: either ``skip`` or ``catch-up``
+    :param serializer: wire format of readouts, ``json`` or ``binary``
+    :param clock: clock timestamping readouts, also set on the measure;
+        defaults to the wall clock
+    '''
+
+    async def publish(self):
+        timestamp = self.clock.now()
+        power, localtime = self.measure.readout(timestamp)
+        reading = {
+            'timestamp': timestamp,
+            'localtime': localtime,
+            'power': power,
+        }
+        if await self.broker.publish(self.serializer.encode(reading)):
+            self._readings.inc()
+            self._sent_log.log('[AsyncMeter] Sent %s', reading)
+        else:
+            self._failures.inc()
+
+    async def publish_periodically(self):
+        deadline = self.first_deadline()
+        while True:
+            delay = deadline - monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            with self._publish_seconds.time():
+                await self.publish()
+            deadline = self.next_deadline(deadline)
+
+
+async def consume_from_broker(simulator, broker):
+    logging.info('[PVSimulator] Waiting for readouts. Ctrl+C to stop.')
+    await broker.start_consuming(simulator.message_received)
+
+
+def instantiate_async_component(component, config, default_class,
+                                **init_kwargs):
+    '''Instantiate ``component`` from its ``async_class`` config entry,
+    falling back to ``default_class``, with the usual parameters
+    '''
+    config = copy.deepcopy(config)
+    component_config = config.setdefault(component, {})
+    component_config['class'] = component_config.get(
+        'async_class', default_class
+    )
+    return instantiate_component(component, config, **init_kwargs)
+
+
+async def run_components(config, with_meter, with_simulator):
+    brokers, writer, coroutines = [], None, []
+    clock = instantiate_clock(config)
+    if with_meter:
+        broker = instantiate_async_component(
+            'broker', config, 'pvsim.aio.AsyncRabbitMQBroker'
+        )
+        brokers.append(broker)
+        count = int(config.get('meter', {}).get('count', 1))
+        for index in range(count):
+            measure = instantiate_component('measure', config)
+            if measure.seed is not None:
+                measure.set_seed(measure.seed, stream=index)
+            meter = instantiate_async_component(
+                'meter',
+                config,
+                'pvsim.aio.AsyncMeter',
+                measure=measure,
+                broker=broker,
+                clock=clock,
+            )
+            coroutines.append(meter.publish_periodically())
+        logging.info('Starting %d meters...', count)
+    if with_simulator:
+        simulator = instantiate_component('simulator', config)
+        writer = instantiate_writer(config)
+        simulator.set_writer(writer)
+        if clock is not None:
+            simulator.set_clock(clock)
+        broker = instantiate_async_component(
+            'broker', config, 'pvsim.aio.AsyncRabbitMQBroker'
+        )
+        brokers.append(broker)
+        coroutines.append(consume_from_broker(simulator, broker))
+        logging.info('Starting simulator...')
+    try:
+        await asyncio.gather(*coroutines)
+    finally:
+        for broker in brokers:
+            await broker.disconnect()
+        if writer is not None:
+            writer.close()
+
+
+def run(config, action):
+    with_meter = action in ('meter', 'pipeline')
+    with_simulator = action in ('simulator', 'pipeline')
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(run_components(config, with_meter, with_simulator))
+    try:
+        loop.run_until_complete(task)
+    except KeyboardInterrupt:
+        logging.info('Stoping...')
+        task.cancel()
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+    finally:
+        loop.close()
+    logging.info('Stopped')
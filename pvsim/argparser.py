@@ -34,6 +34,63 @@ class ArgParser(object):
             action='store_true',
             help='activate verbose mode',
         )
+        self._parser.add_argument(
+            '--log-format',
+            choices=('text', 'json'),
+            default='text',
+            help='log as plain text or as JSON objects, one a line',
+        )
+        self._parser.add_argument(
+            '--log-every',
+            type=int,
+            default=1,
+            metavar='N',
+            help='log only every Nth message of per-readout logs',
+        )
+        self._parser.add_argument(
+            '--log-rate',
+            type=float,
+            default=0,
+            metavar='PER_SECOND',
+            help='log at most this many per-readout messages a second',
+        )
+        self._parser.add_argument(
+            '--asyncio',
+            action='store_true',
+            help='run `meter´, `simulator´ or `pipeline´ on asyncio',
+        )
+        self._parser.add_argument(
+            '--speed',
+            type=float,
+            help='run time this many times faster than the wall clock',
+        )
+        self._parser.add_argument(
+            '--start',
+            type=str,
+            help='local time to start at, as in 2017-06-21T00:00:00',
+        )
+        self._parser.add_argument(
+            '--profile',
+            type=float,
+            metavar='SECONDS',
+            help='profile the action for this many seconds (0 until stopped)',
+        )
+        self._parser.add_argument(
+            '--profile-output',
+            type=str,
+            default='pvsim-profile',
+            help='path prefix of the `.folded´ and `.txt´ profile files',
+        )
+        self._parser.add_argument(
+            '--baseline',
+            type=str,
+            help='baseline file that `bench´ compares to or saves into',
+        )
+        self._parser.add_argument(
+            '--save-baseline',
+            action='store_true',
+            help='save benchmark results as the new baseline',
+        )
         self._parser.add_argument(
             '--version',
             action='store_true',
@@ -47,7 +104,10 @@ class ArgParser(object):
         self._parser.add_argument(
             'action',
             nargs='?',
-            help='either one of `meter´, `simulator´ or `plot´',
+            help=(
+                'either one of `meter´, `simulator´, `pipeline´, `backfill´, '
+                '`bench´ or `plot´'
+            ),
         )
 
     def parse(self):
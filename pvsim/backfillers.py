@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of pvsim.
+# https://github.com/scorphus/pvism
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/MIT-license
+# Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
+
+import logging
+import numpy
+
+from datetime import datetime
+
+
+class Backfiller(object):
+    '''The Backfiller generates ``[localtime, consumed, generated, sum]`` rows
+    over a simulated time range, without a broker and without waiting for the
+    wall clock. Readings are computed in batches with the vectorized
+    ``power_curve`` of both the measure and the simulator and streamed straight
+    into the writer.
+
+    :param measure: the power consumption measure (e.g. ``HPCMeasure``)
+    :param simulator: the power generation simulator (e.g. ``PVSimulator``)
+    :param writer: where rows are written to
+    :param start: beginning of the range (ISO 8601 string or ``datetime``)
+    :param end: end of the range, exclusive (ISO 8601 string or ``datetime``)
+    :param step: interval between readings in seconds
+    :param batch_size: number of readings computed at once
+    :param seed: seed of the random noise of both ``measure`` and
+        ``simulator``, for reproducible backfills; their own seeds are used if
+        empty. The noise of each reading only depends on the seed and its
+        time, so a range yields the same rows however it's split.
+    '''
+
+    def __init__(
+        self,
+        measure,
+        simulator,
+        writer,
+        start,
+        end,
+        step=1,
+        batch_size=86400,
+        seed=None,
+    ):
+        self.measure = measure
+        self.simulator = simulator
+        self.writer = writer
+        self.start = self._to_datetime64(start)
+        self.end = self._to_datetime64(end)
+        self.step = int(step)
+        self.batch_size = int(batch_size)
+        if seed is not None:
+            measure.set_seed(seed, stream=0)
+            simulator.set_seed(seed, stream=1)
+        if self.end <= self.start:
+            raise ValueError('inappropriate values for start and end')
+        if self.step <= 0:
+            raise ValueError('inappropriate value for step')
+        if self.batch_size <= 0:
+            raise ValueError('inappropriate value for batch size')
+
+    def _to_datetime64(self, value):
+        if isinstance(value, datetime):
+            value = value.replace(tzinfo=None)
+        return numpy.datetime64(value, 's')
+
+    def batches(self):
+        step = numpy.timedelta64(self.step, 's')
+        batch_length = step * self.batch_size
+        batch_start = self.start
+        while batch_start < self.end:
+            batch_end = min(batch_start + batch_length, self.end)
+            yield numpy.arange(batch_start, batch_end, step)
+            batch_start = batch_end
+
+    def rows(self, timestamps):
+        consumed = self.measure.power_curve_at(timestamps) / 1000
+        generated = self.simulator.power_curve_at(timestamps) / 1000
+        localtimes = numpy.datetime_as_string(timestamps, unit='s')
+        return [
+            list(row) for row in zip(
+                localtimes.tolist(),
+                consumed.tolist(),
+                generated.tolist(),
+                (generated - consumed).tolist(),
+            )
+        ]
+
+    def run(self):
+        count = 0
+        for timestamps in self.batches():
+            self.writer.write_many(self.rows(timestamps))
+            count += len(timestamps)
+            logging.info(
+                '[Backfiller] Wrote %d rows up to %s', count, timestamps[-1]
+            )
+        return count
@@ -8,11 +8,39 @@
 # http://www.opensource.org/licenses/MIT-license
 # Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
 
+import numpy
 import random
 
-from datetime import datetime
-from time import localtime, mktime
 from math import pi
+from pvsim.clocks import RealClock, seconds_of_day
+
+
+def check_random_state(seed=None):
+    '''Turn ``seed`` into a ``numpy.random.RandomState`` instance. ``None``
+    returns the global one, an integer (or sequence of integers) seeds a new
+    one and an existing instance is returned untouched.
+    '''
+    if seed is None:
+        return numpy.random.mtrand._rand
+    if isinstance(seed, (numpy.random.RandomState, SampledRandomState)):
+        return seed
+    return numpy.random.RandomState(seed)
+
+
+class SampledRandomState(object):
+    '''Hands out samples drawn beforehand, in place of a
+    ``numpy.random.RandomState``, to functions taking a ``random_state``
+
+    :param samples: array of samples in [0, 1)
+    '''
+
+    def __init__(self, samples):
+        self.samples = samples
+
+    def random_sample(self, size=None):
+        if numpy.size(self.samples) != numpy.prod(size, dtype=int):
+            raise ValueError('size does not match the samples')
+        return self.samples.reshape(size)
 
 
 class PowerCalc(object):
@@ -21,13 +49,83 @@ class PowerCalc(object):
     # seconds into account.
     day_length = 24 * 3600
 
-    def format_localtime(self, local_time):
-        return datetime.fromtimestamp(mktime(local_time)).isoformat()
+    #: The clock telling the current time, see ``set_clock``
+    clock = RealClock()
+
+    #: Seed of the random noise, see ``set_seed``. If ``None``, noise comes
+    # from the global ``random`` and ``numpy.random`` states.
+    seed = None
+
+    #: Substream of the random noise, see ``set_seed``
+    stream = 0
+
+    _random_state = None
+    _daily_samples = None
+    _last_day = None, None  # (date prefix, days since the epoch)
+
+    def set_clock(self, clock):
+        self.clock = clock
+
+    def set_seed(self, seed, stream=0):
+        '''Seed the random noise of this instance. Instances with the same
+        ``seed`` and different ``stream`` (e.g. one per meter or worker) draw
+        independent noise.
+        '''
+        self.seed = seed
+        self.stream = int(stream)
+        self._random_state = None
+        self._daily_samples = None
+        self._last_day = None, None
 
-    def current_power_and_time(self):
-        lt = localtime()
-        seconds = lt.tm_hour * 3600 + lt.tm_min * 60 + lt.tm_sec
-        return self.power_at(seconds), self.format_localtime(lt)
+    @property
+    def random_state(self):
+        '''The ``numpy.random.RandomState`` of this instance's substream, or
+        ``None`` if it's not seeded
+        '''
+        if self._random_state is None and self.seed is not None:
+            self._random_state = numpy.random.RandomState(
+                [self.seed, self.stream]
+            )
+        return self._random_state
+
+    def daily_samples(self, day):
+        '''Uniform samples in [0, 1), one for each second of ``day`` (days
+        since the epoch), drawn from a substream of their own
+        '''
+        if self._daily_samples is None or self._daily_samples[0] != day:
+            random_state = numpy.random.RandomState(
+                [self.seed, self.stream, day]
+            )
+            self._daily_samples = day, random_state.random_sample(
+                self.day_length
+            )
+        return self._daily_samples[1]
+
+    def random_state_at(self, timestamps):
+        '''A random state with the noise of each one of the
+        ``numpy.datetime64`` ``timestamps`` drawn from the substream of its
+        day. Noise over a range of time doesn't depend then on how it's split
+        into batches or workers.
+        '''
+        timestamps = numpy.asarray(timestamps, dtype='datetime64[s]')
+        days = timestamps.astype('datetime64[D]')
+        seconds = (timestamps - days).astype(int)
+        days = days.astype(int)
+        samples = numpy.empty(timestamps.shape)
+        for day in numpy.unique(days):
+            in_day = days == day
+            samples[in_day] = self.daily_samples(int(day))[seconds[in_day]]
+        return SampledRandomState(samples)
+
+    def current_seconds(self, timestamp=None):
+        return self.clock.seconds(timestamp)
+
+    def current_seconds_and_time(self, timestamp=None):
+        return self.clock.seconds_and_localtime(timestamp)
+
+    def current_power_and_time(self, timestamp=None):
+        seconds, local_time = self.current_seconds_and_time(timestamp)
+        return self.power_at(seconds), local_time
 
     def day_range(self, step):
         return range(0, self.day_length, step)
@@ -43,5 +141,53 @@ class PowerCalc(object):
     def power_at(self, seconds):
         raise NotImplementedError('power_at should be implemented by subclass')
 
+    def power_curve(self, seconds, random_state=None):
+        '''Vectorized counterpart of ``power_at``: returns a ``numpy`` array
+        with the power at each one of the given ``seconds``
+
+        :param seconds: array-like of seconds since the beginning of the day
+        :param random_state: ``None``, a seed or a ``numpy.random.RandomState``
+        '''
+        raise NotImplementedError(
+            'power_curve should be implemented by subclass'
+        )
+
+    def power_curve_at(self, timestamps, random_state=None):
+        '''Like ``power_curve``, at ``numpy.datetime64`` local times, for
+        subclasses whose power also depends on the date
+        '''
+        timestamps = numpy.asarray(timestamps, dtype='datetime64[s]')
+        if random_state is None and self.seed is not None:
+            random_state = self.random_state_at(timestamps)
+        seconds = timestamps - timestamps.astype('datetime64[D]')
+        return self.power_curve(seconds.astype(int), random_state)
+
     def random(self, factor=10):
-        return (factor - random.random()) / factor
+        if self.seed is None:
+            return (factor - random.random()) / factor
+        return (factor - self.random_state.random_sample()) / factor
+
+    def random_at(self, localtime, factor=10):
+        '''Like ``random``, but if seeded, the noise at the ISO 8601
+        ``localtime`` is drawn from the substream of its day, as
+        ``random_state_at`` does: it doesn't depend then on which worker
+        computes it nor in which order
+        '''
+        seconds = seconds_of_day(localtime)
+        if self.seed is None or seconds is None:
+            return self.random(factor)
+        prefix = localtime[:10]
+        if prefix != self._last_day[0]:
+            try:
+                day = numpy.datetime64(prefix, 'D').astype(int)
+            except ValueError:
+                return self.random(factor)
+            self._last_day = prefix, int(day)
+        sample = self.daily_samples(self._last_day[1])[seconds]
+        return (factor - sample) / factor
+
+    def random_array(self, size, factor=10, random_state=None):
+        if random_state is None:
+            random_state = self.random_state
+        random_state = check_random_state(random_state)
+        return (factor - random_state.random_sample(size)) / factor
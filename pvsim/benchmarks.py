@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of pvsim.
+# https://github.com/scorphus/pvism
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/MIT-license
+# Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
+
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+from itertools import cycle
+from pvsim.brokers import Broker
+from pvsim.measures import ApplianceMeasure, HPCMeasure
+from pvsim.meters import GenericMeter
+from pvsim.serializers import BinarySerializer
+from pvsim.simulators import PVSimulator
+from pvsim.writers import CSVWriter, Writer
+
+try:
+    from time import perf_counter
+except ImportError:
+    from time import time as perf_counter  # Python 2
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None  # Python 2, allocations are not reported
+
+
+class FakeBroker(Broker):
+    '''Keeps published messages in memory until they're delivered'''
+
+    def __init__(self):
+        self.messages = []
+        self.callback = None
+
+    def connect(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def publish(self, body):
+        self.messages.append(body)
+        return True
+
+    def start_consuming(self, callback):
+        self.callback = callback
+
+    def deliver(self):
+        messages, self.messages = self.messages, []
+        for body in messages:
+            self.callback(None, None, None, body.encode())
+
+
+class NullWriter(Writer):
+    '''Counts rows and throws them away'''
+
+    def __init__(self):
+        self.rows = 0
+
+    def write(self, data):
+        self.rows += 1
+
+    def write_many(self, rows):
+        self.rows += len(rows)
+
+
+class Benchmark(object):
+    '''A stage to be benchmarked: ``setup`` returns the function that's timed
+    and ``teardown``, if any, cleans up after it.
+
+    :param name: name of the stage
+    :param setup: callable returning the function to time
+    :param items: number of items (readouts, rows...) handled per call
+    :param teardown: callable run after the stage is done
+    '''
+
+    def __init__(self, name, setup, items=1, teardown=None):
+        self.name = name
+        self.setup = setup
+        self.items = items
+        self.teardown = teardown
+
+    def _time(self, func, iterations):
+        latencies = []
+        for _ in range(iterations):
+            start = perf_counter()
+            func()
+            latencies.append(perf_counter() - start)
+        return latencies
+
+    def _peak_memory(self, func, iterations):
+        if tracemalloc is None:
+            return None
+        tracemalloc.start()
+        try:
+            for _ in range(iterations):
+                func()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def run(self, iterations):
+        func = self.setup()
+        try:
+            func()  # warm up
+            latencies = sorted(self._time(func, iterations))
+            peak_memory = self._peak_memory(func, max(iterations // 10, 1))
+        finally:
+            if self.teardown is not None:
+                self.teardown()
+        total = sum(latencies)
+        return {
+            'rate': self.items * iterations / total if total else 0,
+            'p50': latencies[len(latencies) // 2],
+            'p99': latencies[min(int(len(latencies) * 0.99), iterations - 1)],
+            'peak_kib': None if peak_memory is None else peak_memory / 1024,
+        }
+
+
+def benchmarks(tmpdir):
+    '''Benchmarks of each stage of the pipeline in isolation and end to end'''
+    seconds = cycle(range(0, HPCMeasure.day_length, 7))
+    body = json.dumps({'localtime': '2017-11-06T12:00:00', 'power': 1234})
+    binary_body = BinarySerializer().encode_many([
+        {'timestamp': 1509969600 + i, 'power': 1234} for i in range(100)
+    ])
+    row = ['2017-11-06T12:00:00', 1.234, 2.345, 1.111]
+    csv_writers = []
+
+    def measure():
+        hpcm = HPCMeasure()
+        return lambda: hpcm.power_at(next(seconds))
+
+    def appliance_measure():
+        measure = ApplianceMeasure(seed=42)
+        return lambda: measure.power_at(next(seconds), 17476)
+
+    def measure_curve():
+        hpcm = HPCMeasure()
+        day = list(hpcm.day_range(1))
+        return lambda: hpcm.power_curve(day)
+
+    def meter():
+        return GenericMeter(HPCMeasure(), FakeBroker()).publish
+
+    def simulator():
+        pvs = PVSimulator()
+        pvs.set_writer(NullWriter())
+        return lambda: pvs.message_received(body.encode())
+
+    def simulator_binary():
+        pvs = PVSimulator()
+        pvs.set_writer(NullWriter())
+        return lambda: pvs.message_received(binary_body)
+
+    def csv_writer():
+        writer = CSVWriter(os.path.join(tmpdir, 'bench.csv'))
+        csv_writers.append(writer)
+        return lambda: writer.write(row)
+
+    def close_csv_writers():
+        for writer in csv_writers:
+            writer.close()
+
+    def end_to_end():
+        broker = FakeBroker()
+        meter = GenericMeter(HPCMeasure(), broker)
+        pvs = PVSimulator()
+        pvs.set_writer(NullWriter())
+        pvs.consume_from_broker(broker)
+
+        def publish_and_deliver():
+            meter.publish()
+            broker.deliver()
+        return publish_and_deliver
+
+    return [
+        Benchmark('measure.power_at', measure),
+        Benchmark('measure.appliance.power_at', appliance_measure),
+        Benchmark('measure.power_curve', measure_curve, HPCMeasure.day_length),
+        Benchmark('meter.publish', meter),
+        Benchmark('simulator.message_received', simulator),
+        Benchmark('simulator.message_received.binary', simulator_binary, 100),
+        Benchmark('writer.csv', csv_writer, teardown=close_csv_writers),
+        Benchmark('end_to_end', end_to_end),
+    ]
+
+
+def run_benchmarks(iterations=10000):
+    tmpdir = tempfile.mkdtemp()
+    results = {}
+    try:
+        for benchmark in benchmarks(tmpdir):
+            count = iterations
+            if benchmark.items > 1:
+                count = max(iterations // 1000, 5)
+            results[benchmark.name] = benchmark.run(count)
+    finally:
+        shutil.rmtree(tmpdir)
+    return results
+
+
+def format_results(results):
+    lines = ['{:<34} {:>14} {:>10} {:>10} {:>10}'.format(
+        'stage', 'items/s', 'p50 (us)', 'p99 (us)', 'peak KiB'
+    )]
+    for name, result in sorted(results.items()):
+        peak = result['peak_kib']
+        lines.append('{:<34} {:>14.0f} {:>10.1f} {:>10.1f} {:>10}'.format(
+            name,
+            result['rate'],
+            result['p50'] * 1e6,
+            result['p99'] * 1e6,
+            '-' if peak is None else '{:.1f}'.format(peak),
+        ))
+    return '\n'.join(lines)
+
+
+def compare_to_baseline(results, baseline, tolerance=0.2):
+    '''Return the names of stages that got more than ``tolerance`` slower'''
+    return sorted(
+        name for name, result in results.items()
+        if name in baseline and
+        result['rate'] < baseline[name]['rate'] * (1 - tolerance)
+    )
+
+
+def bench(baseline_path=None, save_baseline=False, tolerance=0.2,
+          iterations=10000):
+    results = run_benchmarks(iterations)
+    sys.stdout.write(format_results(results) + '\n')
+    if baseline_path is None:
+        return True
+    if save_baseline or not os.path.exists(baseline_path):
+        with open(baseline_path, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+        logging.info('[bench] Baseline saved to %s', baseline_path)
+        return True
+    with open(baseline_path) as fp:
+        baseline = json.load(fp)
+    regressions = compare_to_baseline(results, baseline, tolerance)
+    for name in regressions:
+        logging.error(
+            '[bench] %s regressed: %.0f items/s, baseline is %.0f items/s',
+            name, results[name]['rate'], baseline[name]['rate'],
+        )
+    return not regressions
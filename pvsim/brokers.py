@@ -8,12 +8,35 @@
 # http://www.opensource.org/licenses/MIT-license
 # Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
 
+import errno
 import logging
+import os
 import pika
+import select
+import socket
+import struct
+import threading
+import time
+
+from collections import deque
+from pvsim import metrics
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # Python 2
 
 
 class Broker(object):
 
+    #: Number of messages handed at once to ``start_consuming_batches``
+    # callbacks. Brokers that only deliver one message at a time keep it at 1.
+    consume_batch_size = 1
+
+    #: Whether batches are acknowledged once their callback returns, so their
+    # rows must be synced to storage first (see ``Writer.sync``)
+    acks_batches = False
+
     def connect(self):
         raise NotImplementedError('connect should be implemented by subclass')
 
@@ -25,19 +48,96 @@ class Broker(object):
     def publish(self, body):
         raise NotImplementedError('publish should be implemented by subclass')
 
+    def publish_many(self, bodies):
+        return all([self.publish(body) for body in bodies])
+
+    def flush(self):
+        return True
+
+    def flush_due_in(self):
+        '''Seconds until buffered messages must be flushed, or ``None`` if
+        there are none
+        '''
+        return None
+
     def start_consuming(self, callback):
         raise NotImplementedError(
             'start_consuming should be implemented by subclass'
         )
 
+    def start_consuming_batches(self, callback):
+        raise NotImplementedError(
+            'start_consuming_batches should be implemented by subclass'
+        )
+
 
 class RabbitMQBroker(Broker):
+    '''The RabbitMQBroker publishes to and consumes from a direct exchange.
+
+    Published messages go through a buffer that is flushed once it holds
+    ``batch_size`` messages or its oldest message is ``max_latency`` seconds
+    old. Meters flush it while waiting for their next tick; for other
+    publishers, the latency is only checked on ``publish``. Messages that
+    could not be delivered (connection errors or, with ``confirm_delivery``,
+    nacked/returned ones) are kept in an in-memory retry queue and published
+    again on the next flush.
 
-    def __init__(self, host, port, exchange, routing_key):
+    :param host: RabbitMQ server host
+    :param port: RabbitMQ server port
+    :param exchange: name of the exchange
+    :param routing_key: routing key used to publish and bind
+    :param confirm_delivery: enable publisher confirms
+    :param batch_size: number of messages buffered before publishing
+    :param max_latency: maximum number of seconds a message stays buffered
+    :param retry_queue_size: maximum number of undelivered messages kept,
+        oldest ones are dropped first
+    :param queue: name of the queue to consume from; if empty, an exclusive
+        server-named queue is used
+    :param durable: whether the named queue survives broker restarts
+    :param prefetch_count: maximum number of unacknowledged messages
+    :param consume_batch_size: number of messages per batch when consuming
+        batches; they're acknowledged only after the callback returns
+    :param consume_timeout: maximum number of seconds to wait for a batch to
+        fill up before handing it over
+    '''
+
+    acks_batches = True
+
+    def __init__(self, host, port, exchange, routing_key,
+                 confirm_delivery=False, batch_size=1, max_latency=0.5,
+                 retry_queue_size=100000, queue='', durable=False,
+                 prefetch_count=0, consume_batch_size=1, consume_timeout=1):
         self.host = host
         self.port = port
         self.exchange = exchange
         self.routing_key = routing_key
+        self.confirm_delivery = confirm_delivery
+        self.batch_size = int(batch_size)
+        self.max_latency = max_latency
+        self._buffer = []
+        self._buffered_at = None
+        self._retry_queue = deque(maxlen=int(retry_queue_size))
+        self.queue = queue
+        self.durable = durable
+        self.prefetch_count = int(prefetch_count)
+        self.consume_batch_size = int(consume_batch_size)
+        self.consume_timeout = consume_timeout
+        self._reconnects = metrics.counter(
+            'pvsim_broker_reconnects_total',
+            'Connections attempted after losing the previous one',
+        )
+        self._connection_errors = metrics.counter(
+            'pvsim_broker_connection_errors_total',
+            'Failed attempts to connect to the broker',
+        )
+        self._publish_errors = metrics.counter(
+            'pvsim_broker_publish_errors_total',
+            'Messages not delivered, kept in the retry queue',
+        )
+        metrics.gauge(
+            'pvsim_broker_retry_queue_messages',
+            'Messages waiting in the retry queue',
+        ).set_function(lambda: len(self._retry_queue))
         self.connect()
 
     def connect(self):
@@ -46,6 +146,7 @@ class RabbitMQBroker(Broker):
             self.connection = pika.BlockingConnection(params)
         except pika.exceptions.ConnectionClosed as e:
             self.connection, self.channel = None, None
+            self._connection_errors.inc()
             logging.error(
                 '[RabbitMQBroker] Unable to connect to RabbitMQ server: %s', e
             )
@@ -54,33 +155,329 @@ class RabbitMQBroker(Broker):
         self.channel.exchange_declare(
             exchange=self.exchange, exchange_type='direct'
         )
+        if self.confirm_delivery:
+            self.channel.confirm_delivery()
+
+    def reconnect(self):
+        self._reconnects.inc()
+        self.connect()
 
     def disconnect(self):
+        if self._buffer or self._retry_queue:
+            self.flush()
         if self.connection is not None and not self.connection.is_closed:
             self.connection.close()
 
     def publish(self, body):
+        if not self._buffer:
+            self._buffered_at = time.time()
+        self._buffer.append(body)
+        if (len(self._buffer) >= self.batch_size or
+                time.time() - self._buffered_at >= self.max_latency):
+            return self.flush()
+        return True
+
+    def publish_many(self, bodies):
+        self._buffer.extend(bodies)
+        return self.flush()
+
+    def flush_due_in(self):
+        if not self._buffer:
+            return None
+        return self._buffered_at + self.max_latency - time.time()
+
+    def flush(self):
+        bodies = list(self._retry_queue) + self._buffer
+        self._retry_queue.clear()
+        self._buffer, self._buffered_at = [], None
+        if not bodies:
+            return True
         if self.connection is None or self.channel is None:
-            self.connect()
-        if self.connection is not None and not self.connection.is_closed:
-            self.channel.basic_publish(
-                exchange=self.exchange,
-                routing_key=self.routing_key,
-                body=body,
+            self.reconnect()
+        if self.connection is None or self.connection.is_closed:
+            self._retry_queue.extend(bodies)
+            return False
+        for i, body in enumerate(bodies):
+            try:
+                delivered = self.channel.basic_publish(
+                    exchange=self.exchange,
+                    routing_key=self.routing_key,
+                    body=body,
+                )
+            except pika.exceptions.AMQPError as e:
+                logging.error('[RabbitMQBroker] Unable to publish: %r', e)
+                self.connection, self.channel = None, None
+                self._retry_queue.extend(bodies[i:])
+                self._publish_errors.inc(len(bodies) - i)
+                return False
+            if not delivered:
+                self._retry_queue.append(body)
+                self._publish_errors.inc()
+        if self._retry_queue:
+            logging.warning(
+                '[RabbitMQBroker] %d messages not confirmed, will retry',
+                len(self._retry_queue),
             )
-            return True
-        return False
+            return False
+        return True
+
+    def _declare_queue(self):
+        if self.queue:
+            self.channel.queue_declare(queue=self.queue, durable=self.durable)
+            queue = self.queue
+        else:
+            result = self.channel.queue_declare(exclusive=True)
+            queue = result.method.queue
+        self.channel.queue_bind(
+            exchange=self.exchange,
+            queue=queue,
+            routing_key=self.routing_key,
+        )
+        return queue
 
     def start_consuming(self, callback):
         if self.connection is None or self.channel is None:
-            self.connect()
+            self.reconnect()
         if self.connection is not None and not self.connection.is_closed:
-            result = self.channel.queue_declare(exclusive=True)
-            queue = result.method.queue
-            self.channel.queue_bind(
-                exchange=self.exchange,
-                queue=queue,
-                routing_key=self.routing_key,
-            )
+            queue = self._declare_queue()
+            if self.prefetch_count:
+                self.channel.basic_qos(prefetch_count=self.prefetch_count)
             self.channel.basic_consume(callback, queue=queue, no_ack=True)
             self.channel.start_consuming()
+
+    def start_consuming_batches(self, callback):
+        if self.connection is None or self.channel is None:
+            self.reconnect()
+        if self.connection is None or self.connection.is_closed:
+            return
+        queue = self._declare_queue()
+        self.channel.basic_qos(
+            prefetch_count=max(self.prefetch_count, self.consume_batch_size)
+        )
+        bodies, delivery_tag, started_at = [], None, None
+        messages = self.channel.consume(
+            queue, inactivity_timeout=self.consume_timeout
+        )
+        try:
+            for method, _, body in messages:
+                if method is not None:
+                    if not bodies:
+                        started_at = time.time()
+                    bodies.append(body)
+                    delivery_tag = method.delivery_tag
+                if bodies and (
+                    method is None or
+                    len(bodies) >= self.consume_batch_size or
+                    time.time() - started_at >= self.consume_timeout
+                ):
+                    callback(bodies)
+                    self.channel.basic_ack(
+                        delivery_tag=delivery_tag, multiple=True
+                    )
+                    bodies = []
+        finally:
+            if not self.connection.is_closed:
+                self.channel.cancel()
+
+
+class QueueBroker(Broker):
+    '''The QueueBroker delivers messages between a meter and a simulator
+    running in the same process (e.g. ``pvsim pipeline``) through an in-memory
+    queue. Brokers created with the same ``name`` share the queue.
+
+    :param name: name of the queue
+    :param maxsize: maximum number of queued messages, 0 means unbounded;
+        publishing blocks while the queue is full
+    :param consume_batch_size: number of messages per batch when consuming
+        batches
+    :param poll_interval: how often, in seconds, consumers check whether
+        they were disconnected
+    '''
+
+    _queues = {}
+    _queues_lock = threading.Lock()
+
+    def __init__(self, name='pvsim', maxsize=0, consume_batch_size=1,
+                 poll_interval=0.5):
+        self.name = name
+        self.maxsize = int(maxsize)
+        self.consume_batch_size = int(consume_batch_size)
+        self.poll_interval = poll_interval
+        self.connect()
+
+    def connect(self):
+        with self._queues_lock:
+            if self.name not in self._queues:
+                self._queues[self.name] = queue.Queue(self.maxsize)
+            self.queue = self._queues[self.name]
+        self._consuming = False
+        metrics.gauge(
+            'pvsim_broker_queue_messages', 'Messages waiting in the queue'
+        ).set_function(self.queue.qsize)
+
+    def disconnect(self):
+        self._consuming = False
+
+    def publish(self, body):
+        if not isinstance(body, bytes):
+            body = body.encode()
+        self.queue.put(body)
+        return True
+
+    def _get(self):
+        while self._consuming:
+            try:
+                return self.queue.get(timeout=self.poll_interval)
+            except queue.Empty:
+                continue
+
+    def start_consuming(self, callback):
+        self._consuming = True
+        while True:
+            body = self._get()
+            if body is None:
+                return
+            callback(None, None, None, body)
+
+    def start_consuming_batches(self, callback):
+        self._consuming = True
+        while True:
+            body = self._get()
+            if body is None:
+                return
+            bodies = [body]
+            while len(bodies) < self.consume_batch_size:
+                try:
+                    bodies.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            callback(bodies)
+
+
+class UnixSocketBroker(Broker):
+    '''The UnixSocketBroker delivers messages between local processes through
+    a Unix domain socket: the simulator listens on ``path`` and meters connect
+    to it. Messages are framed with a 4-byte length prefix, and
+    ``publish_many`` sends all frames with a single system call.
+
+    :param path: path of the Unix domain socket
+    :param consume_batch_size: number of messages per batch when consuming
+        batches
+    :param poll_interval: how often, in seconds, consumers check whether
+        they were disconnected
+    '''
+
+    header = struct.Struct('>I')
+
+    def __init__(self, path='/tmp/pvsim.sock', consume_batch_size=1,
+                 poll_interval=0.5):
+        self.path = path
+        self.consume_batch_size = int(consume_batch_size)
+        self.poll_interval = poll_interval
+        self.socket = None
+        self._consuming = False
+
+    def connect(self):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.socket.connect(self.path)
+        except socket.error as e:
+            self.socket.close()
+            self.socket = None
+            logging.error(
+                '[UnixSocketBroker] Unable to connect to %s: %s', self.path, e
+            )
+
+    def disconnect(self):
+        if self._consuming:
+            self._consuming = False  # the consuming loop closes its sockets
+        elif self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    def _frame(self, body):
+        if not isinstance(body, bytes):
+            body = body.encode()
+        return self.header.pack(len(body)) + body
+
+    def _send(self, data):
+        if self.socket is None:
+            self.connect()
+        if self.socket is None:
+            return False
+        try:
+            self.socket.sendall(data)
+        except socket.error as e:
+            logging.error('[UnixSocketBroker] Unable to publish: %s', e)
+            self.disconnect()
+            return False
+        return True
+
+    def publish(self, body):
+        return self._send(self._frame(body))
+
+    def publish_many(self, bodies):
+        return self._send(b''.join([self._frame(body) for body in bodies]))
+
+    def _listen(self):
+        try:
+            os.unlink(self.path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(self.path)
+        self.socket.listen(16)
+
+    def _unpack(self, buffer):
+        bodies, offset = [], 0
+        while len(buffer) - offset >= self.header.size:
+            length, = self.header.unpack_from(buffer, offset)
+            end = offset + self.header.size + length
+            if len(buffer) < end:
+                break
+            bodies.append(bytes(buffer[offset + self.header.size:end]))
+            offset = end
+        del buffer[:offset]
+        return bodies
+
+    def _consume(self, handle_bodies):
+        self._listen()
+        listener = self.socket
+        buffers = {}
+        self._consuming = True
+        try:
+            while self._consuming:
+                readable, _, _ = select.select(
+                    [listener] + list(buffers), [], [], self.poll_interval
+                )
+                for sock in readable:
+                    if sock is listener:
+                        connection, _ = listener.accept()
+                        buffers[connection] = bytearray()
+                        continue
+                    data = sock.recv(65536)
+                    if not data:
+                        sock.close()
+                        del buffers[sock]
+                        continue
+                    buffers[sock].extend(data)
+                    handle_bodies(self._unpack(buffers[sock]))
+        finally:
+            for sock in buffers:
+                sock.close()
+            listener.close()
+            self.socket = None
+            os.unlink(self.path)
+
+    def start_consuming(self, callback):
+        def handle_bodies(bodies):
+            for body in bodies:
+                callback(None, None, None, body)
+        self._consume(handle_bodies)
+
+    def start_consuming_batches(self, callback):
+        def handle_bodies(bodies):
+            for i in range(0, len(bodies), self.consume_batch_size):
+                callback(bodies[i:i + self.consume_batch_size])
+        self._consume(handle_bodies)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of pvsim.
+# https://github.com/scorphus/pvism
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/MIT-license
+# Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
+
+import time
+
+from datetime import datetime, timedelta
+
+try:
+    from time import monotonic
+except ImportError:
+    from time import time as monotonic  # Python 2 has no monotonic clock
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    ZoneInfo = None  # Python < 3.9, only the system time zone is available
+
+
+def seconds_of_day(localtime):
+    '''Seconds since the beginning of the day of an ISO 8601 local time such
+    as ``2017-11-06T12:00:00``, or ``None`` if it carries no time of day
+    '''
+    try:
+        return (
+            int(localtime[11:13]) * 3600 +
+            int(localtime[14:16]) * 60 +
+            int(localtime[17:19])
+        )
+    except (TypeError, ValueError):
+        return None
+
+
+class Clock(object):
+    '''Clocks tell the current time and convert timestamps (seconds since the
+    epoch) into seconds since the beginning of the local day and ISO 8601
+    local times. Conversions are cached per day, so on days without a DST
+    transition they're just arithmetic.
+
+    :param timezone: IANA time zone name (e.g. ``Europe/Berlin``); the system
+        time zone is used if empty
+    '''
+
+    def __init__(self, timezone=None):
+        if timezone and ZoneInfo is None:
+            raise ValueError('time zones require Python 3.9+')
+        self.timezone = ZoneInfo(timezone) if timezone else None
+        self._day = None  # (day start, next day start, date prefix)
+
+    def now(self):
+        raise NotImplementedError('now should be implemented by subclass')
+
+    def _datetime(self, timestamp):
+        return datetime.fromtimestamp(timestamp, self.timezone)
+
+    def _epoch(self, dt):
+        if dt.tzinfo is None:
+            return time.mktime(dt.timetuple())
+        return dt.timestamp()  # aware datetimes only exist with zoneinfo
+
+    def _load_day(self, timestamp):
+        dt = self._datetime(timestamp)
+        midnight = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+        next_midnight = datetime.combine(
+            midnight.date() + timedelta(days=1), midnight.time()
+        ).replace(tzinfo=midnight.tzinfo)
+        day_start, next_day_start = (
+            self._epoch(midnight), self._epoch(next_midnight)
+        )
+        if next_day_start - day_start != 24 * 3600:
+            self._day = None  # DST transition, no shortcuts today
+            return dt
+        self._day = day_start, next_day_start, midnight.date().isoformat()
+        return dt
+
+    def _day_of(self, timestamp):
+        '''The cached day of ``timestamp``, or its ``datetime`` if there's a
+        DST transition on that day
+        '''
+        day = self._day
+        if day is not None and day[0] <= timestamp < day[1]:
+            return day, None
+        dt = self._load_day(timestamp)
+        return self._day, dt
+
+    def seconds(self, timestamp=None):
+        '''Seconds since the beginning of the local day of ``timestamp``
+        (defaults to now)
+        '''
+        if timestamp is None:
+            timestamp = self.now()
+        day, dt = self._day_of(timestamp)
+        if day is None:
+            return dt.hour * 3600 + dt.minute * 60 + dt.second
+        return int(timestamp - day[0])
+
+    def day_of_year(self, timestamp=None):
+        '''Day of the year of ``timestamp`` (defaults to now)'''
+        if timestamp is None:
+            timestamp = self.now()
+        return self._datetime(timestamp).timetuple().tm_yday
+
+    def seconds_and_localtime(self, timestamp=None):
+        '''Seconds since the beginning of the local day and ISO 8601 local time
+        of ``timestamp`` (defaults to now)
+        '''
+        if timestamp is None:
+            timestamp = self.now()
+        day, dt = self._day_of(timestamp)
+        if day is None:
+            seconds = dt.hour * 3600 + dt.minute * 60 + dt.second
+            dt = dt.replace(microsecond=0, tzinfo=None)
+            return seconds, dt.isoformat()
+        seconds = int(timestamp - day[0])
+        hours, rest = divmod(seconds, 3600)
+        minutes, secs = divmod(rest, 60)
+        return seconds, '{}T{:02d}:{:02d}:{:02d}'.format(
+            day[2], hours, minutes, secs
+        )
+
+
+class RealClock(Clock):
+    '''The wall clock'''
+
+    def now(self):
+        return time.time()
+
+
+class SimulatedClock(Clock):
+    '''A clock that starts at ``start`` and runs ``speed`` times faster than
+    the wall clock (e.g. 3600 runs a day in 24 minutes)
+
+    :param start: ISO 8601 local time or ``datetime`` to start at; now if
+        empty
+    :param speed: how many simulated seconds pass per wall clock second
+    :param timezone: IANA time zone name; the system time zone if empty
+    '''
+
+    def __init__(self, start=None, speed=1, timezone=None):
+        super(SimulatedClock, self).__init__(timezone)
+        self.speed = float(speed)
+        if self.speed <= 0:
+            raise ValueError('inappropriate value for speed')
+        if start is None:
+            self.start = time.time()
+        else:
+            if not isinstance(start, datetime):
+                start = datetime.strptime(start, '%Y-%m-%dT%H:%M:%S')
+            if start.tzinfo is None and self.timezone is not None:
+                start = start.replace(tzinfo=self.timezone)
+            self.start = self._epoch(start)
+        self._started_at = monotonic()
+
+    def now(self):
+        return self.start + (monotonic() - self._started_at) * self.speed
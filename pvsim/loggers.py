@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of pvsim.
+# https://github.com/scorphus/pvism
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/MIT-license
+# Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
+
+import atexit
+import json
+import logging
+import os
+
+from datetime import datetime
+
+try:
+    from time import monotonic
+except ImportError:
+    from time import time as monotonic  # Python 2
+
+try:
+    from logging.handlers import QueueHandler, QueueListener
+    from queue import Queue
+except ImportError:
+    QueueHandler = None  # Python 2 logs synchronously
+
+
+#: How sampled loggers created from now on sample their messages, see
+# ``SampledLogger``; set from the command line by ``main.set_log_level``
+sampling = {'every': 1, 'per_second': 0, 'summary_interval': 10}
+
+_settings = None  # arguments of the last call to configure
+_handler = None  # handler installed on the root logger
+_listener = None  # thread emitting the records queued by _handler
+
+
+class SampledLogger(object):
+    '''The SampledLogger logs the messages of a hot path, such as one per
+    readout, keeping only every ``every``-th message and at most
+    ``per_second`` messages a second. Nothing is done while ``level`` is
+    disabled, and arguments are only formatted for the messages kept. While
+    sampling, a summary of the messages seen is logged with the first message
+    after every ``summary_interval`` seconds.
+
+    Counts aren't locked: loggers shared by threads may miscount slightly.
+
+    :param name: what the messages are about, as in ``[PVSimulator] Received``
+    :param every: keep one message out of this many
+    :param per_second: keep at most this many messages a second; 0 for no
+        limit
+    :param summary_interval: seconds between summaries
+    :param level: level of the messages and summaries
+    '''
+
+    def __init__(self, name, every=None, per_second=None,
+                 summary_interval=None, level=logging.INFO):
+        self.name = name
+        self.every = max(int(sampling['every'] if every is None else every), 1)
+        self.per_second = float(
+            sampling['per_second'] if per_second is None else per_second
+        )
+        self.summary_interval = float(
+            sampling['summary_interval'] if summary_interval is None
+            else summary_interval
+        )
+        self.level = level
+        self.logger = logging.getLogger()  # the root logger, as logging.info
+        self.seen = 0
+        self.logged = 0
+        self._last_logged_at = None
+        self._summary = None  # (time, seen, logged) of the last summary
+
+    @property
+    def sampling(self):
+        return self.every > 1 or self.per_second > 0
+
+    def log(self, msg, *args, **fields):
+        '''Log ``msg % args`` if it's kept; ``fields`` are added to the
+        records, and show up as keys of their JSON objects
+        '''
+        if not self.logger.isEnabledFor(self.level):
+            return
+        if not self.sampling:
+            self.seen += 1
+            self._emit(msg, args, fields)
+            return
+        now = monotonic()
+        if self._summary is None:
+            self._summary = now, self.seen, self.logged
+        elif now - self._summary[0] >= self.summary_interval:
+            self.summarize(now)
+        self.seen += 1
+        if (self.seen - 1) % self.every:
+            return
+        if self.per_second:
+            if self._last_logged_at is not None and (
+                now - self._last_logged_at < 1 / self.per_second
+            ):
+                return
+            self._last_logged_at = now
+        self._emit(msg, args, fields)
+
+    def _emit(self, msg, args, fields):
+        self.logged += 1
+        extra = {'fields': fields} if fields else None
+        self.logger.log(self.level, msg, *args, extra=extra)
+
+    def summarize(self, now=None):
+        if now is None:
+            now = monotonic()
+        started_at, seen, logged = self._summary or (now, 0, 0)
+        seen, logged = self.seen - seen, self.logged - logged
+        seconds = now - started_at
+        self._summary = now, self.seen, self.logged
+        if not seen:
+            return
+        self.logger.log(
+            self.level, '%s %d messages in %.1fs, logged %d', self.name, seen,
+            seconds, logged,
+            extra={'fields': {
+                'seen': seen, 'logged': logged, 'seconds': seconds,
+            }},
+        )
+
+
+class JSONFormatter(logging.Formatter):
+    '''Formats records as JSON objects, one a line, with the fields given to
+    ``SampledLogger.log`` as additional keys
+    '''
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(),
+            'level': record.levelname,
+            'process': record.processName,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for key, value in (getattr(record, 'fields', None) or {}).items():
+            entry.setdefault(key, value)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+FORMATTERS = {
+    'text': lambda: logging.Formatter('%(asctime)s %(levelname)s %(message)s'),
+    'json': JSONFormatter,
+}
+
+
+if QueueHandler is not None:
+    class LazyQueueHandler(QueueHandler):
+        '''Queues records as they are, so they are formatted by the listener
+        thread instead of the logging one; logged arguments must not be
+        changed afterwards, and pvsim's aren't
+        '''
+
+        def prepare(self, record):
+            return record
+
+
+def configure(level=logging.WARNING, log_format='text', asynchronous=True):
+    '''Log records of ``level`` and above to stderr, formatted as ``text`` or
+    ``json``. Records are emitted by a listener thread, so that writing them
+    never blocks the logging thread, unless ``asynchronous`` is false (or on
+    Python 2). Calling it again replaces the previous configuration.
+    '''
+    global _settings, _handler, _listener
+    if log_format not in FORMATTERS:
+        raise ValueError('inappropriate value for log format')
+    stop()
+    _settings = level, log_format, asynchronous
+    handler = logging.StreamHandler()
+    handler.setFormatter(FORMATTERS[log_format]())
+    if asynchronous and QueueHandler is not None:
+        queue = Queue()
+        _listener = QueueListener(queue, handler)
+        _listener.start()
+        _listener._thread.name = 'log-listener'  # not sampled by profilers
+        handler = LazyQueueHandler(queue)
+    _handler = handler
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
+
+
+def stop():
+    '''Emit the queued records and remove the handler installed by
+    ``configure``
+    '''
+    global _handler, _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+        _handler = None
+
+
+def _after_fork():
+    global _listener
+    if _settings is not None and _listener is not None:
+        _listener = None  # its thread didn't survive the fork
+        configure(*_settings)
+
+
+atexit.register(stop)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -8,18 +8,22 @@
 # http://www.opensource.org/licenses/MIT-license
 # Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
 
+import copy
+import importlib
 import logging
+import multiprocessing
 import sys
+import threading
 import toml
 
-from pvsim import __version__
+from pvsim import __version__, loggers, metrics
 from pvsim.argparser import ArgParser
+from pvsim.writers import ThreadedWriter
 
 
 def import_class(import_path):
-    path_parts = import_path.split('.')
-    module_path, class_ = '.'.join(path_parts[:-1]), path_parts[-1]
-    module = __import__(module_path)
+    module_path, class_ = import_path.rsplit('.', 1)
+    module = importlib.import_module(module_path)
     return getattr(module, class_)
 
 
@@ -45,35 +49,282 @@ def load_config(config_file):
         sys.exit(1)
 
 
+def simulate_time(config, speed=None, start=None):
+    '''A copy of ``config`` whose clock is a ``SimulatedClock`` running
+    ``speed`` times faster from ``start``; the time zone is kept
+    '''
+    if speed is None and start is None:
+        return config
+    config = copy.deepcopy(config)
+    parameters = config.get('clock', {}).get('parameters', {})
+    parameters = {
+        key: value for key, value in parameters.items() if key == 'timezone'
+    }
+    if speed is not None:
+        parameters['speed'] = speed
+    if start is not None:
+        parameters['start'] = start
+    config['clock'] = {
+        'class': 'pvsim.clocks.SimulatedClock',
+        'parameters': parameters,
+    }
+    return config
+
+
+def start_metrics(config, worker=None):
+    '''Enable metrics and serve them over HTTP if there's a ``[metrics]``
+    section and they're not enabled yet; workers serve on consecutive ports.
+    Components only report metrics if they're created afterwards.
+    '''
+    if 'metrics' not in config or metrics.enabled():
+        return None
+    metrics_config = config['metrics']
+    metrics.enable()
+    try:
+        server = metrics.MetricsServer(
+            metrics_config.get('host', '127.0.0.1'),
+            int(metrics_config.get('port', 9464)) + (worker or 0),
+        )
+    except (IOError, OSError) as e:
+        logging.error('[main] Could not serve metrics: %s', e)
+        return None
+    server.start()
+    return server
+
+
+def instantiate_clock(config):
+    '''The clock configured in ``[clock]``, if any'''
+    if 'clock' in config:
+        return instantiate_component('clock', config)
+
+
+def instantiate_writer(config):
+    '''The writer configured in ``[writer]``, handed rows over on a thread of
+    its own if ``[writer.thread]`` is set (see ``ThreadedWriter``)
+    '''
+    writer = instantiate_component('writer', config)
+    thread = config.get('writer', {}).get('thread')
+    if thread is None:
+        return writer
+    return ThreadedWriter(writer, **thread)
+
+
+def check_durability(broker, writer):
+    '''Exit if ``broker`` acknowledges batches whose rows ``writer`` can't
+    make durable first (see ``Writer.durable_sync``)
+    '''
+    if not writer.durable_sync and broker.acks_batches and (
+        broker.consume_batch_size > 1
+    ):
+        logging.error(
+            '[main] %s can\'t store rows durably before their messages are '
+            'acknowledged: set consume_batch_size = 1 in broker parameters '
+            'or use another writer', type(writer).__name__,
+        )
+        sys.exit(1)
+
+
 def run_meter(config):
+    start_metrics(config)
     measure = instantiate_component('measure', config)
     broker = instantiate_component('broker', config)
-    meter = instantiate_component(
-        'meter', config, measure=measure, broker=broker
-    )
+    init_kwargs = {'measure': measure, 'broker': broker}
+    clock = instantiate_clock(config)
+    if clock is not None:
+        init_kwargs['clock'] = clock
+    meter = instantiate_component('meter', config, **init_kwargs)
     logging.info('Starting meter...')
     meter.publish_periodically()
     logging.info('Meter stopped')
     broker.disconnect()
 
 
-def run_simulator(config):
+def shard_config(config, component, worker):
+    '''Return a copy of ``config`` where every string parameter of
+    ``component``, in ``[component.parameters]`` and its other tables (such as
+    ``[writer.thread]``), has its ``{worker}`` placeholder replaced by
+    ``worker``
+    '''
+    config = copy.deepcopy(config)
+    for table in config.get(component, {}).values():
+        if not isinstance(table, dict):
+            continue
+        for name, value in table.items():
+            if hasattr(value, 'format'):
+                table[name] = value.format(worker=worker)
+    return config
+
+
+def run_simulator_worker(config, worker=None):
+    start_metrics(config, worker)
+    if worker is not None:
+        config = shard_config(config, 'writer', worker)
     simulator = instantiate_component('simulator', config)
-    writer = instantiate_component('writer', config)
+    writer = instantiate_writer(config)
     simulator.set_writer(writer)
+    clock = instantiate_clock(config)
+    if clock is not None:
+        simulator.set_clock(clock)
     logging.info('Starting simulator...')
     broker = instantiate_component('broker', config)
+    check_durability(broker, writer)
     simulator.consume_from_broker(broker)
     logging.info('Simulator stopped')
     broker.disconnect()
+    writer.close()
+
+
+def run_simulator_workers(config, workers):
+    broker_parameters = config.get('broker', {}).get('parameters', {})
+    if not broker_parameters.get('queue'):
+        logging.error(
+            '[main] Simulator workers need a shared queue: set a queue name '
+            'in broker parameters'
+        )
+        sys.exit(1)
+    writer_parameters = config.get('writer', {}).get('parameters', {})
+    if writer_parameters and not any(
+        '{worker}' in value for value in writer_parameters.values()
+        if hasattr(value, 'format')
+    ):
+        logging.error(
+            '[main] Simulator workers need an output each: set a `{worker}` '
+            'placeholder in a writer parameter, such as its filepath'
+        )
+        sys.exit(1)
+    spill_path = config.get('writer', {}).get('thread', {}).get('spill_path')
+    if spill_path and '{worker}' not in spill_path:
+        logging.error(
+            '[main] Simulator workers need a spill file each: set a '
+            '`{worker}` placeholder in the writer thread spill_path'
+        )
+        sys.exit(1)
+    processes = [
+        multiprocessing.Process(
+            target=run_simulator_worker,
+            args=(config, worker),
+            name='simulator-{}'.format(worker),
+        )
+        for worker in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    logging.info('Started %d simulator workers', workers)
+    for process in processes:
+        try:
+            process.join()
+        except KeyboardInterrupt:
+            process.join()
+
+
+def run_simulator(config):
+    workers = int(config.get('simulator', {}).get('workers', 1))
+    if workers > 1:
+        run_simulator_workers(config, workers)
+    else:
+        run_simulator_worker(config)
+
+
+def run_pipeline(config):
+    start_metrics(config)
+    simulator = instantiate_component('simulator', config)
+    writer = instantiate_writer(config)
+    simulator.set_writer(writer)
+    clock = instantiate_clock(config)
+    if clock is not None:
+        simulator.set_clock(clock)
+    simulator_broker = instantiate_component('broker', config)
+    check_durability(simulator_broker, writer)
+    consumer = threading.Thread(
+        target=simulator.consume_from_broker,
+        args=(simulator_broker,),
+        name='simulator',
+    )
+    consumer.daemon = True
+    consumer.start()
+    logging.info('Started simulator thread')
+    run_meter(config)
+    simulator_broker.disconnect()
+    consumer.join(5)
+    logging.info('Simulator stopped')
+    writer.close()
+
+
+def run_backfill(config):
+    measure = instantiate_component('measure', config)
+    simulator = instantiate_component('simulator', config)
+    writer = instantiate_component('writer', config)
+    backfiller = instantiate_component(
+        'backfill', config, measure=measure, simulator=simulator, writer=writer
+    )
+    logging.info('Starting backfill...')
+    count = backfiller.run()
+    writer.close()
+    logging.info('Backfill finished: %d rows written', count)
+
+
+def run_plot(config):
+    measure = instantiate_component('measure', config)
+    simulator = instantiate_component('simulator', config)
+    plotter = instantiate_component(
+        'plot', config, measure=measure, simulator=simulator
+    )
+    logging.info('Plotting...')
+    count = plotter.run()
+    logging.info('Plot written to %s: %d readings', plotter.output, count)
+
+
+def run_async(config, action):
+    start_metrics(config)
+    from pvsim import aio  # only importable on Python 3.5+
+    aio.run(config, action)
+
+
+def run_bench(parsed_args):
+    from pvsim.benchmarks import bench
+    if not bench(parsed_args.baseline, parsed_args.save_baseline):
+        sys.exit(1)
+
+
+def run_action(config, parsed_args, parser):
+    if parsed_args.asyncio and parsed_args.action in (
+        'meter', 'simulator', 'pipeline'
+    ):
+        run_async(config, parsed_args.action)
+    elif parsed_args.action == 'meter':
+        run_meter(config)
+    elif parsed_args.action == 'simulator':
+        run_simulator(config)
+    elif parsed_args.action == 'backfill':
+        run_backfill(config)
+    elif parsed_args.action == 'pipeline':
+        run_pipeline(config)
+    elif parsed_args.action == 'plot':
+        run_plot(config)
+    else:
+        logging.error('No such action: %s', parsed_args.action)
+        parser.print_usage()
+
+
+def start_profiler(parsed_args):
+    '''Start sampling stacks if ``--profile`` was given'''
+    if parsed_args.profile is None:
+        return None
+    from pvsim.profilers import SamplingProfiler
+    profiler = SamplingProfiler(
+        parsed_args.profile_output, duration=parsed_args.profile
+    )
+    profiler.start()
+    return profiler
 
 
 def set_log_level(parsed_args):
-    logger = logging.getLogger()
+    loggers.sampling['every'] = parsed_args.log_every
+    loggers.sampling['per_second'] = parsed_args.log_rate
     if parsed_args.verbose:
-        logger.setLevel(logging.INFO)
+        loggers.configure(logging.INFO, parsed_args.log_format)
     else:
-        logger.setLevel(logging.WARNING)
+        loggers.configure(logging.WARNING, parsed_args.log_format)
 
 
 def main():
@@ -84,16 +335,22 @@ def main():
         parser.print_help()
     elif parsed_args.version:
         parser.print_version(__version__)
+    elif parsed_args.action == 'bench':
+        run_bench(parsed_args)
     elif parsed_args.action:
-        config = load_config(parsed_args.config)
-        if parsed_args.action == 'meter':
-            run_meter(config)
-        elif parsed_args.action == 'simulator':
-            run_simulator(config)
-        elif parsed_args.action == 'plot':
-            logging.error('Not implemented yet, sorry')
-        else:
-            logging.error('No such action: %s', parsed_args.action)
-            parser.print_usage()
+        config = simulate_time(
+            load_config(parsed_args.config),
+            parsed_args.speed,
+            parsed_args.start,
+        )
+        profiler = start_profiler(parsed_args)
+        try:
+            run_action(config, parsed_args, parser)
+        except KeyboardInterrupt:
+            if profiler is None or not profiler.expired:
+                raise
+        finally:
+            if profiler is not None:
+                profiler.stop()
     else:
         parser.print_usage()
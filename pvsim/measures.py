@@ -8,13 +8,17 @@
 # http://www.opensource.org/licenses/MIT-license
 # Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
 
+import numpy
+
+from bisect import bisect_right
+from collections import OrderedDict
 from math import cos
-from pvsim.base import PowerCalc
+from pvsim.base import PowerCalc, check_random_state
 
 
 class Measure(object):
 
-    def readout(self):
+    def readout(self, timestamp=None):
         raise NotImplementedError('readout should be implemented by subclass')
 
 
@@ -33,6 +37,8 @@ class HPCMeasure(Measure, PowerCalc):
     :param lunch_end: average time when most people are done with lunch
     :param dinner_start: average time when people start coming back home
     :param dinner_end: average time when most people are in bed
+    :param seed: seed of the random noise, for reproducible readings
+    :param stream: substream of the random noise, see ``PowerCalc.set_seed``
     '''
 
     def __init__(
@@ -44,6 +50,8 @@ class HPCMeasure(Measure, PowerCalc):
         lunch_end=13*3600,
         dinner_start=17*3600,
         dinner_end=24*3600,
+        seed=None,
+        stream=0,
     ):
         self.max_power = max_power
         self.breakfast_start = int(breakfast_start)
@@ -55,6 +63,7 @@ class HPCMeasure(Measure, PowerCalc):
         self.dinner_start = int(dinner_start)
         self.dinner_end = int(dinner_end)
         self.dinner = dinner_end - dinner_start  # dinner duration
+        self.set_seed(seed, stream)
         self._validate()
 
     def _validate(self):
@@ -105,8 +114,237 @@ class HPCMeasure(Measure, PowerCalc):
             step, max_power, angle = self._values_at_dinner(seconds)
         return step + max_power * (1 - cos(angle)) / 2
 
+    def power_curve(self, seconds, random_state=None):
+        seconds = numpy.asarray(seconds, dtype=float)
+        before_breakfast = seconds < self.breakfast_start
+        breakfast = ~before_breakfast & (seconds <= self.breakfast_end)
+        idle = ~before_breakfast & ~breakfast & (
+            (seconds < self.lunch_start) |
+            ((self.lunch_end < seconds) & (seconds < self.dinner_start))
+        )
+        lunch = ~before_breakfast & ~breakfast & ~idle & (
+            seconds <= self.lunch_end
+        )
+        dinner = ~(before_breakfast | breakfast | idle | lunch)
+        factor = numpy.select([breakfast, lunch, dinner], [8, 6, 10], 20)
+        noise = self.random_array(seconds.shape, factor, random_state)
+        step = numpy.select(
+            [
+                before_breakfast,
+                breakfast & (
+                    seconds > self.breakfast_start + self.breakfast / 2
+                ),
+                breakfast,
+                dinner & (seconds > self.dinner_start + self.dinner / 2),
+            ],
+            [1000, 1500, 1000, 1000],
+            1500,
+        )
+        max_power = numpy.select(
+            [breakfast, lunch, dinner],
+            [self.max_power / 2.5, self.max_power / 4, self.max_power],
+        ) * noise - step
+        start = numpy.select(
+            [breakfast, lunch, dinner],
+            [self.breakfast_start, self.lunch_start, self.dinner_start],
+        )
+        duration = numpy.select(
+            [breakfast, lunch, dinner],
+            [self.breakfast, self.lunch, self.dinner],
+            1,
+        )
+        angle = self.get_angle(seconds, start, duration)
+        power = step + max_power * (1 - numpy.cos(angle)) / 2
+        return numpy.where(before_breakfast | idle, step * noise, power)
+
     def daylight_range(self, step=50):
         return range(self.breakfast_start, self.sunset, step)
 
-    def readout(self):
-        return self.current_power_and_time()
+    def readout(self, timestamp=None):
+        return self.current_power_and_time(timestamp)
+
+
+#: Relative likelihood of appliances being switched on at each hour of the
+# day, on weekdays and on weekends
+WEEKDAY_PROFILE = (
+    1, 1, 1, 1, 1, 2, 6, 8, 5, 3, 2, 2, 3, 2, 2, 3, 4, 7, 9, 9, 8, 6, 4, 2,
+)
+WEEKEND_PROFILE = (
+    1, 1, 1, 1, 1, 1, 2, 4, 6, 7, 6, 6, 6, 5, 4, 4, 5, 6, 8, 8, 7, 6, 4, 2,
+)
+
+#: Appliances of an average home: power draw (in watt), mean duration of
+# use (in seconds) and mean number of uses per weekday and weekend day.
+# Appliances with a flat profile are switched on at any time of the day.
+DEFAULT_APPLIANCES = (
+    {'name': 'fridge', 'power': 120, 'duration': 900, 'weekday': 40,
+     'weekend': 40, 'flat': True},
+    {'name': 'kettle', 'power': 2000, 'duration': 180, 'weekday': 3,
+     'weekend': 4},
+    {'name': 'microwave', 'power': 1000, 'duration': 300, 'weekday': 1.5,
+     'weekend': 2},
+    {'name': 'oven', 'power': 2400, 'duration': 2700, 'weekday': 0.4,
+     'weekend': 0.8},
+    {'name': 'dishwasher', 'power': 1800, 'duration': 5400, 'weekday': 0.6,
+     'weekend': 1},
+    {'name': 'washing machine', 'power': 2000, 'duration': 3600,
+     'weekday': 0.4, 'weekend': 1},
+    {'name': 'tumble dryer', 'power': 2500, 'duration': 3000,
+     'weekday': 0.2, 'weekend': 0.6},
+    {'name': 'television', 'power': 120, 'duration': 7200, 'weekday': 1.5,
+     'weekend': 3},
+    {'name': 'lighting', 'power': 200, 'duration': 10800, 'weekday': 1,
+     'weekend': 1.2},
+    {'name': 'computer', 'power': 150, 'duration': 10800, 'weekday': 1,
+     'weekend': 1.5},
+)
+
+
+class ApplianceMeasure(Measure, PowerCalc):
+    '''The ApplianceMeasure simulates the consumption of a home as the sum of
+    its appliances in use on top of a base load. Appliances are switched on
+    as Poisson arrivals, more likely at the busy hours of weekdays or
+    weekends, and draw power for an exponentially distributed duration.
+
+    The uses of all appliances in a day are drawn once and merged into a step
+    function of power over the day, so a reading is a binary search through
+    that day's power steps, however many appliances there are.
+
+    :param appliances: list of appliances, each one with ``power``,
+        ``duration``, ``weekday`` and ``weekend`` (mean uses per day) and
+        optionally ``flat``; see ``DEFAULT_APPLIANCES``
+    :param base_load: power drawn by appliances always on (in watt)
+    :param cache_days: number of days whose power steps are kept in memory
+    :param seed: seed of the random noise and appliance uses, for
+        reproducible readings; homes sharing a seed need different streams
+    :param stream: substream of the random noise, see ``PowerCalc.set_seed``
+    '''
+
+    def __init__(self, appliances=None, base_load=150, cache_days=2,
+                 seed=None, stream=0):
+        if appliances is None:
+            appliances = DEFAULT_APPLIANCES
+        self.appliances = [dict(appliance) for appliance in appliances]
+        self.base_load = base_load
+        self.cache_days = int(cache_days)
+        for appliance in self.appliances:
+            if appliance['power'] < 0 or appliance['duration'] <= 0:
+                raise ValueError('inappropriate values for appliance')
+        self._days = OrderedDict()
+        self._last_date = None, None  # (date prefix, days since the epoch)
+        self.set_seed(seed, stream)
+
+    def is_weekend(self, day):
+        return (day + 3) % 7 >= 5  # the epoch was a Thursday
+
+    def _uses(self, day, random_state):
+        '''Start, end and power of every appliance use on ``day``'''
+        weekend = self.is_weekend(day)
+        profile = numpy.array(WEEKEND_PROFILE if weekend else WEEKDAY_PROFILE)
+        profile = profile / profile.sum()
+        starts, ends, powers = [], [], []
+        for appliance in self.appliances:
+            rate = appliance['weekend' if weekend else 'weekday']
+            count = random_state.poisson(rate)
+            if not count:
+                continue
+            if appliance.get('flat'):
+                start = random_state.randint(0, self.day_length, count)
+            else:
+                hours = random_state.choice(24, count, p=profile)
+                start = hours * 3600 + random_state.randint(0, 3600, count)
+            duration = random_state.exponential(appliance['duration'], count)
+            starts.append(start)
+            ends.append(numpy.minimum(start + duration, self.day_length))
+            powers.append(
+                appliance['power'] * random_state.uniform(0.9, 1.1, count)
+            )
+        if not starts:
+            return numpy.empty(0), numpy.empty(0), numpy.empty(0)
+        return (
+            numpy.concatenate(starts),
+            numpy.concatenate(ends),
+            numpy.concatenate(powers),
+        )
+
+    def day(self, day):
+        '''Power steps of ``day`` (days since the epoch): the times in
+        seconds since the beginning of the day when the power drawn by
+        appliances changes, and the power from each one of them on, as arrays
+        and as lists (faster to search one reading at a time). They're drawn
+        once and cached.
+        '''
+        if day in self._days:
+            self._days[day] = self._days.pop(day)  # most recently used
+            return self._days[day]
+        if self.seed is None:
+            random_state = check_random_state(None)
+        else:
+            random_state = numpy.random.RandomState(
+                [self.seed, self.stream, day, 1]  # apart from daily_samples
+            )
+        starts, ends, powers = self._uses(day, random_state)
+        times = numpy.concatenate([[0], starts, ends])
+        changes = numpy.concatenate([[0], powers, -powers])
+        order = numpy.argsort(times, kind='mergesort')
+        times = times[order]
+        levels = numpy.maximum(numpy.cumsum(changes[order]), 0)
+        self._days[day] = times, levels, times.tolist(), levels.tolist()
+        while len(self._days) > self.cache_days:
+            self._days.popitem(last=False)
+        return self._days[day]
+
+    def day_of(self, localtime):
+        '''Days since the epoch of an ISO 8601 local time'''
+        prefix = localtime[:10]
+        if prefix != self._last_date[0]:
+            day = numpy.datetime64(prefix, 'D').astype(int)
+            self._last_date = prefix, int(day)
+        return self._last_date[1]
+
+    @property
+    def today(self):
+        return self.day_of(self.current_seconds_and_time()[1])
+
+    def appliances_power_at(self, seconds, day):
+        '''Power drawn by appliances at an array of ``seconds`` of ``day``'''
+        times, levels = self.day(day)[:2]
+        return levels[numpy.searchsorted(times, seconds, 'right') - 1]
+
+    def power_at(self, seconds, day=None):
+        if day is None:
+            day = self.today
+        times, levels = self.day(day)[2:]
+        return (
+            self.base_load * self.random(20) +
+            levels[bisect_right(times, seconds) - 1]
+        )
+
+    def power_curve(self, seconds, random_state=None):
+        seconds = numpy.asarray(seconds, dtype=float)
+        noise = self.random_array(seconds.shape, 20, random_state)
+        return (
+            self.base_load * noise +
+            self.appliances_power_at(seconds, self.today)
+        )
+
+    def power_curve_at(self, timestamps, random_state=None):
+        timestamps = numpy.asarray(timestamps, dtype='datetime64[s]')
+        if random_state is None and self.seed is not None:
+            random_state = self.random_state_at(timestamps)
+        days = timestamps.astype('datetime64[D]')
+        seconds = (timestamps - days).astype(int)
+        days = days.astype(int)
+        power = self.base_load * self.random_array(
+            timestamps.shape, 20, random_state
+        )
+        for day in numpy.unique(days):
+            in_day = days == day
+            power[in_day] += self.appliances_power_at(
+                seconds[in_day], int(day)
+            )
+        return power
+
+    def readout(self, timestamp=None):
+        seconds, localtime = self.current_seconds_and_time(timestamp)
+        return self.power_at(seconds, self.day_of(localtime)), localtime
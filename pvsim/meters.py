@@ -8,32 +8,200 @@
 # http://www.opensource.org/licenses/MIT-license
 # Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
 
-import json
 import logging
+import numpy
 import time
 
+from pvsim import loggers, metrics
+from pvsim.clocks import RealClock
+from pvsim.serializers import get_serializer
+
+try:
+    from time import monotonic
+except ImportError:
+    from time import time as monotonic  # Python 2 has no monotonic clock
+
 
 class GenericMeter(object):
+    '''The GenericMeter publishes readouts of a measure on tick boundaries
+    aligned to multiples of ``interval`` (sub-second intervals are fine).
+    Deadlines are kept on a monotonic clock, so publish latency doesn't drift
+    the schedule. When publishing falls behind, missed ticks are either
+    skipped (and counted in ``missed_ticks``) or caught up by publishing
+    back to back.
+
+    :param measure: measure to read from
+    :param broker: where readouts are published to
+    :param interval: interval between readouts in seconds
+    :param missed_tick_policy: either ``skip`` or ``catch-up``
+    :param serializer: wire format of readouts, ``json`` or ``binary``
+    :param clock: clock timestamping readouts, also set on the measure;
+        defaults to the wall clock
+    '''
+
+    missed_tick_policies = ('skip', 'catch-up')
 
-    def __init__(self, measure, broker, interval=2):
+    def __init__(self, measure, broker, interval=2, missed_tick_policy='skip',
+                 serializer='json', clock=None):
         self.measure = measure
         self.broker = broker
         self.interval = interval
+        self.missed_tick_policy = missed_tick_policy
+        self.missed_ticks = 0
+        self.serializer = get_serializer(serializer)
+        self.clock = RealClock() if clock is None else clock
+        if clock is not None:
+            measure.set_clock(clock)
+        if interval <= 0:
+            raise ValueError('inappropriate value for interval')
+        if missed_tick_policy not in self.missed_tick_policies:
+            raise ValueError('inappropriate value for missed tick policy')
+        self._publish_seconds = metrics.histogram(
+            'pvsim_meter_publish_seconds',
+            'Time spent reading and publishing readouts per tick',
+        )
+        self._readings = metrics.counter(
+            'pvsim_meter_readings_total', 'Readouts published'
+        )
+        self._failures = metrics.counter(
+            'pvsim_meter_publish_failures_total',
+            'Readouts the broker could not publish right away',
+        )
+        self._missed_ticks = metrics.counter(
+            'pvsim_meter_missed_ticks_total', 'Ticks skipped for being late'
+        )
+        self._sent_log = loggers.SampledLogger(
+            '[{}] Sent'.format(type(self).__name__)
+        )
 
     def publish(self):
-        power, localtime = self.measure.readout()
-        data = {
+        timestamp = self.clock.now()
+        power, localtime = self.measure.readout(timestamp)
+        reading = {
+            'timestamp': timestamp,
             'localtime': localtime,
             'power': power,
         }
-        if self.broker.publish(json.dumps(data)):
-            logging.info('[GenericMeter] Sent %s', data)
+        if self.broker.publish(self.serializer.encode(reading)):
+            self._readings.inc()
+            self._sent_log.log('[GenericMeter] Sent %s', reading)
+        else:
+            self._failures.inc()
+
+    def first_deadline(self):
+        '''Monotonic time of the next wall clock multiple of ``interval``'''
+        return monotonic() + self.interval - time.time() % self.interval
+
+    def next_deadline(self, deadline):
+        deadline += self.interval
+        behind = int((monotonic() - deadline) // self.interval)
+        if behind <= 0:
+            return deadline
+        if self.missed_tick_policy == 'skip':
+            self.missed_ticks += behind
+            self._missed_ticks.inc(behind)
+            logging.warning('[GenericMeter] Skipped %d missed ticks', behind)
+            return deadline + behind * self.interval
+        logging.warning('[GenericMeter] Catching up %d late ticks', behind)
+        return deadline
+
+    def sleep(self, delay):
+        '''Sleep for ``delay`` seconds, flushing the broker meanwhile whenever
+        its buffered messages reach their maximum latency
+        '''
+        due_in = self.broker.flush_due_in()
+        while due_in is not None and due_in < delay:
+            if due_in > 0:
+                time.sleep(due_in)
+                delay -= due_in
+            self.broker.flush()
+            due_in = self.broker.flush_due_in()
+        if delay > 0:
+            time.sleep(delay)
 
     def publish_periodically(self):
-        while True:
-            self.publish()
-            try:
-                time.sleep(self.interval)
-            except KeyboardInterrupt:
-                logging.info('[GenericMeter] Stoping...')
-                return
+        deadline = self.first_deadline()
+        try:
+            while True:
+                delay = deadline - monotonic()
+                if delay > 0:
+                    self.sleep(delay)
+                with self._publish_seconds.time():
+                    self.publish()
+                deadline = self.next_deadline(deadline)
+        except KeyboardInterrupt:
+            logging.info('[GenericMeter] Stoping...')
+
+
+class FleetMeter(GenericMeter):
+    '''The FleetMeter simulates a whole fleet of meters in a single process.
+    Every meter reads the same measure shifted by its own time offset and
+    scaled by its own factor, so all readings of a tick are computed in one
+    vectorized ``power_curve`` call and published with ``publish_many``.
+
+    :param measure: measure whose ``power_curve`` is shared by all meters
+    :param broker: where readings are published to
+    :param interval: interval between ticks in seconds
+    :param size: number of meters in the fleet
+    :param time_jitter: maximum time offset of a meter's schedule in seconds
+    :param power_jitter: maximum relative deviation of a meter's power
+    :param first_id: id of the first meter, the others follow sequentially
+    :param seed: seed for the jitter and noise of the fleet
+    :param missed_tick_policy: either ``skip`` or ``catch-up``
+    :param serializer: wire format of readouts, ``json`` or ``binary``
+    :param frame_size: number of readouts sent per message
+    :param clock: clock timestamping readouts, also set on the measure;
+        defaults to the wall clock
+    '''
+
+    def __init__(self, measure, broker, interval=2, size=1000,
+                 time_jitter=1800, power_jitter=0.2, first_id=0, seed=None,
+                 missed_tick_policy='skip', serializer='json', frame_size=1,
+                 clock=None):
+        super(FleetMeter, self).__init__(
+            measure, broker, interval, missed_tick_policy, serializer, clock
+        )
+        self.size = int(size)
+        self.frame_size = int(frame_size)
+        self.random_state = numpy.random.RandomState(seed)
+        self.meter_ids = list(range(first_id, first_id + self.size))
+        self.offsets = self.random_state.uniform(
+            -time_jitter, time_jitter, self.size
+        ).round()
+        self.scales = self.random_state.uniform(
+            1 - power_jitter, 1 + power_jitter, self.size
+        )
+
+    def readouts(self):
+        timestamp = self.clock.now()
+        seconds, localtime = self.measure.current_seconds_and_time(timestamp)
+        seconds = (seconds + self.offsets) % self.measure.day_length
+        powers = self.measure.power_curve(seconds, self.random_state)
+        powers *= self.scales
+        return [
+            {
+                'timestamp': timestamp,
+                'localtime': localtime,
+                'power': power,
+                'meter_id': meter_id,
+            }
+            for meter_id, power in zip(self.meter_ids, powers.tolist())
+        ]
+
+    def publish(self):
+        readings = self.readouts()
+        if self.frame_size > 1:
+            bodies = [
+                self.serializer.encode_many(readings[i:i + self.frame_size])
+                for i in range(0, len(readings), self.frame_size)
+            ]
+        else:
+            bodies = [self.serializer.encode(reading) for reading in readings]
+        if self.broker.publish_many(bodies):
+            self._readings.inc(len(readings))
+            self._sent_log.log(
+                '[FleetMeter] Sent %d readouts', len(readings),
+                readouts=len(readings),
+            )
+        else:
+            self._failures.inc(len(readings))
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of pvsim.
+# https://github.com/scorphus/pvism
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/MIT-license
+# Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
+
+import logging
+import threading
+
+from bisect import bisect_left
+
+try:
+    from time import monotonic
+except ImportError:
+    from time import time as monotonic  # Python 2
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # Python 2
+    from SocketServer import ThreadingMixIn
+
+
+#: Upper bounds of histogram buckets in seconds, from 10µs to 10s
+DEFAULT_BUCKETS = (
+    0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1,
+    5, 10,
+)
+
+
+class Timer(object):
+    '''Context manager observing the seconds spent in its block'''
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started_at = monotonic()
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(monotonic() - self.started_at)
+
+
+class Metric(object):
+    '''Metrics are registered by name in a ``Registry`` and rendered in the
+    Prometheus text format
+
+    :param name: name of the metric, e.g. ``pvsim_meter_readings_total``
+    :param help: description of the metric
+    '''
+
+    type = None
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+
+    def samples(self):
+        raise NotImplementedError('samples should be implemented by subclass')
+
+    def render(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.help),
+            '# TYPE {} {}'.format(self.name, self.type),
+        ]
+        for name, value in self.samples():
+            lines.append('{} {}'.format(name, repr(float(value))))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    '''A value that only goes up, such as a number of messages'''
+
+    type = 'counter'
+
+    def __init__(self, name, help):
+        super(Counter, self).__init__(name, help)
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        return [(self.name, self.value)]
+
+
+class Gauge(Metric):
+    '''A value that goes up and down, such as the depth of a queue. Instead of
+    being set, it can also be read from a function when rendered.
+    '''
+
+    type = 'gauge'
+
+    def __init__(self, name, help):
+        super(Gauge, self).__init__(name, help)
+        self.value = 0
+        self._function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            return [(self.name, self._function())]
+        return [(self.name, self.value)]
+
+
+class Histogram(Metric):
+    '''Observations, such as latencies, counted in buckets
+
+    :param buckets: upper bounds of the buckets, in increasing order
+    '''
+
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help)
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.sum = 0
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        return Timer(self)
+
+    def samples(self):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        samples, cumulative = [], 0
+        bounds = [repr(float(b)) for b in self.buckets] + ['+Inf']
+        for bound, count in zip(bounds, counts):
+            cumulative += count
+            samples.append(
+                ('{}_bucket{{le="{}"}}'.format(self.name, bound), cumulative)
+            )
+        samples.append(('{}_sum'.format(self.name), total))
+        samples.append(('{}_count'.format(self.name), cumulative))
+        return samples
+
+
+class NullMetric(object):
+    '''Stands for any metric while metrics are disabled, doing nothing'''
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def set_function(self, function):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def time(self):
+        return NULL_TIMER
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_METRIC = NULL_TIMER = NullMetric()
+
+
+class Registry(object):
+    '''Metrics by name; asking twice for a name returns the same metric'''
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, metric_class, name, help, **kwargs):
+        with self._lock:
+            if name not in self.metrics:
+                self.metrics[name] = metric_class(name, help, **kwargs)
+            return self.metrics[name]
+
+    def counter(self, name, help):
+        return self._get(Counter, name, help)
+
+    def gauge(self, name, help):
+        return self._get(Gauge, name, help)
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = sorted(self.metrics.values(), key=lambda m: m.name)
+        return ''.join(metric.render() + '\n' for metric in metrics)
+
+
+class NullRegistry(object):
+    '''Hands out ``NullMetric`` instances, so instrumented code costs next to
+    nothing while metrics are disabled
+    '''
+
+    def counter(self, name, help):
+        return NULL_METRIC
+
+    def gauge(self, name, help):
+        return NULL_METRIC
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        return NULL_METRIC
+
+    def render(self):
+        return ''
+
+
+#: Where components get their metrics from; metrics are disabled until
+# ``enable`` is called, and components only see it if they're created after
+registry = NullRegistry()
+
+
+def enable():
+    global registry
+    if not enabled():
+        registry = Registry()
+    return registry
+
+
+def disable():
+    global registry
+    registry = NullRegistry()
+
+
+def enabled():
+    return isinstance(registry, Registry)
+
+
+def counter(name, help):
+    return registry.counter(name, help)
+
+
+def gauge(name, help):
+    return registry.gauge(name, help)
+
+
+def histogram(name, help, buckets=DEFAULT_BUCKETS):
+    return registry.histogram(name, help, buckets)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug('[MetricsServer] ' + format, *args)
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    '''Serves metrics in the Prometheus text format at ``/metrics`` from a
+    daemon thread
+
+    :param host: address to listen on; keep it local unless it's protected
+    :param port: port to listen on, 0 picks a free one
+    '''
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=9464):
+        HTTPServer.__init__(self, (host, int(port)), MetricsHandler)
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.serve_forever, name='metrics'
+        )
+        self.thread.daemon = True
+        self.thread.start()
+        logging.info(
+            '[MetricsServer] Serving metrics on http://%s:%d/metrics',
+            *self.server_address[:2]
+        )
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of pvsim.
+# https://github.com/scorphus/pvism
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/MIT-license
+# Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
+
+import csv
+import logging
+import numpy
+
+from datetime import date, datetime
+from itertools import islice
+from pvsim.backfillers import Backfiller
+
+try:
+    from matplotlib.figure import Figure
+except ImportError:
+    Figure = None  # matplotlib is only required by Plotter
+
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None  # without pyarrow, files are read with the csv module
+
+
+class MinMaxDownsampler(object):
+    '''The MinMaxDownsampler reduces a stream of time series to the minimum and
+    maximum of each one of ``bins`` intervals of time (e.g. one per pixel
+    column of a plot), so memory is bounded however long the stream is. Bins
+    start ``bin_width`` seconds wide from the earliest timestamp of the first
+    chunk (earlier ones later on fall in the first bin) and are merged in
+    pairs, doubling their width, whenever the stream outgrows them.
+
+    :param bins: number of intervals of time
+    :param series: number of values at each timestamp
+    :param bin_width: initial width of the intervals in seconds
+    '''
+
+    def __init__(self, bins=1600, series=3, bin_width=1):
+        self.bins = int(bins) + int(bins) % 2  # merged in pairs
+        self.bin_width = max(int(bin_width), 1)
+        self.origin = None
+        self.count = 0
+        self.mins = numpy.full((self.bins, series), numpy.nan)
+        self.maxs = numpy.full((self.bins, series), numpy.nan)
+
+    def _merge(self):
+        half = self.bins // 2
+        mins = numpy.full_like(self.mins, numpy.nan)
+        maxs = numpy.full_like(self.maxs, numpy.nan)
+        mins[:half] = numpy.fmin(self.mins[0::2], self.mins[1::2])
+        maxs[:half] = numpy.fmax(self.maxs[0::2], self.maxs[1::2])
+        self.mins, self.maxs = mins, maxs
+        self.bin_width *= 2
+
+    def add(self, timestamps, values):
+        '''Add a chunk of ``numpy.datetime64`` timestamps and the values of
+        each series at them, as an array of one row per timestamp
+        '''
+        timestamps = numpy.asarray(timestamps, dtype='datetime64[s]')
+        if not len(timestamps):
+            return
+        timestamps = timestamps.astype(numpy.int64)
+        values = numpy.asarray(values, dtype=float).reshape(
+            len(timestamps), -1
+        )
+        if self.origin is None:
+            self.origin = int(timestamps.min())
+        offsets = numpy.maximum(timestamps - self.origin, 0)
+        while offsets.max() >= self.bin_width * self.bins:
+            self._merge()
+        indexes = offsets // self.bin_width
+        steps = numpy.diff(indexes)
+        if (steps >= 0).all():  # in order, as files and models are
+            starts = numpy.concatenate([[0], numpy.flatnonzero(steps) + 1])
+            bins = indexes[starts]
+            self.mins[bins] = numpy.fmin(
+                self.mins[bins], numpy.fmin.reduceat(values, starts)
+            )
+            self.maxs[bins] = numpy.fmax(
+                self.maxs[bins], numpy.fmax.reduceat(values, starts)
+            )
+        else:
+            numpy.fmin.at(self.mins, indexes, values)
+            numpy.fmax.at(self.maxs, indexes, values)
+        self.count += len(timestamps)
+
+    def envelope(self):
+        '''The middle time (``numpy.datetime64``) of every bin with values, and
+        the minimum and maximum of each series in them
+        '''
+        filled = ~numpy.isnan(self.mins).all(axis=1)
+        indexes = numpy.flatnonzero(filled)
+        if self.origin is None:
+            times = indexes
+        else:
+            times = self.origin + indexes * self.bin_width
+            times += self.bin_width // 2
+        return (
+            times.astype('datetime64[s]'),
+            self.mins[filled],
+            self.maxs[filled],
+        )
+
+
+def model_chunks(measure, simulator, start, end, step=1, chunk_size=86400):
+    '''Timestamps and consumed, generated and net power (in kW) at them, as
+    computed by the models a chunk at a time
+    '''
+    batches = Backfiller(
+        measure, simulator, None, start, end, step, chunk_size
+    ).batches()
+    for timestamps in batches:
+        consumed = measure.power_curve_at(timestamps) / 1000
+        generated = simulator.power_curve_at(timestamps) / 1000
+        yield timestamps, numpy.column_stack(
+            [consumed, generated, generated - consumed]
+        )
+
+
+def csv_chunks(filepath, chunk_size=86400):
+    '''Timestamps and powers of a CSV file written by ``CSVWriter``, read a
+    chunk at a time; pyarrow is used to parse it if it's installed
+    '''
+    if pyarrow is not None:
+        reader = pyarrow.csv.open_csv(
+            filepath,
+            read_options=pyarrow.csv.ReadOptions(
+                column_names=['localtime', 'consumed', 'generated', 'sum']
+            ),
+            convert_options=pyarrow.csv.ConvertOptions(
+                column_types={'localtime': pyarrow.timestamp('s')}
+            ),
+        )
+        for batch in reader:
+            yield _batch_arrays(batch)
+        return
+    with open(filepath) as fp:
+        reader = csv.reader(fp)
+        while True:
+            rows = list(islice(reader, chunk_size))
+            if not rows:
+                break
+            localtimes = [row[0] for row in rows]
+            yield (
+                numpy.array(localtimes, dtype='datetime64[s]'),
+                numpy.array([row[1:] for row in rows], dtype=float),
+            )
+
+
+def parquet_chunks(filepath, chunk_size=86400):
+    '''Timestamps and powers of a Parquet file written by ``ParquetWriter``,
+    read a chunk at a time
+    '''
+    if pyarrow is None:
+        raise ImportError('Parquet files require pyarrow to be installed')
+    parquet_file = pyarrow.parquet.ParquetFile(filepath)
+    for batch in parquet_file.iter_batches(batch_size=chunk_size):
+        yield _batch_arrays(batch)
+
+
+def _batch_arrays(batch):
+    localtimes = batch.column(0).to_numpy().astype('datetime64[s]')
+    powers = numpy.column_stack([
+        batch.column(i).to_numpy() for i in range(1, 4)
+    ])
+    return localtimes, powers
+
+
+class Plotter(object):
+    '''The Plotter renders consumed, generated and net power over time into a
+    PNG or SVG file (by the extension of ``output``), without a display.
+    Powers are either computed by the models or read from a CSV or Parquet
+    file written by the simulator, a chunk at a time, and downsampled to their
+    minimum and maximum at each pixel column: memory is bounded and a year of
+    readings plots as fast as it's read. Requires ``matplotlib``.
+
+    :param measure: the power consumption measure (e.g. ``HPCMeasure``)
+    :param simulator: the power generation simulator (e.g. ``PVSimulator``)
+    :param output: path of the image
+    :param filepath: CSV or Parquet file to plot instead of the models
+    :param start: beginning of the range of the models (ISO 8601 string or
+        ``datetime``); today if empty
+    :param end: end of the range of the models, exclusive; a day after
+        ``start`` if empty
+    :param step: interval between powers computed by the models in seconds
+    :param width: width of the image in pixels
+    :param height: height of the image in pixels
+    :param dpi: pixels per inch
+    :param chunk_size: number of powers computed or read at once
+    '''
+
+    labels = ('Consumed', 'Generated', 'Net')
+
+    def __init__(self, measure, simulator, output='pvsim.png', filepath=None,
+                 start=None, end=None, step=1, width=1600, height=900,
+                 dpi=100, chunk_size=86400):
+        if Figure is None:
+            raise ImportError('Plotter requires matplotlib to be installed')
+        self.measure = measure
+        self.simulator = simulator
+        self.output = output
+        self.filepath = filepath
+        if start is None:
+            start = date.today()
+        self.start = self._to_datetime64(start)
+        if end is None:
+            end = self.start + numpy.timedelta64(1, 'D')
+        self.end = self._to_datetime64(end)
+        self.step = int(step)
+        self.width = int(width)
+        self.height = int(height)
+        self.dpi = dpi
+        self.chunk_size = int(chunk_size)
+
+    def _to_datetime64(self, value):
+        if isinstance(value, datetime):
+            value = value.replace(tzinfo=None)
+        return numpy.datetime64(value, 's')
+
+    def chunks(self):
+        if self.filepath is None:
+            return model_chunks(
+                self.measure, self.simulator, self.start, self.end,
+                self.step, self.chunk_size,
+            )
+        if self.filepath.endswith('.parquet'):
+            return parquet_chunks(self.filepath, self.chunk_size)
+        return csv_chunks(self.filepath, self.chunk_size)
+
+    def downsample(self):
+        bin_width = 1
+        if self.filepath is None:
+            span = (self.end - self.start).astype(int)
+            bin_width = -(-span // self.width)
+        downsampler = MinMaxDownsampler(
+            self.width, len(self.labels), bin_width
+        )
+        for timestamps, powers in self.chunks():
+            downsampler.add(timestamps, powers)
+        return downsampler
+
+    def render(self, downsampler):
+        times, mins, maxs = downsampler.envelope()
+        figure = Figure(
+            figsize=(self.width / self.dpi, self.height / self.dpi),
+            dpi=self.dpi,
+        )
+        axes = figure.add_subplot(1, 1, 1)
+        x = numpy.repeat(times, 2)  # a vertical segment per pixel column
+        for i, label in enumerate(self.labels):
+            y = numpy.column_stack([mins[:, i], maxs[:, i]]).ravel()
+            axes.plot(x, y, lw=1, alpha=0.8, label=label)
+        axes.set_ylabel('Power (kW)')
+        axes.grid(alpha=0.3)
+        axes.legend()
+        figure.autofmt_xdate()
+        figure.savefig(self.output)
+
+    def run(self):
+        downsampler = self.downsample()
+        logging.info(
+            '[Plotter] Downsampled %d readings', downsampler.count
+        )
+        self.render(downsampler)
+        return downsampler.count
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of pvsim.
+# https://github.com/scorphus/pvism
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/MIT-license
+# Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
+
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+
+try:
+    from time import monotonic
+except ImportError:
+    from time import time as monotonic  # Python 2
+
+
+PACKAGE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+#: Pipeline stage of each pvsim module. Samples are tagged with the stage of
+# the innermost pvsim frame of their stack, so hot paths need no markers.
+MODULE_STAGES = {
+    'measures.py': 'measure',
+    'meters.py': 'schedule',
+    'simulators.py': 'compute',
+    'writers.py': 'write',
+}
+
+#: Functions of pvsim modules that belong to a stage other than the module's
+FUNCTION_STAGES = {
+    ('serializers.py', 'decode'): 'decode',
+    ('serializers.py', 'format_localtime'): 'decode',
+    ('serializers.py', 'serializer_for'): 'decode',
+    ('brokers.py', 'publish'): 'publish',
+    ('brokers.py', 'publish_many'): 'publish',
+    ('brokers.py', 'flush'): 'publish',
+    ('brokers.py', 'connect'): 'publish',
+    ('brokers.py', 'reconnect'): 'publish',
+}
+
+#: Stage of the other functions of modules with more than one stage
+DEFAULT_STAGES = {
+    'serializers.py': 'encode',
+    'brokers.py': 'consume',
+}
+
+#: Functions that wait when they're the innermost Python frame of a stack
+# (blocking C calls such as ``time.sleep`` don't have a frame of their own).
+# Their samples are tagged ``idle`` and left out of the report percentages.
+IDLE_FUNCTIONS = {
+    ('threading.py', 'wait'),  # conditions, events and so queues
+    ('threading.py', '_wait_for_tstate_lock'),  # Thread.join
+    ('selectors.py', 'select'),
+    ('select_connection.py', 'poll'),  # pika's ioloop
+    ('popen_fork.py', 'poll'),  # Process.join
+    ('meters.py', 'sleep'),  # GenericMeter.sleep waiting for the next tick
+}
+
+#: Names of pvsim's helper threads, which aren't sampled
+HELPER_THREADS = {'profiler', 'log-listener', 'metrics', 'compressor'}
+
+
+def is_idle(stack):
+    if not stack:
+        return False
+    code = stack[-1]
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FUNCTIONS
+
+
+def stage_of(stack):
+    '''Pipeline stage of a stack of code objects, outermost first'''
+    if is_idle(stack):
+        return 'idle'
+    for code in reversed(stack):
+        directory, module = os.path.split(code.co_filename)
+        if directory != PACKAGE_DIRECTORY:
+            continue
+        stage = FUNCTION_STAGES.get((module, code.co_name))
+        if stage is None:
+            stage = MODULE_STAGES.get(module, DEFAULT_STAGES.get(module))
+        if stage is not None:
+            return stage
+    return 'other'
+
+
+def frame_name(code):
+    module = os.path.basename(code.co_filename)
+    if module.endswith('.py'):
+        module = module[:-3]
+    return '{}:{}'.format(module, getattr(code, 'co_qualname', code.co_name))
+
+
+class SamplingProfiler(object):
+    '''The SamplingProfiler takes a sample of the stacks of all threads but
+    pvsim's helper ones every ``interval`` seconds from a daemon thread, so
+    the profiled code runs untouched. Every ``dump_interval`` seconds and when
+    stopped, it writes:
+
+    - ``<output>.folded``: stacks in the folded format of flame graph tools
+      (e.g. ``flamegraph.pl`` or speedscope), rooted at their pipeline stage
+    - ``<output>.txt``: samples per stage and per function, by self and
+      total (inclusive) samples; percentages are of the samples that
+      weren't ``idle`` (waiting or sleeping)
+
+    After ``duration`` seconds it interrupts the main thread and the child
+    processes (e.g. simulator workers), as Ctrl+C does.
+
+    :param output: path prefix of the files written
+    :param duration: seconds to profile for; 0 profiles until stopped
+    :param interval: seconds between samples
+    :param dump_interval: seconds between writing the files
+    '''
+
+    def __init__(self, output='pvsim-profile', duration=0, interval=0.005,
+                 dump_interval=10):
+        self.output = output
+        self.duration = duration
+        self.interval = interval
+        self.dump_interval = dump_interval
+        self.stacks = {}  # stack of code objects -> number of samples
+        self.samples = 0
+        self.expired = False
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        frames = sys._current_frames()
+        helpers = set(
+            thread.ident for thread in threading.enumerate()
+            if thread.name in HELPER_THREADS
+        )
+        with self._lock:
+            for thread_id, frame in frames.items():
+                if thread_id in helpers:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                stack = tuple(reversed(stack))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+    def folded(self):
+        '''Lines of ``stage;outer;...;inner count``'''
+        with self._lock:
+            stacks = list(self.stacks.items())
+        lines = []
+        for stack, count in stacks:
+            names = [stage_of(stack)] + [frame_name(c) for c in stack]
+            lines.append('{} {}'.format(';'.join(names), count))
+        return sorted(lines)
+
+    def stats(self):
+        '''Samples per stage, and self and total samples per function but
+        the idle ones
+        '''
+        with self._lock:
+            stacks = list(self.stacks.items())
+        stages, functions = {}, {}
+        for stack, count in stacks:
+            stage = stage_of(stack)
+            stages[stage] = stages.get(stage, 0) + count
+            if stage == 'idle':
+                continue
+            for code in set(stack):
+                name = frame_name(code)
+                own, total = functions.get(name, (0, 0))
+                functions[name] = own, total + count
+            if stack:
+                name = frame_name(stack[-1])
+                own, total = functions[name]
+                functions[name] = own + count, total
+        return stages, functions
+
+    def report(self, limit=50):
+        stages, functions = self.stats()
+        idle = stages.pop('idle', 0)
+        total = float(sum(stages.values()) or 1)
+        lines = ['{:>8} {:>7}  {}'.format('samples', '%', 'stage')]
+        for stage, count in sorted(stages.items(), key=lambda s: -s[1]):
+            lines.append('{:>8} {:>6.1f}%  {}'.format(
+                count, 100 * count / total, stage
+            ))
+        lines.append('{:>8} {:>7}  {}'.format(idle, '-', 'idle'))
+        lines.append('')
+        lines.append('{:>8} {:>7} {:>8} {:>7}  {}'.format(
+            'self', '%', 'total', '%', 'function'
+        ))
+        by_self = sorted(functions.items(), key=lambda f: (-f[1][0], f[0]))
+        for name, (own, inclusive) in by_self[:limit]:
+            lines.append('{:>8} {:>6.1f}% {:>8} {:>6.1f}%  {}'.format(
+                own, 100 * own / total, inclusive, 100 * inclusive / total,
+                name,
+            ))
+        return lines
+
+    def _write(self, path, lines):
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'w') as fp:
+            fp.write('\n'.join(lines) + '\n')
+        os.rename(temporary_path, path)  # readers never see partial files
+
+    def dump(self):
+        self._write(self.output + '.folded', self.folded())
+        self._write(self.output + '.txt', self.report())
+        logging.info(
+            '[SamplingProfiler] Wrote %d samples to %s.folded and %s.txt',
+            self.samples, self.output, self.output,
+        )
+
+    def _run(self):
+        started_at = last_dump = monotonic()
+        while not self._stopped.wait(self.interval):
+            self.sample()
+            now = monotonic()
+            if now - last_dump >= self.dump_interval:
+                self.dump()
+                last_dump = now
+            if self.duration and now - started_at >= self.duration:
+                self.expired = True
+                logging.info('[SamplingProfiler] Profiled for %ss, stopping',
+                             self.duration)
+                self.interrupt()
+                return
+
+    def interrupt(self):
+        '''Interrupt this process and its children, which Ctrl+C also reaches
+        but ``os.kill`` doesn't
+        '''
+        for child in multiprocessing.active_children():
+            os.kill(child.pid, signal.SIGINT)
+        os.kill(os.getpid(), signal.SIGINT)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='profiler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.dump()
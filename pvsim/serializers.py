@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of pvsim.
+# https://github.com/scorphus/pvism
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/MIT-license
+# Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
+
+import json
+import struct
+
+from datetime import datetime
+
+
+class Serializer(object):
+    '''Serializers turn readings into message bodies and back. A reading is a
+    dict with ``localtime`` (ISO 8601), ``power`` (in watt) and, optionally,
+    ``timestamp`` (seconds since the epoch) and ``meter_id``.
+
+    Not every broker carries message properties, so consumers tell formats
+    apart by the body itself, see ``serializer_for``.
+    '''
+
+    def encode(self, reading):
+        raise NotImplementedError('encode should be implemented by subclass')
+
+    def encode_many(self, readings):
+        raise NotImplementedError(
+            'encode_many should be implemented by subclass'
+        )
+
+    def decode(self, body, clock=None):
+        '''Return the list of readings in ``body``; ``clock`` converts epoch
+        timestamps into local times, in the system time zone if empty
+        '''
+        raise NotImplementedError('decode should be implemented by subclass')
+
+
+class JSONSerializer(Serializer):
+    '''Readings as JSON objects, several of them as a JSON array'''
+
+    def _message(self, reading):
+        message = {
+            'localtime': reading['localtime'],
+            'power': reading['power'],
+        }
+        if reading.get('timestamp') is not None:
+            message['timestamp'] = reading['timestamp']
+        if reading.get('meter_id') is not None:
+            message['meter_id'] = reading['meter_id']
+        return message
+
+    def encode(self, reading):
+        return json.dumps(self._message(reading))
+
+    def encode_many(self, readings):
+        return json.dumps([self._message(reading) for reading in readings])
+
+    def decode(self, body, clock=None):
+        message = json.loads(body.decode())
+        if isinstance(message, list):
+            return message
+        return [message]
+
+
+class BinarySerializer(Serializer):
+    '''Readings as fixed-width binary records, any number of them per frame.
+    A frame starts with the ``PVB`` magic, a version, the power format (``d``
+    for float64, ``f`` for float32) and the number of records; each record
+    holds the epoch timestamp (float64), the power and the meter id (uint32).
+
+    :param power_format: either ``d`` (float64) or ``f`` (float32)
+    '''
+
+    magic = b'PVB'
+    version = 1
+    header = struct.Struct('<3sBcI')
+
+    def __init__(self, power_format='d'):
+        if power_format not in ('d', 'f'):
+            raise ValueError('inappropriate value for power format')
+        self.power_format = power_format
+        self.record = struct.Struct('<d{}I'.format(power_format))
+        self._last_second, self._last_localtime = None, None
+        self._last_clock = None
+
+    def _pack(self, reading):
+        return self.record.pack(
+            reading['timestamp'],
+            reading['power'],
+            reading.get('meter_id') or 0,
+        )
+
+    def _frame(self, readings):
+        return self.header.pack(
+            self.magic,
+            self.version,
+            self.power_format.encode(),
+            len(readings),
+        ) + b''.join([self._pack(reading) for reading in readings])
+
+    def encode(self, reading):
+        return self._frame([reading])
+
+    def encode_many(self, readings):
+        return self._frame(readings)
+
+    def format_localtime(self, timestamp, clock=None):
+        second = int(timestamp)
+        if second != self._last_second or clock is not self._last_clock:
+            self._last_second, self._last_clock = second, clock
+            if clock is None:
+                self._last_localtime = datetime.fromtimestamp(
+                    second
+                ).isoformat()
+            else:
+                self._last_localtime = clock.seconds_and_localtime(second)[1]
+        return self._last_localtime
+
+    def decode(self, body, clock=None):
+        magic, version, power_format, count = self.header.unpack_from(body)
+        if magic != self.magic or version != self.version:
+            raise struct.error('not a version {} frame'.format(self.version))
+        if power_format not in (b'd', b'f'):
+            raise struct.error(
+                'unknown power format {!r}'.format(power_format)
+            )
+        record = self.record
+        if power_format.decode() != self.power_format:
+            record = struct.Struct('<d{}I'.format(power_format.decode()))
+        if len(body) != self.header.size + count * record.size:
+            raise struct.error('frame has an unexpected length')
+        readings = []
+        for offset in range(self.header.size, len(body), record.size):
+            timestamp, power, meter_id = record.unpack_from(body, offset)
+            readings.append({
+                'timestamp': timestamp,
+                'localtime': self.format_localtime(timestamp, clock),
+                'power': power,
+                'meter_id': meter_id,
+            })
+        return readings
+
+
+#: Serializers selectable by name from the configuration
+SERIALIZERS = {
+    'json': JSONSerializer,
+    'binary': BinarySerializer,
+}
+
+
+def get_serializer(name):
+    try:
+        return SERIALIZERS[name]()
+    except KeyError:
+        raise ValueError('no such serializer: {}'.format(name))
+
+
+_decoders = {}
+
+
+def serializer_for(body):
+    '''Return the serializer able to decode ``body``, recognized by the magic
+    at the start of binary frames; anything else is taken as JSON
+    '''
+    name = 'binary' if body[:3] == BinarySerializer.magic else 'json'
+    if name not in _decoders:
+        _decoders[name] = get_serializer(name)
+    return _decoders[name]
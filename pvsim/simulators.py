@@ -9,10 +9,16 @@
 # Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
 
 import logging
-import json
+import numpy
+import struct
 
-from math import cos
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from math import cos, radians
+from pvsim import loggers, metrics
 from pvsim.base import PowerCalc
+from pvsim.clocks import seconds_of_day
+from pvsim.serializers import serializer_for
 from pvsim.writers import StdoutWriter
 
 try:
@@ -29,16 +35,47 @@ class PVSimulator(PowerCalc):
     :param max_power: maximum power this PV system can generate (in Watt)
     :param sunrise: time of sunrise in seconds since the beginning of the day
     :param sunset: time of sunset in seconds since the beginning of the day
+    :param seed: seed of the random noise, for reproducible readings
+    :param stream: substream of the random noise, see ``PowerCalc.set_seed``
     '''
     _writer = None
+    _received_log = None
+    _profile = None
+    _profile_key = None
 
-    def __init__(self, max_power=3300, sunrise=6*3600, sunset=20.5*3600):
+    #: Whether batches are synced to storage before being acknowledged, set
+    # from the broker when consuming batches
+    sync_batches = False
+
+    def __init__(self, max_power=3300, sunrise=6*3600, sunset=20.5*3600,
+                 seed=None, stream=0):
         self.max_power = max_power
         self.sunrise = int(sunrise)
         self.sunset = int(sunset)
+        self.set_seed(seed, stream)
+        self._register_metrics()
         if sunset <= sunrise:
             raise ValueError('inappropriate values for sunrise and sunset')
-        self.light_hours = sunset - sunrise  # duration of daylight in seconds
+
+    def _register_metrics(self):
+        self._messages = metrics.counter(
+            'pvsim_simulator_messages_total', 'Messages received'
+        )
+        self._readings = metrics.counter(
+            'pvsim_simulator_readings_total', 'Readouts simulated'
+        )
+        self._decode_errors = metrics.counter(
+            'pvsim_simulator_decode_errors_total',
+            'Messages dropped for being malformed',
+        )
+        self._lag = metrics.gauge(
+            'pvsim_simulator_consume_lag_seconds',
+            'Time between the last readout and its simulation',
+        )
+
+    @property
+    def light_hours(self):
+        return self.sunset - self.sunrise  # duration of daylight in seconds
 
     @property
     def writer(self):
@@ -46,6 +83,14 @@ class PVSimulator(PowerCalc):
             self.set_writer(StdoutWriter())
         return self._writer
 
+    @property
+    def received_log(self):
+        if self._received_log is None:
+            self._received_log = loggers.SampledLogger(
+                '[PVSimulator] Received'
+            )
+        return self._received_log
+
     def power_at(self, seconds):
         if seconds < self.sunrise or seconds > self.sunset:
             return 0
@@ -53,36 +98,333 @@ class PVSimulator(PowerCalc):
         power = self.max_power * (1 - cos(angle)) / 2
         return power * self.random()
 
+    def power_curve(self, seconds, random_state=None):
+        seconds = numpy.asarray(seconds, dtype=float)
+        angle = self.get_angle(seconds, self.sunrise, self.light_hours)
+        power = self.max_power * (1 - numpy.cos(angle)) / 2
+        power *= self.random_array(seconds.shape, random_state=random_state)
+        dark = (seconds < self.sunrise) | (seconds > self.sunset)
+        power[dark] = 0
+        return power
+
+    @property
+    def profile(self):
+        '''The noiseless power at each second of the day, as ``float32``. It's
+        computed once and again only when the parameters change.
+        '''
+        key = (self.max_power, self.sunrise, self.sunset)
+        if self._profile_key != key:
+            seconds = numpy.arange(self.day_length)
+            angle = self.get_angle(seconds, self.sunrise, self.light_hours)
+            profile = self.max_power * (1 - numpy.cos(angle)) / 2
+            profile[(seconds < self.sunrise) | (seconds > self.sunset)] = 0
+            self._profile = profile.astype(numpy.float32)
+            self._profile_key = key
+        return self._profile
+
+    def cached_power_at(self, seconds):
+        '''Same as ``power_at``, looked up in the precomputed ``profile``'''
+        return float(self.profile[int(seconds) % self.day_length]) * (
+            self.random()
+        )
+
     def daylight_range(self, step=50):
         return range(self.sunrise, self.sunset, step)
 
-    def message_received(self, body):
-        logging.info('[PVSimulator] Received %s', body)
+    def generated_power_at(self, localtime, timestamp=None):
+        '''Generated power at the local time a reading was taken, so that
+        simulated time (see ``SimulatedClock``) carries over from the meter;
+        the current time is used if ``localtime`` has no time of day.
+        ``timestamp`` is the epoch time of the reading, if it has one
+        '''
+        seconds = seconds_of_day(localtime)
+        if seconds is None:
+            return self.cached_power_at(self.current_seconds())
+        return float(self.profile[seconds % self.day_length]) * (
+            self.random_at(localtime)
+        )
+
+    def _rows_from(self, body):
+        self._messages.inc()
         try:
-            message = json.loads(body.decode())
-            localtime = message['localtime']
-            consumed_power = message['power'] / 1000
-            generated_power, _ = self.current_power_and_time()
-            generated_power = generated_power / 1000
-            power_sum = generated_power - consumed_power
-            self.writer.write([
-                localtime, consumed_power, generated_power, power_sum
-            ])
-        except JSONDecodeError as e:
+            readings = serializer_for(body).decode(body, self.clock)
+            generated = {}  # readings in a frame mostly share their time
+            rows = []
+            for reading in readings:
+                localtime = reading['localtime']
+                if localtime not in generated:
+                    generated[localtime] = self.generated_power_at(
+                        localtime, reading.get('timestamp')
+                    ) / 1000
+                generated_power = generated[localtime]
+                consumed_power = reading['power'] / 1000
+                power_sum = generated_power - consumed_power
+                rows.append([
+                    localtime,
+                    consumed_power,
+                    generated_power,
+                    power_sum,
+                ])
+            self._readings.inc(len(rows))
+            if rows and metrics.enabled():
+                self._measure_lag(rows[-1][0])
+            return rows
+        except (JSONDecodeError, struct.error) as e:
             logging.error('[PVSimulator] Could not unpack message: %s', e)
         except KeyError as e:
             logging.error('[PVSimulator] Message is incomplete: %s', e)
         except TypeError as e:
             logging.error('[PVSimulator] Message is incompatible: %s', e)
+        self._decode_errors.inc()
+        return []
+
+    def _measure_lag(self, localtime):
+        seconds = seconds_of_day(localtime)
+        if seconds is not None:
+            lag = (self.current_seconds() - seconds) % self.day_length
+            self._lag.set(lag)
+
+    def message_received(self, body):
+        self.received_log.log('[PVSimulator] Received %s', body)
+        for row in self._rows_from(body):
+            self.writer.write(row)
+
+    def messages_received(self, bodies):
+        '''Handle a batch of messages at once; if the broker acknowledges
+        batches, rows are synced to storage by the writer (see
+        ``Writer.sync``) before returning, so that's safe
+        '''
+        self.received_log.log(
+            '[PVSimulator] Received %d messages', len(bodies),
+            messages=len(bodies),
+        )
+        rows = []
+        for body in bodies:
+            rows.extend(self._rows_from(body))
+        self.writer.write_many(rows)
+        if self.sync_batches:
+            self.writer.sync()
 
     def consume_from_broker(self, broker):
         def callback(*args):
             self.message_received(args[-1])
         try:
             logging.info('[PVSimulator] Waiting for readouts. Ctrl+C to stop.')
-            broker.start_consuming(callback)
+            if broker.consume_batch_size > 1:
+                self.sync_batches = broker.acks_batches
+                broker.start_consuming_batches(self.messages_received)
+            else:
+                broker.start_consuming(callback)
         except KeyboardInterrupt:
             logging.info('[PVSimulator] Stoping...')
+            self.writer.flush()  # drain rows still on their way to storage
 
     def set_writer(self, writer):
         self._writer = writer
+
+
+class SolarPVSimulator(PVSimulator):
+    '''The SolarPVSimulator simulates a photovoltaic power generator from the
+    position of the sun: solar declination and hour angle give the incidence
+    angle of beam radiation on the tilted panel, and a simple clear-sky model
+    gives the irradiance. Sunrise, sunset and the clear-sky curve of a day
+    only depend on its day of the year, so they're computed for the whole day
+    at once and kept in a cache of ``cache_days`` days.
+
+    :param max_power: power this PV system generates under 1000 W/m² (in Watt)
+    :param latitude: latitude of the system in degrees, north is positive
+    :param longitude: longitude of the system in degrees, east is positive
+    :param tilt: tilt of the panel from the horizontal in degrees
+    :param azimuth: azimuth the panel faces in degrees; 0 is facing the
+        equator, east is negative and west is positive
+    :param utc_offset: standard time zone offset from UTC in hours
+    :param cache_days: number of days whose curves are kept in memory
+    :param seed: seed of the random noise, for reproducible readings
+    :param stream: substream of the random noise, see ``PowerCalc.set_seed``
+    '''
+
+    solar_constant = 1353  # W/m²
+
+    def __init__(self, max_power=3300, latitude=52.52, longitude=13.40,
+                 tilt=30, azimuth=0, utc_offset=1, cache_days=32, seed=None,
+                 stream=0):
+        self.max_power = max_power
+        self.latitude = float(latitude)
+        self.longitude = float(longitude)
+        self.tilt = float(tilt)
+        self.azimuth = float(azimuth)
+        self.utc_offset = float(utc_offset)
+        self.cache_days = int(cache_days)
+        if not -90 <= self.latitude <= 90:
+            raise ValueError('inappropriate value for latitude')
+        if not 0 <= self.tilt <= 90:
+            raise ValueError('inappropriate value for tilt')
+        self._days = OrderedDict()
+        self._last_date = None, None  # (date prefix, day of the year)
+        self._last_standard_day = None, None  # (days since epoch, of year)
+        self.set_seed(seed, stream)
+        self._register_metrics()
+
+    @property
+    def surface_azimuth(self):
+        '''Azimuth of the panel from due south, east negative, as the
+        incidence formula takes it; south of the equator, ``azimuth`` 0 faces
+        due north
+        '''
+        if self.latitude < 0:
+            return 180 - self.azimuth
+        return self.azimuth
+
+    def declination(self, day_of_year):
+        angle = 2 * numpy.pi * (284 + day_of_year) / 365
+        return radians(23.45) * numpy.sin(angle)
+
+    def solar_time_correction(self, day_of_year):
+        '''Solar time minus local standard time, in seconds'''
+        b = 2 * numpy.pi * (day_of_year - 81) / 364
+        equation_of_time = (
+            9.87 * numpy.sin(2 * b) - 7.53 * numpy.cos(b) - 1.5 * numpy.sin(b)
+        )
+        standard_meridian = 15 * self.utc_offset
+        longitude_correction = 4 * (self.longitude - standard_meridian)
+        return 60 * (longitude_correction + equation_of_time)
+
+    def hour_angle(self, day_of_year, seconds):
+        solar_seconds = seconds + self.solar_time_correction(day_of_year)
+        return 2 * numpy.pi * (solar_seconds - self.day_length / 2) / (
+            self.day_length
+        )
+
+    def _sunrise_and_sunset(self, day_of_year):
+        latitude = radians(self.latitude)
+        cos_sunset_angle = -numpy.tan(latitude) * numpy.tan(
+            self.declination(day_of_year)
+        )
+        sunset_angle = numpy.arccos(numpy.clip(cos_sunset_angle, -1, 1))
+        half_day = sunset_angle / (2 * numpy.pi) * self.day_length
+        noon = self.day_length / 2 - self.solar_time_correction(day_of_year)
+        return int(round(noon - half_day)), int(round(noon + half_day))
+
+    def _clear_sky_curve(self, day_of_year):
+        seconds = numpy.arange(self.day_length)
+        latitude, tilt = radians(self.latitude), radians(self.tilt)
+        azimuth = radians(self.surface_azimuth)
+        declination = self.declination(day_of_year)
+        hour_angle = self.hour_angle(day_of_year, seconds)
+        sin_d, cos_d = numpy.sin(declination), numpy.cos(declination)
+        sin_l, cos_l = numpy.sin(latitude), numpy.cos(latitude)
+        cos_h = numpy.cos(hour_angle)
+        cos_zenith = sin_l * sin_d + cos_l * cos_d * cos_h
+        cos_incidence = (
+            sin_d * sin_l * numpy.cos(tilt) -
+            sin_d * cos_l * numpy.sin(tilt) * numpy.cos(azimuth) +
+            cos_d * cos_l * numpy.cos(tilt) * cos_h +
+            cos_d * sin_l * numpy.sin(tilt) * numpy.cos(azimuth) * cos_h +
+            cos_d * numpy.sin(tilt) * numpy.sin(azimuth) *
+            numpy.sin(hour_angle)
+        )
+        daylight = cos_zenith > 0
+        air_mass = 1 / numpy.where(daylight, cos_zenith, 1)
+        beam = self.solar_constant * 0.7 ** (air_mass ** 0.678)
+        diffuse = 0.1 * beam * (1 + numpy.cos(tilt)) / 2
+        irradiance = beam * numpy.clip(cos_incidence, 0, None) + diffuse
+        curve = self.max_power * irradiance / 1000
+        curve[~daylight] = 0
+        return curve.astype(numpy.float32)
+
+    def day(self, day_of_year):
+        '''Sunrise, sunset (seconds since the beginning of the day) and
+        clear-sky curve of a day of the year, computed once and cached
+        '''
+        key = (
+            day_of_year, self.max_power, self.latitude, self.longitude,
+            self.tilt, self.azimuth, self.utc_offset,
+        )
+        if key in self._days:
+            self._days[key] = self._days.pop(key)  # most recently used
+            return self._days[key]
+        sunrise, sunset = self._sunrise_and_sunset(day_of_year)
+        self._days[key] = sunrise, sunset, self._clear_sky_curve(day_of_year)
+        while len(self._days) > self.cache_days:
+            self._days.popitem(last=False)
+        return self._days[key]
+
+    @property
+    def today(self):
+        return self.clock.day_of_year()
+
+    @property
+    def sunrise(self):
+        return self.day(self.today)[0]
+
+    @property
+    def sunset(self):
+        return self.day(self.today)[1]
+
+    @property
+    def profile(self):
+        return self.day(self.today)[2]
+
+    def power_at(self, seconds):
+        return self.cached_power_at(seconds)
+
+    def day_of_year_of(self, localtime):
+        '''Day of the year of an ISO 8601 local time, or ``None``'''
+        try:
+            prefix = localtime[:10]
+            if prefix != self._last_date[0]:
+                day = datetime.strptime(prefix, '%Y-%m-%d')
+                self._last_date = prefix, day.timetuple().tm_yday
+        except (TypeError, ValueError):
+            return None
+        return self._last_date[1]
+
+    def standard_time_of(self, timestamp):
+        '''Day of the year and seconds since the beginning of the day of an
+        epoch timestamp, in standard time (``utc_offset``, without DST)
+        '''
+        days, seconds = divmod(
+            int(timestamp + self.utc_offset * 3600), self.day_length
+        )
+        if days != self._last_standard_day[0]:
+            date = datetime(1970, 1, 1) + timedelta(days=days)
+            self._last_standard_day = days, date.timetuple().tm_yday
+        return self._last_standard_day[1], seconds
+
+    def generated_power_at(self, localtime, timestamp=None):
+        '''The curves are in standard time, so the reading's ``timestamp`` is
+        used when present; otherwise, ``localtime`` is taken as standard time,
+        which is only right for clocks whose time zone has no DST
+        '''
+        if timestamp is not None:
+            day_of_year, seconds = self.standard_time_of(timestamp)
+        else:
+            seconds = seconds_of_day(localtime)
+            day_of_year = self.day_of_year_of(localtime)
+        if seconds is None or day_of_year is None:
+            return super(SolarPVSimulator, self).generated_power_at(localtime)
+        curve = self.day(day_of_year)[2]
+        return float(curve[seconds % self.day_length]) * (
+            self.random_at(localtime)
+        )
+
+    def power_curve(self, seconds, random_state=None):
+        seconds = numpy.asarray(seconds, dtype=int) % self.day_length
+        noise = self.random_array(seconds.shape, random_state=random_state)
+        return self.profile[seconds] * noise
+
+    def power_curve_at(self, timestamps, random_state=None):
+        timestamps = numpy.asarray(timestamps, dtype='datetime64[s]')
+        if random_state is None and self.seed is not None:
+            random_state = self.random_state_at(timestamps)
+        days = timestamps.astype('datetime64[D]')
+        seconds = (timestamps - days).astype(int)
+        days_of_year = (days - days.astype('datetime64[Y]')).astype(int) + 1
+        unique_days, day_indexes = numpy.unique(
+            days_of_year, return_inverse=True
+        )
+        curves = numpy.stack([self.day(d)[2] for d in unique_days])
+        power = curves[day_indexes.reshape(seconds.shape), seconds]
+        return power * self.random_array(
+            timestamps.shape, random_state=random_state
+        )
@@ -9,14 +9,69 @@
 # Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
 
 import csv
+import gzip
+import json
+import logging
+import numpy
+import os
+import shutil
 import sys
+import tempfile
+import threading
+import time
+
+from array import array
+from collections import deque
+from pvsim import metrics
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None  # pyarrow is only required by ParquetWriter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # only required by RotatingCSVWriter's zstd compression
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue  # Python 2
 
 
 class Writer(object):
 
+    #: Whether ``sync`` makes written rows durable, so acknowledging the
+    # messages they came from is safe
+    durable_sync = False
+
+    def _register_metrics(self):
+        self._flush_seconds = metrics.histogram(
+            'pvsim_writer_flush_seconds', 'Time spent flushing rows'
+        )
+        self._rows = metrics.counter(
+            'pvsim_writer_rows_total', 'Rows flushed'
+        )
+
     def write(self, data):
         raise NotImplementedError('write should be implemented by subclass')
 
+    def write_many(self, rows):
+        for data in rows:
+            self.write(data)
+
+    def flush(self):
+        pass
+
+    def sync(self):
+        '''Flush rows and, if ``durable_sync``, make them durable'''
+        self.flush()
+
+    def close(self):
+        self.flush()
+
 
 class StdoutWriter(Writer):
 
@@ -25,11 +80,621 @@ class StdoutWriter(Writer):
 
 
 class CSVWriter(Writer):
+    '''The CSVWriter appends rows to a CSV file. The file is kept open and rows
+    are buffered in memory until either threshold is reached.
+
+    :param filepath: path of the CSV file
+    :param buffer_size: number of rows buffered before flushing
+    :param flush_interval: maximum number of seconds rows stay buffered
+    :param fsync_every: call ``os.fsync`` after this many rows (0 disables it)
+    '''
+
+    durable_sync = True
+    _syncing = False
+
+    def __init__(self, filepath, buffer_size=1000, flush_interval=1,
+                 fsync_every=0):
+        self.filepath = filepath
+        self.buffer_size = int(buffer_size)
+        self.flush_interval = flush_interval
+        self.fsync_every = int(fsync_every)
+        self._fp = None
+        self._csv_writer = None
+        self._buffer = []
+        self._last_flush = time.time()
+        self._unsynced = 0
+        self._register_metrics()
+
+    def _open(self):
+        if self._fp is None:
+            self._fp = open(self.filepath, 'a')
+            self._csv_writer = csv.writer(self._fp)
+
+    def _should_flush(self):
+        return (
+            len(self._buffer) >= self.buffer_size or
+            time.time() - self._last_flush >= self.flush_interval
+        )
+
+    def write(self, data):
+        self._buffer.append(data)
+        if self._should_flush():
+            self.flush()
+
+    def write_many(self, rows):
+        self._buffer.extend(rows)
+        if self._should_flush():
+            self.flush()
+
+    def flush(self):
+        self._last_flush = time.time()
+        if not self._buffer:
+            return
+        with self._flush_seconds.time():
+            self._open()
+            self._csv_writer.writerows(self._buffer)
+            self._fp.flush()
+            self._rows.inc(len(self._buffer))
+            self._unsynced += len(self._buffer)
+            self._buffer = []
+            if self.fsync_every and self._unsynced >= self.fsync_every:
+                os.fsync(self._fp.fileno())
+                self._unsynced = 0
+
+    def sync(self):
+        self._syncing = True  # files closed meanwhile are synced too
+        try:
+            self.flush()
+        finally:
+            self._syncing = False
+        if self._fp is not None and self._unsynced:
+            os.fsync(self._fp.fileno())
+            self._unsynced = 0
+
+    def _close_file(self):
+        if self._fp is not None:
+            if (self.fsync_every or self._syncing) and self._unsynced:
+                os.fsync(self._fp.fileno())
+                self._unsynced = 0
+            self._fp.close()
+            self._fp, self._csv_writer = None, None
+
+    def close(self):
+        self.flush()
+        self._close_file()
+
+
+class RotatingCSVWriter(CSVWriter):
+    '''The RotatingCSVWriter writes rows to a CSV file per ``hour`` or ``day``
+    of their local time, named after it (e.g. ``2017-06-21T12.csv``), or to a
+    new file every ``max_bytes`` with ``size``. ``max_bytes`` also rotates
+    hourly and daily files, into ``2017-06-21T12.1.csv`` and so on. Rows older
+    than the current partition, say from a late meter, stay in its file.
+
+    Closed files are compressed by a background thread and described by a
+    manifest (e.g. ``2017-06-21T12.manifest.json``) with their number of rows
+    and first and last local times, so readers can skip whole files.
+
+    :param directory: directory of the files, created if missing
+    :param partition: either ``hour``, ``day`` or ``size``
+    :param max_bytes: size of a file in bytes to rotate at (0 disables it);
+        files are rotated on flushes, so they grow a buffer past it
+    :param compression: either ``gzip``, ``zstd`` (requires ``zstandard``)
+        or empty to keep files as they are
+    :param buffer_size: number of rows buffered before flushing
+    :param flush_interval: maximum number of seconds rows stay buffered
+    :param fsync_every: call ``os.fsync`` after this many rows (0 disables it)
+    '''
+
+    key_lengths = {'hour': 13, 'day': 10, 'size': 0}
+    extensions = {'gzip': '.gz', 'zstd': '.zst'}
+
+    def __init__(self, directory, partition='hour', max_bytes=0,
+                 compression='gzip', buffer_size=1000, flush_interval=1,
+                 fsync_every=0):
+        if partition not in self.key_lengths:
+            raise ValueError('inappropriate value for partition')
+        if partition == 'size' and not max_bytes:
+            raise ValueError('inappropriate value for max_bytes')
+        if compression and compression not in self.extensions:
+            raise ValueError('inappropriate value for compression')
+        if compression == 'zstd' and zstandard is None:
+            raise ImportError('zstd compression requires zstandard')
+        super(RotatingCSVWriter, self).__init__(
+            None, buffer_size, flush_interval, fsync_every
+        )
+        self.directory = directory
+        self.partition = partition
+        self.key_length = self.key_lengths[partition]
+        self.max_bytes = int(max_bytes)
+        self.compression = compression
+        self._key = None  # partition of the current file
+        self._segment = None  # rows, first and last local time of the file
+        self._closed_files = Queue()
+        self._compressor = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _file_name(self, localtime):
+        if self.key_length:
+            name = localtime[:self.key_length]
+        else:
+            name = localtime.replace(':', '')
+        candidate, number = name, 0
+        while any(
+            entry.startswith(candidate + '.csv') or
+            entry == candidate + '.manifest.json'
+            for entry in os.listdir(self.directory)
+        ):
+            number += 1
+            candidate = '{}.{}'.format(name, number)
+        return candidate
+
+    def _rotate(self, localtime):
+        self._close_segment()
+        self._key = localtime[:self.key_length]
+        self.filepath = os.path.join(
+            self.directory, self._file_name(localtime) + '.csv'
+        )
+        self._segment = [0, None, None]
+
+    def _write_rows(self, rows):
+        if not rows:
+            return
+        self._open()
+        self._csv_writer.writerows(rows)
+        self._unsynced += len(rows)
+        localtimes = [str(row[0]) for row in rows]
+        first, last = min(localtimes), max(localtimes)
+        segment = self._segment
+        segment[0] += len(rows)
+        if segment[1] is None or first < segment[1]:
+            segment[1] = first
+        if segment[2] is None or last > segment[2]:
+            segment[2] = last
+
+    def flush(self):
+        self._last_flush = time.time()
+        if not self._buffer:
+            return
+        with self._flush_seconds.time():
+            rows, start = self._buffer, 0
+            for i, row in enumerate(rows):
+                localtime = str(row[0])
+                if self._key is None or (
+                    localtime[:self.key_length] > self._key
+                ):
+                    self._write_rows(rows[start:i])
+                    self._rotate(localtime)
+                    start = i
+            self._write_rows(rows[start:])
+            self._fp.flush()
+            self._rows.inc(len(rows))
+            self._buffer = []
+            if self.fsync_every and self._unsynced >= self.fsync_every:
+                os.fsync(self._fp.fileno())
+                self._unsynced = 0
+            if self.max_bytes and self._fp.tell() >= self.max_bytes:
+                self._close_segment()
+
+    def _close_segment(self):
+        if self._fp is None:
+            return
+        self._close_file()
+        if self._compressor is None:
+            self._compressor = threading.Thread(
+                target=self._compress_closed_files, name='compressor'
+            )
+            self._compressor.daemon = True
+            self._compressor.start()
+        self._closed_files.put((self.filepath, self._segment))
+        self._key, self._segment = None, None
+
+    def _compress(self, filepath):
+        if not self.compression:
+            return filepath
+        compressed_path = filepath + self.extensions[self.compression]
+        temporary_path = compressed_path + '.tmp'
+        with open(filepath, 'rb') as source:
+            if self.compression == 'gzip':
+                with gzip.open(temporary_path, 'wb') as target:
+                    shutil.copyfileobj(source, target)
+            else:
+                with open(temporary_path, 'wb') as target:
+                    zstandard.ZstdCompressor().copy_stream(source, target)
+        os.rename(temporary_path, compressed_path)
+        os.remove(filepath)
+        return compressed_path
+
+    def _write_manifest(self, filepath, segment):
+        rows, first, last = segment
+        manifest_path = filepath[:filepath.rindex('.csv')] + '.manifest.json'
+        manifest = {
+            'file': os.path.basename(filepath),
+            'partition': self.partition,
+            'rows': rows,
+            'first_localtime': first,
+            'last_localtime': last,
+            'bytes': os.path.getsize(filepath),
+            'compression': self.compression or None,
+        }
+        with open(manifest_path + '.tmp', 'w') as fp:
+            json.dump(manifest, fp, indent=2, sort_keys=True)
+        os.rename(manifest_path + '.tmp', manifest_path)
 
-    def __init__(self, filepath):
+    def _compress_closed_files(self):
+        while True:
+            closed_file = self._closed_files.get()
+            try:
+                if closed_file is None:
+                    return
+                filepath, segment = closed_file
+                try:
+                    filepath = self._compress(filepath)
+                    self._write_manifest(filepath, segment)
+                except Exception as e:
+                    logging.error(
+                        '[RotatingCSVWriter] Could not finish %s: %s',
+                        filepath, e,
+                    )
+            finally:
+                self._closed_files.task_done()
+
+    def close(self):
+        self.flush()
+        self._close_segment()
+        if self._compressor is not None:
+            self._closed_files.put(None)
+            self._compressor.join()
+            self._compressor = None
+
+
+class ParquetWriter(Writer):
+    '''The ParquetWriter stores rows in a Parquet file. Rows are accumulated
+    into typed column buffers and each flush emits a compressed row group, so
+    downstream readers don't need to parse text. Requires ``pyarrow``.
+
+    A Parquet file is only readable once closed, when its footer is written,
+    so rows aren't durable before ``close``: batches consumed from a broker
+    that acknowledges them (see ``Broker.acks_batches``) are rejected.
+
+    :param filepath: path of the Parquet file; if it exists, rows go to the
+        first of ``name.1.parquet``, ``name.2.parquet``... that doesn't
+    :param row_group_size: number of rows buffered per row group
+    :param flush_interval: maximum number of seconds rows stay buffered
+    :param compression: compression codec (``snappy``, ``zstd``, ``gzip``...)
+    '''
+
+    columns = ('localtime', 'consumed', 'generated', 'sum')
+
+    def __init__(self, filepath, row_group_size=65536, flush_interval=60,
+                 compression='zstd'):
+        if pyarrow is None:
+            raise ImportError('ParquetWriter requires pyarrow to be installed')
         self.filepath = filepath
+        self.row_group_size = int(row_group_size)
+        self.flush_interval = flush_interval
+        self.compression = compression
+        self.schema = pyarrow.schema([
+            ('localtime', pyarrow.timestamp('s')),
+            ('consumed', pyarrow.float64()),
+            ('generated', pyarrow.float64()),
+            ('sum', pyarrow.float64()),
+        ])
+        self._parquet_writer = None
+        self._last_flush = time.time()
+        self._reset_buffers()
+        self._register_metrics()
+
+    def _reset_buffers(self):
+        self._localtimes = []
+        self._consumed = array('d')
+        self._generated = array('d')
+        self._sums = array('d')
+
+    def _should_flush(self):
+        return (
+            len(self._localtimes) >= self.row_group_size or
+            time.time() - self._last_flush >= self.flush_interval
+        )
+
+    def write(self, data):
+        localtime, consumed, generated, power_sum = data
+        self._localtimes.append(localtime)
+        self._consumed.append(consumed)
+        self._generated.append(generated)
+        self._sums.append(power_sum)
+        if self._should_flush():
+            self.flush()
+
+    def write_many(self, rows):
+        for localtime, consumed, generated, power_sum in rows:
+            self._localtimes.append(localtime)
+            self._consumed.append(consumed)
+            self._generated.append(generated)
+            self._sums.append(power_sum)
+        if self._should_flush():
+            self.flush()
+
+    def _localtime_array(self):
+        '''Buffered local times as ``datetime64``, and a mask of the valid
+        ones if some can't be converted (these are dropped and logged)
+        '''
+        try:
+            return numpy.array(self._localtimes, dtype='datetime64[s]'), None
+        except (TypeError, ValueError):
+            pass
+        valid = numpy.ones(len(self._localtimes), dtype=bool)
+        localtimes = numpy.empty(len(self._localtimes), dtype='datetime64[s]')
+        for i, localtime in enumerate(self._localtimes):
+            try:
+                localtimes[i] = numpy.datetime64(localtime, 's')
+            except (TypeError, ValueError):
+                valid[i] = False
+                logging.error(
+                    '[ParquetWriter] Dropped row with invalid local time: %r',
+                    localtime,
+                )
+        return localtimes[valid], valid
+
+    def _new_filepath(self):
+        '''``filepath``, or the first free one numbered after it, so earlier
+        output is never overwritten
+        '''
+        root, ext = os.path.splitext(self.filepath)
+        filepath, number = self.filepath, 0
+        while os.path.exists(filepath):
+            number += 1
+            filepath = '{}.{}{}'.format(root, number, ext)
+        if number:
+            logging.warning(
+                '[ParquetWriter] %s exists, writing to %s', self.filepath,
+                filepath,
+            )
+        return filepath
+
+    def flush(self):
+        self._last_flush = time.time()
+        if not self._localtimes:
+            return
+        with self._flush_seconds.time():
+            localtimes, valid = self._localtime_array()
+            columns = [
+                numpy.frombuffer(self._consumed),
+                numpy.frombuffer(self._generated),
+                numpy.frombuffer(self._sums),
+            ]
+            if valid is not None:
+                columns = [column[valid] for column in columns]
+            if not len(localtimes):
+                self._reset_buffers()
+                return
+            table = pyarrow.Table.from_arrays(
+                [pyarrow.array(localtimes)] +
+                [pyarrow.array(column) for column in columns],
+                schema=self.schema,
+            )
+            if self._parquet_writer is None:
+                self._parquet_writer = pyarrow.parquet.ParquetWriter(
+                    self._new_filepath(), self.schema,
+                    compression=self.compression,
+                )
+            self._parquet_writer.write_table(table)
+            self._rows.inc(len(localtimes))
+            self._reset_buffers()
+
+    def close(self):
+        self.flush()
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+
+
+class ThreadedWriter(Writer):
+    '''The ThreadedWriter hands rows over to another writer running on its
+    own thread, so storage stalls never hold up the thread consuming messages
+    (nor its broker heartbeats). At most ``queue_size`` rows wait in memory;
+    when they're full, the backpressure ``policy`` either:
+
+    - ``block``: waits for the writer thread to make room
+    - ``drop-oldest``: drops the oldest rows waiting (counted in ``dropped``)
+    - ``spill``: appends rows to ``spill_path`` on disk, to be written in order
+      once the queue catches up
+
+    ``flush`` and ``sync`` wait for the rows written so far to be written and
+    flushed or synced, so acknowledging messages after ``sync`` stays safe
+    unless rows are dropped, and ``close`` drains the queue before closing
+    the other writer. When the other writer fails, the error is raised again
+    by the next ``write``, ``flush`` or ``sync``.
+
+    :param writer: the writer to hand rows over to (e.g. ``CSVWriter``)
+    :param queue_size: number of rows waiting in memory at most
+    :param policy: either ``block``, ``drop-oldest`` or ``spill``
+    :param spill_path: file rows are spilled to; a temporary one by default
+    '''
+
+    policies = ('block', 'drop-oldest', 'spill')
+
+    def __init__(self, writer, queue_size=100000, policy='block',
+                 spill_path=None):
+        if policy not in self.policies:
+            raise ValueError('inappropriate value for policy')
+        self.writer = writer
+        self.queue_size = int(queue_size)
+        self.policy = policy
+        self.spill_path = spill_path
+        self.dropped = 0
+        self._batches = deque()
+        self._queued = 0  # rows in _batches
+        self._spilled = 0  # batches in the spill file yet to be read
+        self._spill_fp = None
+        self._spill_reader = None
+        self._added = 0  # batches added so far
+        self._done = 0  # batches written or dropped so far
+        self._flushed = 0  # value of _done at the last flush
+        self._flush_requested = 0
+        self._sync_requested = 0
+        self._error = None  # raised by the next write or flush
+        self._closing = False
+        self._condition = threading.Condition()
+        self._register_metrics()
+        self._thread = threading.Thread(target=self._run, name='writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def durable_sync(self):
+        return self.policy != 'drop-oldest' and self.writer.durable_sync
+
+    def _register_metrics(self):
+        self._queue_rows = metrics.gauge(
+            'pvsim_writer_queue_rows', 'Rows waiting for the writer thread'
+        )
+        self._queue_rows.set_function(lambda: self._queued)
+        self._dropped_rows = metrics.counter(
+            'pvsim_writer_dropped_rows_total',
+            'Rows dropped for the writer queue being full',
+        )
+        self._spilled_rows = metrics.counter(
+            'pvsim_writer_spilled_rows_total',
+            'Rows spilled to disk for the writer queue being full',
+        )
+
+    def _has_room(self, size):
+        return not self._queued or self._queued + size <= self.queue_size
+
+    def _has_work(self):
+        return bool(self._batches or self._spilled)
+
+    def _spill(self, rows):
+        if self._spill_fp is None:
+            if self.spill_path is None:
+                fd, self.spill_path = tempfile.mkstemp(
+                    prefix='pvsim-spill-', suffix='.jsonl'
+                )
+                os.close(fd)
+            self._spill_fp = open(self.spill_path, 'w')
+            self._spill_reader = open(self.spill_path)
+        self._spill_fp.write(json.dumps(rows, default=str) + '\n')
+        self._spill_fp.flush()
+        self._spilled += 1
+        self._spilled_rows.inc(len(rows))
+
+    def _unspill(self):
+        rows = json.loads(self._spill_reader.readline())
+        self._spilled -= 1
+        if not self._spilled:  # caught up: start over next time
+            self._spill_fp.close()
+            self._spill_reader.close()
+            self._spill_fp, self._spill_reader = None, None
+            os.remove(self.spill_path)
+        return rows
 
     def write(self, data):
-        with open(self.filepath, 'a') as fp:
-            csv_writer = csv.writer(fp)
-            csv_writer.writerow(data)
+        self.write_many([data])
+
+    def write_many(self, rows):
+        rows = list(rows)
+        if not rows:
+            return
+        with self._condition:
+            if self._closing:
+                raise ValueError('write to closed writer')
+            self._raise_error()
+            self._added += 1
+            if self.policy == 'spill':
+                if self._spilled or not self._has_room(len(rows)):
+                    self._spill(rows)
+                    self._condition.notify_all()
+                    return
+            elif self.policy == 'drop-oldest':
+                while not self._has_room(len(rows)):
+                    dropped = self._batches.popleft()
+                    self._queued -= len(dropped)
+                    self._done += 1
+                    self.dropped += len(dropped)
+                    self._dropped_rows.inc(len(dropped))
+            else:
+                while not self._has_room(len(rows)):
+                    self._condition.wait()
+            self._batches.append(rows)
+            self._queued += len(rows)
+            self._condition.notify_all()
+
+    def _next_batch(self):
+        '''Wait for rows to write, or for a flush or close to do; called
+        with the condition acquired'''
+        while not self._has_work():
+            if self._flush_requested > self._flushed or self._closing:
+                return None
+            self._condition.wait()
+        if self._batches:
+            rows = self._batches.popleft()
+            self._queued -= len(rows)
+        else:
+            rows = self._unspill()
+        self._condition.notify_all()  # there's room in the queue
+        return rows
+
+    def _raise_error(self):
+        '''Raise the last error of the other writer, if any; called with the
+        condition acquired'''
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def _run(self):
+        while True:
+            with self._condition:
+                rows = self._next_batch()
+                if rows is None:
+                    done, closing = self._done, self._closing
+                    syncing = self._sync_requested > self._flushed
+            if rows is not None:
+                try:
+                    self.writer.write_many(rows)
+                    error = None
+                except Exception as e:
+                    logging.error('[ThreadedWriter] Could not write: %s', e)
+                    error = e
+                with self._condition:
+                    self._done += 1
+                    self._error = error or self._error
+                continue
+            try:
+                if closing:
+                    self.writer.close()
+                elif syncing:
+                    self.writer.sync()
+                else:
+                    self.writer.flush()
+                error = None
+            except Exception as e:
+                logging.error('[ThreadedWriter] Could not flush: %s', e)
+                error = e
+            with self._condition:
+                self._error = error or self._error
+                self._flushed = done
+                self._condition.notify_all()
+            if closing:
+                return
+
+    def flush(self, sync=False):
+        with self._condition:
+            target = self._added
+            self._flush_requested = target
+            if sync:
+                self._sync_requested = target
+            self._condition.notify_all()
+            while self._flushed < target and self._thread.is_alive():
+                self._condition.wait()
+            self._raise_error()
+
+    def sync(self):
+        self.flush(sync=True)
+
+    def close(self):
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        self._thread.join()
@@ -8,8 +8,14 @@
 # http://www.opensource.org/licenses/MIT-license
 # Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
 
+import os
+
 from setuptools import setup, find_packages
-from pvsim import __version__
+
+# Read without importing pvsim, whose dependencies may not be installed yet
+version = {}
+with open(os.path.join(os.path.dirname(__file__), 'pvsim', 'version.py')) as f:
+    exec(f.read(), version)
 
 tests_require = [
     'flake8',
@@ -23,7 +29,7 @@ tests_require = [
 
 setup(
     name='pvsim',
-    version=__version__,
+    version=version['__version__'],
     description='PV Simulator Challenge',
     long_description='''
 PV Simulator Challenge
@@ -50,10 +56,15 @@ PV Simulator Challenge
     packages=find_packages(),
     include_package_data=False,
     install_requires=[
+        'numpy',
         'pika',
         'toml',
     ],
     extras_require={
+        'asyncio': ['aio-pika'],
+        'parquet': ['pyarrow'],
+        'plot': ['matplotlib'],
+        'zstd': ['zstandard'],
         'tests': tests_require,
     },
     entry_points={
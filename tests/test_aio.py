@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of pvsim.
+# https://github.com/scorphus/pvism
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/MIT-license
+# Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
+
+import asyncio
+import json
+import time
+
+from mock import AsyncMock, MagicMock, patch
+from pvsim import aio
+from unittest import TestCase, skipIf
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class AsyncBrokerTestCase(TestCase):
+
+    def setUp(self):
+        self.broker = aio.AsyncBroker()
+
+    def test_methods_raise_not_implemented(self):
+        for coroutine in (
+            self.broker.connect(),
+            self.broker.disconnect(),
+            self.broker.publish('...'),
+            self.broker.start_consuming(None),
+        ):
+            with self.assertRaises(NotImplementedError):
+                run(coroutine)
+
+    def test_publish_many_calls_publish(self):
+        self.broker.publish = AsyncMock(return_value=True)
+        self.assertTrue(run(self.broker.publish_many(['a', 'b'])))
+        self.assertEqual(self.broker.publish.await_count, 2)
+
+
+@skipIf(aio.aio_pika is None, 'aio-pika is not installed')
+class AsyncRabbitMQBrokerTestCase(TestCase):
+
+    def setUp(self):
+        self.patcher = patch('pvsim.aio.aio_pika.connect_robust')
+        self.connect_mock = self.patcher.start()
+        self.connection = MagicMock(is_closed=False, close=AsyncMock())
+        self.channel = AsyncMock()
+        self.connection.channel = AsyncMock(return_value=self.channel)
+        self.connect_mock.return_value = self.connection
+        self.broker = aio.AsyncRabbitMQBroker(
+            'localhost', 5672, 'exchange', 'key', batch_size=10
+        )
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_connect_declares_exchange(self):
+        run(self.broker.connect())
+        self.connect_mock.assert_awaited_once_with(
+            host='localhost', port=5672
+        )
+        self.connection.channel.assert_awaited_once_with(
+            publisher_confirms=False
+        )
+        self.channel.declare_exchange.assert_awaited_once()
+        self.assertEqual(self.channel.set_qos.await_count, 0)
+
+    @patch('pvsim.aio.logging')
+    def test_connect_errs_upon_exception(self, log_mock):
+        self.connect_mock.side_effect = ConnectionError('refused')
+        run(self.broker.connect())
+        log_mock.error.assert_called_once()
+        self.assertIsNone(self.broker.connection)
+
+    @patch('pvsim.aio.logging')
+    def test_publish_errs_while_reconnecting(self, log_mock):
+        exchange = self.channel.declare_exchange.return_value
+        exchange.publish.side_effect = ConnectionError('reset')
+        self.assertFalse(run(self.broker.publish('body')))
+        log_mock.error.assert_called_once()
+        exchange.publish.side_effect = (
+            aio.aio_pika.exceptions.ChannelInvalidStateError('closed')
+        )
+        self.assertFalse(run(self.broker.publish('body')))
+        exchange.publish.side_effect = None
+        self.assertTrue(run(self.broker.publish('body')))
+
+    def test_publish_connects_and_publishes(self):
+        self.assertTrue(run(self.broker.publish('body')))
+        exchange = self.channel.declare_exchange.return_value
+        message = exchange.publish.call_args[0][0]
+        self.assertEqual(message.body, b'body')
+        self.assertEqual(exchange.publish.call_args[1], {'routing_key': 'key'})
+
+    @patch('pvsim.aio.logging')
+    def test_publish_fails_without_connection(self, log_mock):
+        self.connect_mock.side_effect = ConnectionError('refused')
+        self.assertFalse(run(self.broker.publish('body')))
+
+    def test_start_consuming_binds_queue_and_calls_back(self):
+        queue = AsyncMock()
+        self.channel.declare_queue.return_value = queue
+        callback = MagicMock()
+
+        async def consume(on_message, no_ack):
+            await on_message(MagicMock(body=b'body'))
+            raise asyncio.CancelledError
+
+        queue.consume.side_effect = consume
+        with self.assertRaises(asyncio.CancelledError):
+            run(self.broker.start_consuming(callback))
+        self.channel.declare_queue.assert_awaited_once_with(
+            None, durable=False, exclusive=True
+        )
+        queue.bind.assert_awaited_once()
+        callback.assert_called_once_with(b'body')
+
+
+class AsyncMeterTestCase(TestCase):
+
+    def test_publish_publishes_readout(self):
+        measure = MagicMock()
+        measure.readout.return_value = (1234, '2017-11-06T12:00:00')
+        broker = MagicMock(publish=AsyncMock(return_value=True))
+        run(aio.AsyncMeter(measure, broker).publish())
+        body = broker.publish.call_args[0][0]
+        self.assertEqual(json.loads(body), {
+            'localtime': '2017-11-06T12:00:00', 'power': 1234,
+            'timestamp': measure.readout.call_args[0][0],
+        })
+
+    def test_publish_periodically_keeps_publishing(self):
+        meter = aio.AsyncMeter(MagicMock(), MagicMock(), interval=0.001)
+        meter.publish = AsyncMock(side_effect=[None, None, StopAsyncIteration])
+        with self.assertRaises(StopAsyncIteration):
+            run(meter.publish_periodically())
+        self.assertEqual(meter.publish.await_count, 3)
+
+    def test_publish_periodically_skips_missed_ticks(self):
+        meter = aio.AsyncMeter(
+            MagicMock(), MagicMock(), interval=0.01, missed_tick_policy='skip'
+        )
+        calls = []
+
+        async def slow_publish():
+            calls.append(1)
+            if len(calls) == 1:
+                time.sleep(0.035)  # a stall of more than 3 ticks
+            else:
+                raise StopAsyncIteration
+
+        meter.publish = slow_publish
+        with self.assertRaises(StopAsyncIteration):
+            run(meter.publish_periodically())
+        self.assertGreaterEqual(meter.missed_ticks, 2)
+
+    def test_init_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            aio.AsyncMeter(MagicMock(), MagicMock(), missed_tick_policy='x')
+        with self.assertRaises(ValueError):
+            aio.AsyncMeter(MagicMock(), MagicMock(), interval=0)
+
+
+class RunComponentsTestCase(TestCase):
+
+    @patch('pvsim.main.instantiate_component')
+    @patch('pvsim.aio.instantiate_component')
+    def test_pipeline_runs_meters_and_simulator(self, instantiate_mock,
+                                                main_instantiate_mock):
+        components = []
+
+        def instantiate(component, config, **init_kwargs):
+            mock = MagicMock(
+                publish_periodically=AsyncMock(),
+                start_consuming=AsyncMock(),
+                disconnect=AsyncMock(),
+            )
+            class_ = config.get(component, {}).get('class')
+            components.append((component, class_, mock))
+            return mock
+
+        instantiate_mock.side_effect = instantiate
+        main_instantiate_mock.side_effect = instantiate  # the writer
+        config = {'meter': {'count': 2}}
+        run(aio.run_components(config, True, True))
+        classes = [(c, class_) for c, class_, _ in components]
+        self.assertEqual(classes.count(
+            ('broker', 'pvsim.aio.AsyncRabbitMQBroker')
+        ), 2)
+        self.assertEqual(classes.count(('meter', 'pvsim.aio.AsyncMeter')), 2)
+        for component, _, mock in components:
+            if component == 'meter':
+                mock.publish_periodically.assert_awaited_once()
+            elif component == 'broker':
+                mock.disconnect.assert_awaited_once()
+            elif component == 'writer':
+                mock.close.assert_called_once()
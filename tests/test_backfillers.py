@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of pvsim.
+# https://github.com/scorphus/pvism
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/MIT-license
+# Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
+
+from datetime import datetime
+from mock import MagicMock
+from pvsim.backfillers import Backfiller
+from pvsim.measures import HPCMeasure
+from pvsim.simulators import PVSimulator
+from unittest import TestCase
+
+
+class BackfillerTestCase(TestCase):
+
+    def setUp(self):
+        self.writer = MagicMock()
+        self.backfiller = Backfiller(
+            HPCMeasure(),
+            PVSimulator(),
+            self.writer,
+            '2017-11-06T00:00:00',
+            '2017-11-08T00:00:00',
+            step=60,
+            batch_size=1000,
+            seed=42,
+        )
+
+    def test_init_raises_value_error(self):
+        with self.assertRaises(ValueError) as e:
+            Backfiller(None, None, None, '2017-11-06', '2017-11-06')
+        self.assertIn('start and end', e.exception.args[0])
+        with self.assertRaises(ValueError) as e:
+            Backfiller(None, None, None, '2017-11-06', '2017-11-07', step=0)
+        self.assertIn('step', e.exception.args[0])
+
+    def test_init_accepts_datetimes(self):
+        backfiller = Backfiller(
+            None, None, None, datetime(2017, 11, 6), datetime(2017, 11, 7)
+        )
+        self.assertEqual(str(backfiller.start), '2017-11-06T00:00:00')
+
+    def test_batches_cover_whole_range(self):
+        batches = list(self.backfiller.batches())
+        self.assertEqual(len(batches), 3)
+        self.assertEqual(sum(len(b) for b in batches), 2 * 24 * 60)
+        self.assertEqual(str(batches[0][0]), '2017-11-06T00:00:00')
+        self.assertEqual(str(batches[-1][-1]), '2017-11-07T23:59:00')
+
+    def test_run_writes_rows_in_batches(self):
+        count = self.backfiller.run()
+        self.assertEqual(count, 2 * 24 * 60)
+        self.assertEqual(self.writer.write_many.call_count, 3)
+        row = self.writer.write_many.call_args_list[0][0][0][0]
+        self.assertEqual(row[0], '2017-11-06T00:00:00')
+        self.assertGreater(row[1], 0)
+        self.assertEqual(row[2], 0)
+        self.assertAlmostEqual(row[3], row[2] - row[1])
+
+    def test_run_does_not_depend_on_partitioning(self):
+        self.backfiller.run()
+        rows = [
+            row for call in self.writer.write_many.call_args_list
+            for row in call[0][0]
+        ]
+        writer = MagicMock()
+        for start, end in [
+            ('2017-11-06T00:00:00', '2017-11-06T13:00:00'),
+            ('2017-11-06T13:00:00', '2017-11-08T00:00:00'),
+        ]:
+            Backfiller(
+                HPCMeasure(), PVSimulator(), writer, start, end, step=60,
+                batch_size=777, seed=42,
+            ).run()
+        self.assertEqual(rows, [
+            row for call in writer.write_many.call_args_list
+            for row in call[0][0]
+        ])
+
+    def test_rows_are_computed_at_second_of_day(self):
+        rows = self.backfiller.rows(next(self.backfiller.batches()))
+        noon = rows[12 * 60]
+        self.assertEqual(noon[0], '2017-11-06T12:00:00')
+        self.assertGreater(noon[2], 0)
@@ -8,9 +8,11 @@
 # http://www.opensource.org/licenses/MIT-license
 # Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
 
+import numpy
+
 from math import pi
 from mock import patch
-from pvsim.base import PowerCalc
+from pvsim.base import PowerCalc, SampledRandomState, check_random_state
 from unittest import TestCase
 
 
@@ -23,6 +25,21 @@ class PowerCalcTestCase(TestCase):
         with self.assertRaises(NotImplementedError):
             self.pcalc.power_at(1234)
 
+    def test_power_curve_raises_not_implemented(self):
+        with self.assertRaises(NotImplementedError):
+            self.pcalc.power_curve([1234])
+
+    @patch('pvsim.base.PowerCalc.power_curve')
+    def test_power_curve_at_passes_seconds_of_day(self, power_curve_mock):
+        timestamps = numpy.array(
+            ['2017-11-06T00:00:10', '2017-11-07T12:00:00'],
+            dtype='datetime64[s]',
+        )
+        self.pcalc.power_curve_at(timestamps, 42)
+        seconds, random_state = power_curve_mock.call_args[0]
+        self.assertEqual(seconds.tolist(), [10, 12 * 3600])
+        self.assertEqual(random_state, 42)
+
     @patch('pvsim.simulators.PowerCalc.power_at', return_value=1234)
     def test_current_power_and_time_calls_power_at(self, power_at_mock):
         power, _ = self.pcalc.current_power_and_time()
@@ -39,3 +56,117 @@ class PowerCalcTestCase(TestCase):
         self.assertEqual(random_value, 0.95)
         random_value = self.pcalc.random(1)
         self.assertEqual(random_value, 0.5)
+
+    def test_random_array_is_within_bounds(self):
+        values = self.pcalc.random_array(1000, random_state=42)
+        self.assertEqual(values.shape, (1000,))
+        self.assertTrue(((values > 0.9) & (values <= 1)).all())
+
+    def test_random_array_is_reproducible(self):
+        values_a = self.pcalc.random_array(10, random_state=42)
+        values_b = self.pcalc.random_array(10, random_state=42)
+        numpy.testing.assert_array_equal(values_a, values_b)
+
+
+class SeededPowerCalcTestCase(TestCase):
+
+    def seeded(self, seed=42, stream=0):
+        pcalc = PowerCalc()
+        pcalc.set_seed(seed, stream)
+        return pcalc
+
+    @patch('pvsim.base.random.random')
+    def test_random_draws_from_own_stream(self, random_mock):
+        values_a = [self.seeded().random() for _ in range(3)]
+        pcalc = self.seeded()
+        values_b = [pcalc.random(), pcalc.random(), pcalc.random()]
+        self.assertEqual(values_a[0], values_b[0])
+        self.assertEqual(len(set(values_b)), 3)
+        self.assertEqual(random_mock.call_count, 0)
+
+    def test_random_array_draws_from_own_stream(self):
+        numpy.testing.assert_array_equal(
+            self.seeded().random_array(10), self.seeded().random_array(10)
+        )
+
+    def test_streams_are_independent(self):
+        values_a = self.seeded(stream=0).random_array(10)
+        values_b = self.seeded(stream=1).random_array(10)
+        self.assertFalse((values_a == values_b).any())
+
+    def test_set_seed_resets_stream(self):
+        pcalc = self.seeded()
+        value = pcalc.random()
+        pcalc.set_seed(42)
+        self.assertEqual(pcalc.random(), value)
+
+    def test_random_state_at_does_not_depend_on_partitioning(self):
+        timestamps = numpy.arange(
+            numpy.datetime64('2017-11-06T23:00:00'),
+            numpy.datetime64('2017-11-07T01:00:00'),
+            numpy.timedelta64(60, 's'),
+        )
+        whole = self.seeded().random_state_at(timestamps).random_sample(120)
+        first = self.seeded().random_state_at(timestamps[:70])
+        second = self.seeded().random_state_at(timestamps[70:])
+        numpy.testing.assert_array_equal(
+            whole,
+            numpy.concatenate([
+                first.random_sample(70), second.random_sample(50)
+            ]),
+        )
+
+    def test_random_at_samples_noise_by_time(self):
+        localtimes = ['2017-11-06T23:59:59', '2017-11-07T00:00:00']
+        pcalc = self.seeded()
+        values = [pcalc.random_at(localtime) for localtime in localtimes]
+        pcalc = self.seeded()
+        self.assertEqual(
+            [pcalc.random_at(localtime) for localtime in localtimes[::-1]],
+            values[::-1],
+        )
+        samples = self.seeded().random_state_at(
+            numpy.array(localtimes, 'datetime64[s]')
+        ).random_sample(2)
+        numpy.testing.assert_array_equal(values, (10 - samples) / 10)
+
+    @patch('pvsim.base.random.random', return_value=0)
+    def test_random_at_falls_back_to_random(self, _):
+        self.assertEqual(self.seeded(None).random_at('2017-11-06T12:00'), 1)
+        self.assertNotEqual(self.seeded().random_at('2017-11-06'), 1)
+
+    @patch('pvsim.base.PowerCalc.power_curve')
+    def test_power_curve_at_samples_noise_by_time(self, power_curve_mock):
+        timestamps = numpy.array(['2017-11-06T12:00:00'], 'datetime64[s]')
+        self.seeded().power_curve_at(timestamps)
+        random_state = power_curve_mock.call_args[0][1]
+        self.assertIsInstance(random_state, SampledRandomState)
+
+
+class SampledRandomStateTestCase(TestCase):
+
+    def test_random_sample_hands_out_samples(self):
+        samples = numpy.array([0.1, 0.2, 0.3, 0.4])
+        random_state = SampledRandomState(samples)
+        self.assertEqual(
+            random_state.random_sample((2, 2)).tolist(),
+            [[0.1, 0.2], [0.3, 0.4]],
+        )
+
+    def test_random_sample_size_must_match(self):
+        with self.assertRaises(ValueError):
+            SampledRandomState(numpy.zeros(4)).random_sample(3)
+
+
+class CheckRandomStateTestCase(TestCase):
+
+    def test_none_returns_global_random_state(self):
+        self.assertIs(check_random_state(), numpy.random.mtrand._rand)
+
+    def test_seed_returns_new_random_state(self):
+        random_state = check_random_state(42)
+        self.assertIsInstance(random_state, numpy.random.RandomState)
+
+    def test_random_state_is_returned_untouched(self):
+        random_state = numpy.random.RandomState(42)
+        self.assertIs(check_random_state(random_state), random_state)
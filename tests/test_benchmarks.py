@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of pvsim.
+# https://github.com/scorphus/pvism
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/MIT-license
+# Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
+
+import json
+import os
+import shutil
+import tempfile
+
+from mock import MagicMock, patch
+from pvsim.benchmarks import (
+    Benchmark, FakeBroker, NullWriter, bench, compare_to_baseline,
+    format_results, run_benchmarks,
+)
+from unittest import TestCase
+
+
+class FakeBrokerTestCase(TestCase):
+
+    def test_deliver_calls_back_with_published_messages(self):
+        broker = FakeBroker()
+        callback = MagicMock()
+        broker.start_consuming(callback)
+        broker.publish('body')
+        broker.deliver()
+        callback.assert_called_once_with(None, None, None, b'body')
+        self.assertEqual(broker.messages, [])
+
+
+class BenchmarkTestCase(TestCase):
+
+    def test_run_reports_rate_and_latencies(self):
+        func, teardown = MagicMock(), MagicMock()
+        result = Benchmark('stage', lambda: func, 2, teardown).run(100)
+        self.assertEqual(func.call_count, 111)  # warm up and memory pass
+        self.assertGreater(result['rate'], 0)
+        self.assertLessEqual(result['p50'], result['p99'])
+        teardown.assert_called_once()
+
+    def test_run_benchmarks_covers_all_stages(self):
+        results = run_benchmarks(20)
+        self.assertEqual(sorted(results), [
+            'end_to_end',
+            'measure.appliance.power_at',
+            'measure.power_at',
+            'measure.power_curve',
+            'meter.publish',
+            'simulator.message_received',
+            'simulator.message_received.binary',
+            'writer.csv',
+        ])
+        self.assertIn('end_to_end', format_results(results))
+
+    def test_end_to_end_reaches_writer(self):
+        with patch('pvsim.benchmarks.NullWriter.write') as write_mock:
+            run_benchmarks(10)
+        self.assertGreater(write_mock.call_count, 0)
+
+    def test_null_writer_counts_rows(self):
+        writer = NullWriter()
+        writer.write([1])
+        writer.write_many([[2], [3]])
+        self.assertEqual(writer.rows, 3)
+
+
+class BaselineTestCase(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.baseline_path = os.path.join(self.tmpdir, 'baseline.json')
+        self.results = {
+            'a': {'rate': 100, 'p50': 0, 'p99': 0, 'peak_kib': None},
+            'b': {'rate': 79, 'p50': 0, 'p99': 0, 'peak_kib': None},
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_compare_to_baseline_finds_regressions(self):
+        baseline = {'a': {'rate': 110}, 'b': {'rate': 100}, 'c': {'rate': 1}}
+        self.assertEqual(compare_to_baseline(self.results, baseline), ['b'])
+
+    @patch('pvsim.benchmarks.sys.stdout')
+    @patch('pvsim.benchmarks.run_benchmarks')
+    def test_bench_saves_and_compares_baseline(self, run_mock, _):
+        run_mock.return_value = self.results
+        self.assertTrue(bench(self.baseline_path))
+        with open(self.baseline_path) as fp:
+            self.assertEqual(json.load(fp), self.results)
+        self.assertTrue(bench(self.baseline_path))
+        run_mock.return_value = dict(self.results, a=dict(
+            self.results['a'], rate=10
+        ))
+        with patch('pvsim.benchmarks.logging') as log_mock:
+            self.assertFalse(bench(self.baseline_path))
+        log_mock.error.assert_called_once()
@@ -8,9 +8,18 @@
 # http://www.opensource.org/licenses/MIT-license
 # Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
 
-from mock import MagicMock, patch
-from pika.exceptions import ConnectionClosed
-from pvsim.brokers import RabbitMQBroker, Broker
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from collections import deque
+from mock import MagicMock, call, patch
+from pika.exceptions import AMQPConnectionError, ConnectionClosed
+from pvsim.brokers import (
+    Broker, QueueBroker, RabbitMQBroker, UnixSocketBroker
+)
 from unittest import TestCase
 
 
@@ -31,10 +40,19 @@ class BrokerTestCase(TestCase):
         with self.assertRaises(NotImplementedError):
             self.broker.publish('...')
 
+    def test_publish_many_calls_publish(self):
+        self.broker.publish = MagicMock(return_value=True)
+        self.assertTrue(self.broker.publish_many(['a', 'b']))
+        self.assertEqual(self.broker.publish.call_count, 2)
+
     def test_start_consuming_raises_not_implemented(self):
         with self.assertRaises(NotImplementedError):
             self.broker.start_consuming(None)
 
+    def test_start_consuming_batches_raises_not_implemented(self):
+        with self.assertRaises(NotImplementedError):
+            self.broker.start_consuming_batches(None)
+
 
 class RabbitMQBrokerInitTestCase(TestCase):
 
@@ -80,6 +98,80 @@ class RabbitMQBrokerTestCase(TestCase):
             exchange='exchange', routing_key='key', body='body'
         )
 
+    def test_publish_buffers_up_to_batch_size(self):
+        self.broker.batch_size = 3
+        self.broker.max_latency = 60
+        self.assertTrue(self.broker.publish('a'))
+        self.assertTrue(self.broker.publish('b'))
+        self.assertEqual(self.broker.channel.basic_publish.call_count, 0)
+        self.assertTrue(self.broker.publish('c'))
+        self.assertEqual(self.broker.channel.basic_publish.call_count, 3)
+
+    def test_publish_flushes_after_max_latency(self):
+        self.broker.batch_size = 3
+        self.broker.max_latency = 0
+        self.assertTrue(self.broker.publish('a'))
+        self.broker.channel.basic_publish.assert_called_once()
+
+    @patch('pvsim.brokers.time.time')
+    def test_flush_due_in_counts_from_oldest_buffered_message(self, time_mock):
+        self.broker.batch_size = 3
+        self.broker.max_latency = 0.1
+        self.assertIsNone(self.broker.flush_due_in())
+        time_mock.return_value = 100
+        self.broker.publish('a')
+        time_mock.return_value = 100.04
+        self.broker.publish('b')
+        self.assertAlmostEqual(self.broker.flush_due_in(), 0.06)
+        self.broker.flush()
+        self.assertIsNone(self.broker.flush_due_in())
+
+    def test_publish_many_publishes_all_bodies(self):
+        self.assertTrue(self.broker.publish_many(['a', 'b', 'c']))
+        self.assertEqual(self.broker.channel.basic_publish.call_count, 3)
+
+    def test_connect_enables_publisher_confirms(self):
+        self.broker.confirm_delivery = True
+        self.broker.connect()
+        self.broker.channel.confirm_delivery.assert_called_once()
+
+    @patch('pvsim.brokers.logging')
+    def test_unconfirmed_messages_are_retried(self, log_mock):
+        self.broker.channel.basic_publish.side_effect = [True, False, True]
+        self.assertFalse(self.broker.publish_many(['a', 'b']))
+        self.assertEqual(list(self.broker._retry_queue), ['b'])
+        self.assertTrue(self.broker.flush())
+        self.broker.channel.basic_publish.assert_called_with(
+            exchange='exchange', routing_key='key', body='b'
+        )
+        self.assertEqual(len(self.broker._retry_queue), 0)
+
+    @patch('pvsim.brokers.logging')
+    def test_publish_errors_are_retried_after_reconnecting(self, log_mock):
+        channel = self.broker.channel
+        channel.basic_publish.side_effect = [
+            True, AMQPConnectionError('gone'), True, True
+        ]
+        self.assertFalse(self.broker.publish_many(['a', 'b', 'c']))
+        self.assertIsNone(self.broker.channel)
+        self.assertEqual(list(self.broker._retry_queue), ['b', 'c'])
+        self.assertTrue(self.broker.flush())
+        self.assertEqual(self.bc_mock.call_count, 2)
+
+    def test_retry_queue_drops_oldest_messages(self):
+        self.broker._retry_queue = deque(maxlen=2)
+        self.broker.channel.basic_publish.return_value = False
+        self.broker.publish_many(['a', 'b', 'c'])
+        self.assertEqual(list(self.broker._retry_queue), ['b', 'c'])
+
+    def test_disconnect_flushes_buffer(self):
+        self.broker.batch_size = 10
+        self.broker.max_latency = 60
+        self.broker.publish('a')
+        self.broker.disconnect()
+        self.broker.channel.basic_publish.assert_called_once()
+        self.connection.close.assert_called_once()
+
     @patch('pvsim.brokers.logging')
     @patch('pvsim.brokers.pika.BlockingConnection')
     def test_connect_errs_upon_exception(self, bc_mock, log_mock):
@@ -101,3 +193,166 @@ class RabbitMQBrokerTestCase(TestCase):
         self.broker.channel.queue_bind.assert_called_once()
         self.broker.channel.basic_consume.assert_called_once()
         self.broker.channel.start_consuming.assert_called_once()
+
+    def test_start_consuming_declares_named_durable_queue(self):
+        self.broker.queue = 'readouts'
+        self.broker.durable = True
+        self.broker.prefetch_count = 10
+        self.broker.start_consuming(MagicMock())
+        self.broker.channel.queue_declare.assert_called_once_with(
+            queue='readouts', durable=True
+        )
+        self.broker.channel.basic_qos.assert_called_once_with(
+            prefetch_count=10
+        )
+        self.assertEqual(
+            self.broker.channel.basic_consume.call_args[1]['queue'],
+            'readouts'
+        )
+
+    def test_start_consuming_batches_acks_after_callback(self):
+        self.broker.consume_batch_size = 2
+        self.broker.consume_timeout = 60
+        self.broker.channel.consume.return_value = iter([
+            (MagicMock(delivery_tag=1), None, b'a'),
+            (MagicMock(delivery_tag=2), None, b'b'),
+            (MagicMock(delivery_tag=3), None, b'c'),
+            (None, None, None),
+        ])
+        callback = MagicMock()
+        self.broker.start_consuming_batches(callback)
+        self.broker.channel.basic_qos.assert_called_once_with(
+            prefetch_count=2
+        )
+        self.assertEqual(
+            callback.call_args_list, [call([b'a', b'b']), call([b'c'])]
+        )
+        self.assertEqual(self.broker.channel.basic_ack.call_args_list, [
+            call(delivery_tag=2, multiple=True),
+            call(delivery_tag=3, multiple=True),
+        ])
+        self.broker.channel.cancel.assert_called_once()
+
+    def test_start_consuming_batches_does_not_ack_on_failure(self):
+        self.broker.consume_batch_size = 1
+        self.broker.channel.consume.return_value = iter([
+            (MagicMock(delivery_tag=1), None, b'a'),
+        ])
+        callback = MagicMock(side_effect=IOError('disk full'))
+        with self.assertRaises(IOError):
+            self.broker.start_consuming_batches(callback)
+        self.assertEqual(self.broker.channel.basic_ack.call_count, 0)
+        self.broker.channel.cancel.assert_called_once()
+        self.assertTrue(self.broker.acks_batches)
+
+
+class QueueBrokerTestCase(TestCase):
+
+    def setUp(self):
+        QueueBroker._queues.clear()
+        self.publisher = QueueBroker(poll_interval=0.01)
+        self.consumer = QueueBroker(poll_interval=0.01)
+
+    def consume_in_thread(self, method, callback):
+        thread = threading.Thread(target=method, args=(callback,))
+        thread.start()
+        return thread
+
+    def test_brokers_with_same_name_share_queue(self):
+        self.assertIs(self.publisher.queue, self.consumer.queue)
+        self.assertIsNot(QueueBroker('other').queue, self.consumer.queue)
+        self.assertFalse(self.consumer.acks_batches)
+
+    def test_start_consuming_delivers_published_messages(self):
+        bodies = []
+
+        def callback(*args):
+            bodies.append(args[-1])
+            if len(bodies) == 2:
+                self.consumer.disconnect()
+
+        self.publisher.publish('a')
+        self.publisher.publish_many([b'b'])
+        self.consume_in_thread(self.consumer.start_consuming, callback).join()
+        self.assertEqual(bodies, [b'a', b'b'])
+
+    def test_start_consuming_batches_delivers_batches(self):
+        batches = []
+
+        def callback(bodies):
+            batches.append(bodies)
+            self.consumer.disconnect()
+
+        self.consumer.consume_batch_size = 2
+        self.publisher.publish_many(['a', 'b', 'c'])
+        self.consume_in_thread(
+            self.consumer.start_consuming_batches, callback
+        ).join()
+        self.assertEqual(batches, [[b'a', b'b']])
+
+    def test_disconnect_stops_idle_consumer(self):
+        thread = self.consume_in_thread(
+            self.consumer.start_consuming, MagicMock()
+        )
+        self.consumer.disconnect()
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+
+
+class UnixSocketBrokerTestCase(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        path = os.path.join(self.tmpdir, 'pvsim.sock')
+        self.publisher = UnixSocketBroker(path)
+        self.consumer = UnixSocketBroker(path, poll_interval=0.01)
+
+    def tearDown(self):
+        self.publisher.disconnect()
+        shutil.rmtree(self.tmpdir)
+
+    def consume_in_thread(self, method, callback):
+        thread = threading.Thread(target=method, args=(callback,))
+        thread.start()
+        while not os.path.exists(self.consumer.path):
+            time.sleep(0.01)
+        return thread
+
+    @patch('pvsim.brokers.logging')
+    def test_publish_fails_without_consumer(self, log_mock):
+        self.assertFalse(self.publisher.publish('body'))
+        log_mock.error.assert_called_once()
+
+    def test_start_consuming_delivers_published_messages(self):
+        bodies = []
+
+        def callback(*args):
+            bodies.append(args[-1])
+            if len(bodies) == 3:
+                self.consumer.disconnect()
+
+        thread = self.consume_in_thread(
+            self.consumer.start_consuming, callback
+        )
+        self.assertTrue(self.publisher.publish('a'))
+        self.assertTrue(self.publisher.publish_many(['b' * 100000, b'c']))
+        thread.join(5)
+        self.assertEqual(bodies, [b'a', b'b' * 100000, b'c'])
+        self.assertFalse(os.path.exists(self.consumer.path))
+
+    def test_start_consuming_batches_delivers_batches(self):
+        batches = []
+
+        def callback(bodies):
+            batches.append(bodies)
+            if sum(len(batch) for batch in batches) == 3:
+                self.consumer.disconnect()
+
+        self.consumer.consume_batch_size = 2
+        thread = self.consume_in_thread(
+            self.consumer.start_consuming_batches, callback
+        )
+        self.publisher.publish_many(['a', 'b', 'c'])
+        thread.join(5)
+        self.assertEqual(sum(batches, []), [b'a', b'b', b'c'])
+        self.assertTrue(all(len(batch) <= 2 for batch in batches))
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of pvsim.
+# https://github.com/scorphus/pvism
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/MIT-license
+# Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
+
+from datetime import datetime
+from mock import patch
+from pvsim.clocks import RealClock, SimulatedClock, ZoneInfo, seconds_of_day
+from unittest import TestCase, skipIf
+
+import time
+
+
+class SecondsOfDayTestCase(TestCase):
+
+    def test_seconds_of_day_parses_time_of_day(self):
+        self.assertEqual(
+            seconds_of_day('2017-11-06T13:15:30'), 13 * 3600 + 15 * 60 + 30
+        )
+
+    def test_seconds_of_day_without_time_of_day(self):
+        self.assertIsNone(seconds_of_day('2017-11-06'))
+        self.assertIsNone(seconds_of_day(None))
+
+
+class RealClockTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = RealClock()
+
+    def test_now_is_wall_clock_time(self):
+        before = time.time()
+        now = self.clock.now()
+        self.assertTrue(before <= now <= time.time())
+
+    def test_seconds_and_localtime_match_datetime(self):
+        timestamp = 1509969600.25
+        expected = datetime.fromtimestamp(timestamp)
+        seconds, localtime = self.clock.seconds_and_localtime(timestamp)
+        self.assertEqual(
+            seconds,
+            expected.hour * 3600 + expected.minute * 60 + expected.second
+        )
+        self.assertEqual(
+            localtime, expected.replace(microsecond=0).isoformat()
+        )
+
+    def test_seconds_reuses_cached_day(self):
+        timestamp = 1509969600
+        self.clock.seconds(timestamp)
+        with patch.object(self.clock, '_load_day') as load_day:
+            self.clock.seconds(timestamp + 60)
+        self.assertEqual(load_day.call_count, 0)
+
+    def test_day_of_year(self):
+        timestamp = time.mktime((2017, 2, 1, 12, 0, 0, 0, 0, -1))
+        self.assertEqual(self.clock.day_of_year(timestamp), 32)
+
+    def test_seconds_defaults_to_now(self):
+        with patch.object(self.clock, 'now', return_value=1509969600):
+            self.assertEqual(
+                self.clock.seconds(), self.clock.seconds(1509969600)
+            )
+
+
+@skipIf(ZoneInfo is None, 'time zones require Python 3.9+')
+class TimezoneClockTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = RealClock(timezone='Europe/Berlin')
+
+    def test_seconds_and_localtime_in_timezone(self):
+        # 2017-11-06T12:00:00Z is 13:00 in Berlin
+        self.assertEqual(
+            self.clock.seconds_and_localtime(1509969600),
+            (13 * 3600, '2017-11-06T13:00:00')
+        )
+
+    def test_seconds_and_localtime_on_dst_day(self):
+        # 2017-03-26T01:30:00Z is 03:30 CEST, an hour after the switch
+        self.assertEqual(
+            self.clock.seconds_and_localtime(1490491800),
+            (3 * 3600 + 30 * 60, '2017-03-26T03:30:00')
+        )
+
+    def test_seconds_before_dst_switch(self):
+        # 2017-03-26T00:30:00Z is 01:30 CET
+        self.assertEqual(self.clock.seconds(1490488200), 3600 + 30 * 60)
+
+
+class SimulatedClockTestCase(TestCase):
+
+    @patch('pvsim.clocks.monotonic', side_effect=[100, 110])
+    def test_now_advances_by_speed(self, _):
+        clock = SimulatedClock('2017-06-21T00:00:00', speed=60)
+        start = clock.start
+        self.assertEqual(clock.now(), start + 600)
+
+    def test_start_accepts_datetime(self):
+        clock = SimulatedClock(datetime(2017, 6, 21, 6))
+        self.assertEqual(
+            clock.seconds_and_localtime(clock.start),
+            (6 * 3600, '2017-06-21T06:00:00')
+        )
+
+    def test_start_defaults_to_now(self):
+        before = time.time()
+        clock = SimulatedClock()
+        self.assertTrue(before <= clock.start <= time.time())
+
+    def test_inappropriate_speed_raises(self):
+        with self.assertRaises(ValueError):
+            SimulatedClock(speed=0)
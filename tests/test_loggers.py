@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of pvsim.
+# https://github.com/scorphus/pvism
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/MIT-license
+# Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
+
+import json
+import logging
+
+from mock import MagicMock, patch
+from pvsim import loggers
+from unittest import TestCase
+
+
+class SampledLoggerTestCase(TestCase):
+
+    def setUp(self):
+        self.logger_mock = MagicMock()
+        self.logger_mock.isEnabledFor.return_value = True
+
+    def sampled_logger(self, **kwargs):
+        sampled_logger = loggers.SampledLogger('[Test] Received', **kwargs)
+        sampled_logger.logger = self.logger_mock
+        return sampled_logger
+
+    def test_sampled_logger_logs_everything_by_default(self):
+        sampled_logger = self.sampled_logger()
+        for i in range(3):
+            sampled_logger.log('[Test] Received %s', i)
+        self.assertEqual(self.logger_mock.log.call_count, 3)
+        self.logger_mock.log.assert_called_with(
+            logging.INFO, '[Test] Received %s', 2, extra=None
+        )
+
+    def test_sampled_logger_does_nothing_while_disabled(self):
+        self.logger_mock.isEnabledFor.return_value = False
+        sampled_logger = self.sampled_logger(every=2)
+        sampled_logger.log('[Test] Received %s', 1)
+        self.logger_mock.log.assert_not_called()
+        self.assertEqual(sampled_logger.seen, 0)
+
+    def test_sampled_logger_logs_every_nth_message(self):
+        sampled_logger = self.sampled_logger(every=3)
+        for i in range(7):
+            sampled_logger.log('[Test] Received %s', i)
+        logged = [c[0][2] for c in self.logger_mock.log.call_args_list]
+        self.assertEqual(logged, [0, 3, 6])
+        self.assertEqual(sampled_logger.logged, 3)
+
+    @patch('pvsim.loggers.monotonic')
+    def test_sampled_logger_limits_messages_per_second(self, monotonic_mock):
+        sampled_logger = self.sampled_logger(per_second=2)
+        for now in (0, 0.1, 0.2, 0.5, 0.6, 1.1):
+            monotonic_mock.return_value = now
+            sampled_logger.log('[Test] Received %s', now)
+        logged = [c[0][2] for c in self.logger_mock.log.call_args_list]
+        self.assertEqual(logged, [0, 0.5, 1.1])
+
+    @patch('pvsim.loggers.monotonic')
+    def test_sampled_logger_summarizes_messages(self, monotonic_mock):
+        sampled_logger = self.sampled_logger(every=2, summary_interval=10)
+        for now in (0, 1, 2, 3, 10):
+            monotonic_mock.return_value = now
+            sampled_logger.log('[Test] Received %s', now)
+        summary = self.logger_mock.log.call_args_list[2]
+        self.assertEqual(
+            summary[0][1:], (
+                '%s %d messages in %.1fs, logged %d', '[Test] Received', 4,
+                10, 2,
+            )
+        )
+        self.assertEqual(
+            summary[1]['extra'],
+            {'fields': {'seen': 4, 'logged': 2, 'seconds': 10}},
+        )
+
+    def test_sampled_logger_passes_fields(self):
+        sampled_logger = self.sampled_logger()
+        sampled_logger.log('[Test] Received %d', 3, messages=3)
+        self.logger_mock.log.assert_called_once_with(
+            logging.INFO, '[Test] Received %d', 3,
+            extra={'fields': {'messages': 3}},
+        )
+
+    @patch.dict('pvsim.loggers.sampling', {'every': 5, 'per_second': 1})
+    def test_sampled_logger_defaults_to_module_sampling(self):
+        sampled_logger = loggers.SampledLogger('[Test] Received')
+        self.assertEqual(sampled_logger.every, 5)
+        self.assertEqual(sampled_logger.per_second, 1)
+        self.assertTrue(sampled_logger.sampling)
+
+
+class JSONFormatterTestCase(TestCase):
+
+    def test_json_formatter_formats_message_and_fields(self):
+        record = logging.LogRecord(
+            'root', logging.INFO, __file__, 1, '[Test] Received %d', (3,),
+            None,
+        )
+        record.fields = {'messages': 3, 'message': 'ignored'}
+        entry = json.loads(loggers.JSONFormatter().format(record))
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['message'], '[Test] Received 3')
+        self.assertEqual(entry['messages'], 3)
+        self.assertIn('time', entry)
+
+
+class ConfigureTestCase(TestCase):
+
+    def tearDown(self):
+        loggers.stop()
+        logging.getLogger().setLevel(logging.WARNING)
+
+    def test_configure_emits_from_listener(self):
+        loggers.configure(logging.INFO, 'json')
+        root = logging.getLogger()
+        self.assertEqual(root.level, logging.INFO)
+        self.assertIn(loggers._handler, root.handlers)
+        stream = loggers._listener.handlers[0]
+        with patch.object(stream, 'emit') as emit_mock:
+            logging.info('[Test] Received %s', 1)
+            loggers.stop()
+        record = emit_mock.call_args[0][0]
+        self.assertEqual(record.getMessage(), '[Test] Received 1')
+        self.assertNotIn(stream, root.handlers)
+
+    def test_configure_synchronously(self):
+        loggers.configure(logging.INFO, asynchronous=False)
+        self.assertIsNone(loggers._listener)
+        self.assertIsInstance(loggers._handler, logging.StreamHandler)
+
+    def test_configure_replaces_previous_configuration(self):
+        loggers.configure()
+        loggers.configure()
+        handlers = [
+            h for h in logging.getLogger().handlers
+            if isinstance(h, loggers.LazyQueueHandler)
+        ]
+        self.assertEqual(handlers, [loggers._handler])
+
+    def test_configure_rejects_unknown_format(self):
+        with self.assertRaises(ValueError):
+            loggers.configure(log_format='xml')
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of pvsim.
+# https://github.com/scorphus/pvism
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/MIT-license
+# Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
+
+import logging
+import time
+
+from mock import MagicMock, patch
+from pvsim import loggers, main, metrics
+from unittest import TestCase
+
+
+class ShardConfigTestCase(TestCase):
+
+    def test_shard_config_formats_worker_placeholder(self):
+        config = {
+            'writer': {
+                'class': 'pvsim.CSVWriter',
+                'parameters': {'filepath': 'output-{worker}.csv', 'n': 1},
+            },
+        }
+        sharded = main.shard_config(config, 'writer', 3)
+        self.assertEqual(sharded['writer']['parameters'], {
+            'filepath': 'output-3.csv', 'n': 1,
+        })
+        self.assertEqual(
+            config['writer']['parameters']['filepath'], 'output-{worker}.csv'
+        )
+
+    def test_shard_config_formats_other_tables(self):
+        config = {
+            'writer': {
+                'class': 'pvsim.CSVWriter',
+                'thread': {'spill_path': 'spill-{worker}.jsonl'},
+            },
+        }
+        sharded = main.shard_config(config, 'writer', 2)
+        self.assertEqual(
+            sharded['writer']['thread']['spill_path'], 'spill-2.jsonl'
+        )
+        self.assertEqual(sharded['writer']['class'], 'pvsim.CSVWriter')
+
+
+class SimulateTimeTestCase(TestCase):
+
+    def test_simulate_time_keeps_config_without_options(self):
+        config = {'meter': {}}
+        self.assertIs(main.simulate_time(config), config)
+
+    def test_simulate_time_configures_simulated_clock(self):
+        config = {
+            'clock': {
+                'class': 'pvsim.RealClock',
+                'parameters': {'timezone': 'Europe/Berlin'},
+            },
+        }
+        simulated = main.simulate_time(config, 3600, '2017-06-21T00:00:00')
+        self.assertEqual(simulated['clock'], {
+            'class': 'pvsim.clocks.SimulatedClock',
+            'parameters': {
+                'timezone': 'Europe/Berlin',
+                'speed': 3600,
+                'start': '2017-06-21T00:00:00',
+            },
+        })
+        self.assertEqual(config['clock']['class'], 'pvsim.RealClock')
+
+    @patch('pvsim.main.instantiate_component')
+    def test_run_meter_passes_clock_to_meter(self, instantiate_mock):
+        config = main.simulate_time({}, speed=60)
+        with patch('pvsim.main.instantiate_clock') as clock_mock:
+            main.run_meter(config)
+        self.assertIs(
+            instantiate_mock.call_args_list[2][1]['clock'],
+            clock_mock.return_value,
+        )
+
+
+class InstantiateWriterTestCase(TestCase):
+
+    @patch('pvsim.main.instantiate_component')
+    def test_instantiate_writer_without_thread(self, instantiate_mock):
+        writer = main.instantiate_writer({'writer': {}})
+        self.assertIs(writer, instantiate_mock.return_value)
+
+    @patch('pvsim.main.ThreadedWriter')
+    @patch('pvsim.main.instantiate_component')
+    def test_instantiate_writer_with_thread(self, instantiate_mock,
+                                            threaded_mock):
+        config = {'writer': {'thread': {'policy': 'spill'}}}
+        writer = main.instantiate_writer(config)
+        threaded_mock.assert_called_once_with(
+            instantiate_mock.return_value, policy='spill'
+        )
+        self.assertIs(writer, threaded_mock.return_value)
+
+
+class StartMetricsTestCase(TestCase):
+
+    def tearDown(self):
+        metrics.disable()
+
+    def test_start_metrics_without_section(self):
+        self.assertIsNone(main.start_metrics({}))
+        self.assertFalse(metrics.enabled())
+
+    @patch('pvsim.main.metrics.MetricsServer')
+    def test_start_metrics_serves_on_worker_port(self, server_mock):
+        config = {'metrics': {'port': 9000}}
+        server = main.start_metrics(config, worker=2)
+        server_mock.assert_called_once_with('127.0.0.1', 9002)
+        server.start.assert_called_once()
+        self.assertTrue(metrics.enabled())
+        self.assertIsNone(main.start_metrics(config))
+
+
+class SetLogLevelTestCase(TestCase):
+
+    @patch('pvsim.main.loggers.configure')
+    @patch.dict('pvsim.loggers.sampling')
+    def test_set_log_level_configures_logging(self, configure_mock):
+        parsed_args = MagicMock(
+            verbose=True, log_format='json', log_every=10, log_rate=2
+        )
+        main.set_log_level(parsed_args)
+        configure_mock.assert_called_once_with(logging.INFO, 'json')
+        self.assertEqual(loggers.sampling['every'], 10)
+        self.assertEqual(loggers.sampling['per_second'], 2)
+
+    @patch('pvsim.main.loggers.configure')
+    @patch.dict('pvsim.loggers.sampling')
+    def test_set_log_level_defaults_to_warnings(self, configure_mock):
+        parsed_args = MagicMock(
+            verbose=False, log_format='text', log_every=1, log_rate=0
+        )
+        main.set_log_level(parsed_args)
+        configure_mock.assert_called_once_with(logging.WARNING, 'text')
+
+
+class StartProfilerTestCase(TestCase):
+
+    def test_start_profiler_without_profile(self):
+        parsed_args = MagicMock(profile=None)
+        self.assertIsNone(main.start_profiler(parsed_args))
+
+    @patch('pvsim.profilers.SamplingProfiler')
+    def test_start_profiler_starts_sampling(self, profiler_mock):
+        parsed_args = MagicMock(profile=60, profile_output='out')
+        profiler = main.start_profiler(parsed_args)
+        profiler_mock.assert_called_once_with('out', duration=60)
+        profiler.start.assert_called_once()
+
+
+class RunSimulatorTestCase(TestCase):
+
+    @patch('pvsim.main.run_simulator_worker')
+    def test_run_simulator_runs_single_worker_by_default(self, worker_mock):
+        main.run_simulator({'simulator': {}})
+        worker_mock.assert_called_once_with({'simulator': {}})
+
+    @patch('pvsim.main.run_simulator_workers')
+    def test_run_simulator_runs_workers(self, workers_mock):
+        config = {'simulator': {'workers': 4}}
+        main.run_simulator(config)
+        workers_mock.assert_called_once_with(config, 4)
+
+    @patch('pvsim.main.multiprocessing.Process')
+    def test_run_simulator_workers_starts_processes(self, process_mock):
+        config = {'broker': {'parameters': {'queue': 'readouts'}}}
+        main.run_simulator_workers(config, 2)
+        self.assertEqual(process_mock.call_count, 2)
+        self.assertEqual(process_mock.return_value.start.call_count, 2)
+        self.assertEqual(process_mock.return_value.join.call_count, 2)
+        self.assertEqual(process_mock.call_args[1]['args'], (config, 1))
+
+    @patch('pvsim.main.logging')
+    def test_run_simulator_workers_requires_queue(self, log_mock):
+        with self.assertRaises(SystemExit):
+            main.run_simulator_workers({'broker': {'parameters': {}}}, 2)
+        log_mock.error.assert_called_once()
+
+    @patch('pvsim.main.multiprocessing.Process')
+    @patch('pvsim.main.logging')
+    def test_run_simulator_workers_require_sharded_writer(
+        self, log_mock, process_mock
+    ):
+        config = {
+            'broker': {'parameters': {'queue': 'readouts'}},
+            'writer': {'parameters': {'filepath': 'output.csv'}},
+        }
+        with self.assertRaises(SystemExit):
+            main.run_simulator_workers(config, 2)
+        log_mock.error.assert_called_once()
+        process_mock.assert_not_called()
+
+    @patch('pvsim.main.multiprocessing.Process')
+    @patch('pvsim.main.logging')
+    def test_run_simulator_workers_require_sharded_spill_path(
+        self, log_mock, process_mock
+    ):
+        config = {
+            'broker': {'parameters': {'queue': 'readouts'}},
+            'writer': {'thread': {'spill_path': 'spill.jsonl'}},
+        }
+        with self.assertRaises(SystemExit):
+            main.run_simulator_workers(config, 2)
+        log_mock.error.assert_called_once()
+        process_mock.assert_not_called()
+
+    @patch('pvsim.main.instantiate_component')
+    def test_run_simulator_worker_shards_writer(self, instantiate_mock):
+        simulator, writer, broker = MagicMock(), MagicMock(), MagicMock()
+        instantiate_mock.side_effect = [simulator, writer, broker]
+        config = {'writer': {'parameters': {'filepath': 'out-{worker}.csv'}}}
+        main.run_simulator_worker(config, 1)
+        sharded = instantiate_mock.call_args_list[1][0][1]
+        self.assertEqual(
+            sharded['writer']['parameters']['filepath'], 'out-1.csv'
+        )
+        simulator.consume_from_broker.assert_called_once_with(broker)
+        broker.disconnect.assert_called_once()
+        writer.close.assert_called_once()
+
+
+class CheckDurabilityTestCase(TestCase):
+
+    @patch('pvsim.main.logging')
+    def test_check_durability_rejects_writer_not_syncing(self, log_mock):
+        broker = MagicMock(acks_batches=True, consume_batch_size=100)
+        with self.assertRaises(SystemExit):
+            main.check_durability(broker, MagicMock(durable_sync=False))
+        log_mock.error.assert_called_once()
+
+    def test_check_durability_accepts_unacked_or_single_messages(self):
+        writer = MagicMock(durable_sync=False)
+        main.check_durability(
+            MagicMock(acks_batches=False, consume_batch_size=100), writer
+        )
+        main.check_durability(
+            MagicMock(acks_batches=True, consume_batch_size=1), writer
+        )
+        main.check_durability(
+            MagicMock(acks_batches=True, consume_batch_size=100),
+            MagicMock(durable_sync=True),
+        )
+
+
+class RunBackfillTestCase(TestCase):
+
+    @patch('pvsim.main.instantiate_component')
+    def test_run_backfill_runs_and_closes_writer(self, instantiate_mock):
+        writer, backfiller = MagicMock(), MagicMock()
+        instantiate_mock.side_effect = [
+            MagicMock(), MagicMock(), writer, backfiller
+        ]
+        main.run_backfill({})
+        backfiller.run.assert_called_once()
+        writer.close.assert_called_once()
+
+
+class RunPlotTestCase(TestCase):
+
+    @patch('pvsim.main.instantiate_component')
+    def test_run_plot_runs_plotter_with_models(self, instantiate_mock):
+        measure, simulator, plotter = MagicMock(), MagicMock(), MagicMock()
+        instantiate_mock.side_effect = [measure, simulator, plotter]
+        main.run_plot({})
+        self.assertEqual(instantiate_mock.call_args[1], {
+            'measure': measure, 'simulator': simulator,
+        })
+        plotter.run.assert_called_once()
+
+
+class RunPipelineTestCase(TestCase):
+
+    @patch('pvsim.main.run_meter')
+    def test_run_pipeline_feeds_simulator_in_process(self, run_meter_mock):
+        config = {
+            'broker': {
+                'class': 'pvsim.QueueBroker',
+                'parameters': {'name': 'test', 'poll_interval': 0.01},
+            },
+            'simulator': {'class': 'pvsim.PVSimulator'},
+            'writer': {'class': 'pvsim.benchmarks.NullWriter'},
+        }
+
+        def run_meter(config):
+            broker = main.instantiate_component('broker', config)
+            broker.publish('{"localtime": "2017-11-06", "power": 1234}')
+            while not write_mock.called:
+                time.sleep(0.01)
+
+        run_meter_mock.side_effect = run_meter
+        with patch('pvsim.benchmarks.NullWriter.write') as write_mock, \
+                patch('pvsim.benchmarks.NullWriter.close') as close_mock:
+            main.run_pipeline(config)
+        self.assertEqual(write_mock.call_args[0][0][:2], ['2017-11-06', 1.234])
+        close_mock.assert_called_once()
@@ -8,10 +8,11 @@
 # http://www.opensource.org/licenses/MIT-license
 # Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
 
+import numpy
 import pytest
 
 from mock import patch
-from pvsim.measures import HPCMeasure, Measure
+from pvsim.measures import ApplianceMeasure, HPCMeasure, Measure
 from unittest import TestCase
 
 
@@ -132,3 +133,105 @@ class HPCMeasureTestCase(TestCase):
         power, _ = self.hpcm.readout()
         self.assertEqual(power, 1234)
         power_at_mock.assert_called_once()
+
+
+class HPCMeasurePowerCurveTestCase(TestCase):
+
+    def setUp(self):
+        self.hpcm = HPCMeasure()
+
+    @patch('pvsim.measures.HPCMeasure.random_array')
+    @patch('pvsim.measures.HPCMeasure.random', return_value=1)
+    def test_power_curve_matches_power_at(self, _, random_array_mock):
+        random_array_mock.side_effect = lambda size, *args: numpy.ones(size)
+        seconds = numpy.arange(0, self.hpcm.day_length, 60)
+        curve = self.hpcm.power_curve(seconds)
+        expected = [self.hpcm.power_at(s) for s in seconds]
+        numpy.testing.assert_allclose(curve, expected)
+
+    def test_power_curve_is_reproducible(self):
+        seconds = self.hpcm.day_range(1)
+        curve_a = self.hpcm.power_curve(seconds, random_state=42)
+        curve_b = self.hpcm.power_curve(seconds, random_state=42)
+        self.assertEqual(curve_a.shape, (self.hpcm.day_length,))
+        numpy.testing.assert_array_equal(curve_a, curve_b)
+
+    def test_seeded_readouts_are_reproducible(self):
+        measure_a, measure_b = HPCMeasure(seed=42), HPCMeasure(seed=42)
+        self.assertEqual(
+            [measure_a.power_at(12 * 3600) for _ in range(3)],
+            [measure_b.power_at(12 * 3600) for _ in range(3)],
+        )
+
+
+class ApplianceMeasureTestCase(TestCase):
+
+    def setUp(self):
+        self.kettle = {
+            'name': 'kettle', 'power': 2000, 'duration': 180, 'weekday': 3,
+            'weekend': 0,
+        }
+        self.measure = ApplianceMeasure([self.kettle], base_load=0, seed=42)
+        self.weekday = 17476  # 2017-11-06, a Monday
+        self.saturday = 17481
+
+    def test_init_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            ApplianceMeasure([dict(self.kettle, duration=0)])
+
+    def test_is_weekend(self):
+        self.assertFalse(self.measure.is_weekend(self.weekday))
+        self.assertTrue(self.measure.is_weekend(self.saturday))
+
+    def test_day_is_a_step_function_of_uses(self):
+        times, levels = self.measure.day(self.weekday)[:2]
+        self.assertEqual(times[0], 0)
+        self.assertTrue((numpy.diff(times) >= 0).all())
+        self.assertTrue(set(numpy.round(levels)) <= set(range(0, 8001)))
+        self.assertEqual(levels[-1], 0)
+
+    def test_day_uses_weekend_profile(self):
+        times, levels = self.measure.day(self.saturday)[:2]
+        self.assertEqual(times.tolist(), [0])
+        self.assertEqual(levels.tolist(), [0])
+
+    def test_day_is_cached(self):
+        day = self.measure.day(self.weekday)
+        self.assertIs(self.measure.day(self.weekday), day)
+        self.measure.day(self.weekday + 1)
+        self.measure.day(self.weekday + 2)
+        self.assertIsNot(self.measure.day(self.weekday), day)
+
+    def test_seeded_days_are_reproducible(self):
+        other = ApplianceMeasure([self.kettle], base_load=0, seed=42)
+        numpy.testing.assert_array_equal(
+            self.measure.day(self.weekday)[0], other.day(self.weekday)[0]
+        )
+
+    def test_power_at_is_power_of_appliances_in_use(self):
+        times, levels = self.measure.day(self.weekday)[:2]
+        for time, level in zip(times, levels):
+            self.assertEqual(
+                self.measure.power_at(int(time) + 1, self.weekday), level
+            )
+
+    def test_power_curve_at_matches_power_at(self):
+        timestamps = numpy.arange(
+            numpy.datetime64('2017-11-06T00:00:00'),
+            numpy.datetime64('2017-11-07T00:00:00'),
+            numpy.timedelta64(60, 's'),
+        )
+        curve = self.measure.power_curve_at(timestamps)
+        expected = [
+            self.measure.power_at(s, self.weekday)
+            for s in range(0, 24 * 3600, 60)
+        ]
+        numpy.testing.assert_allclose(curve, expected)
+
+    @patch('pvsim.measures.ApplianceMeasure.random', return_value=1)
+    def test_readout_uses_day_of_timestamp(self, _):
+        measure = ApplianceMeasure([self.kettle], base_load=150, seed=42)
+        with patch.object(measure, 'current_seconds_and_time') as time_mock:
+            time_mock.return_value = 0, '2017-11-11T00:00:00'
+            self.assertEqual(measure.readout(), (150, '2017-11-11T00:00:00'))
+        self.assertIn(self.saturday, measure._days)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of pvsim.
+# https://github.com/scorphus/pvism
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/MIT-license
+# Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
+
+import json
+
+from mock import MagicMock, patch
+from pvsim.measures import HPCMeasure
+from pvsim.meters import FleetMeter, GenericMeter
+from pvsim.serializers import BinarySerializer
+from unittest import TestCase
+
+
+class GenericMeterTestCase(TestCase):
+
+    def setUp(self):
+        self.measure = MagicMock()
+        self.measure.readout.return_value = (1234, '2017-11-06T12:00:00')
+        self.broker = MagicMock()
+        self.broker.flush_due_in.return_value = None
+        self.meter = GenericMeter(self.measure, self.broker)
+
+    def test_publish_publishes_readout(self):
+        self.meter.publish()
+        timestamp = self.measure.readout.call_args[0][0]
+        self.assertIsNotNone(timestamp)
+        body = self.broker.publish.call_args[0][0]
+        self.assertEqual(json.loads(body), {
+            'localtime': '2017-11-06T12:00:00', 'power': 1234,
+            'timestamp': timestamp,
+        })
+
+    def test_init_raises_value_error(self):
+        with self.assertRaises(ValueError) as e:
+            GenericMeter(self.measure, self.broker, interval=0)
+        self.assertIn('interval', e.exception.args[0])
+        with self.assertRaises(ValueError) as e:
+            GenericMeter(self.measure, self.broker, missed_tick_policy='no')
+        self.assertIn('missed tick policy', e.exception.args[0])
+        with self.assertRaises(ValueError) as e:
+            GenericMeter(self.measure, self.broker, serializer='xml')
+        self.assertIn('no such serializer', e.exception.args[0])
+
+    @patch('pvsim.meters.time.time', return_value=1509969600.5)
+    def test_publish_publishes_binary_readout(self, _):
+        self.meter.serializer = BinarySerializer()
+        self.meter.publish()
+        body = self.broker.publish.call_args[0][0]
+        reading, = self.meter.serializer.decode(body)
+        self.assertEqual(reading['timestamp'], 1509969600.5)
+        self.assertEqual(reading['power'], 1234)
+
+    @patch('pvsim.meters.time.time', return_value=1000.5)
+    @patch('pvsim.meters.monotonic', return_value=10)
+    def test_first_deadline_is_aligned_to_interval(self, *mocks):
+        self.assertEqual(self.meter.first_deadline(), 11.5)
+        self.meter.interval = 0.25
+        self.assertEqual(self.meter.first_deadline(), 10.25)
+
+    @patch('pvsim.meters.monotonic', return_value=10.5)
+    def test_next_deadline_does_not_drift(self, _):
+        self.assertEqual(self.meter.next_deadline(10), 12)
+        self.assertEqual(self.meter.missed_ticks, 0)
+
+    @patch('pvsim.meters.logging')
+    @patch('pvsim.meters.monotonic', return_value=17)
+    def test_next_deadline_skips_missed_ticks(self, *mocks):
+        self.assertEqual(self.meter.next_deadline(10), 16)
+        self.assertEqual(self.meter.missed_ticks, 2)
+
+    @patch('pvsim.meters.logging')
+    @patch('pvsim.meters.monotonic', return_value=17)
+    def test_next_deadline_catches_up_missed_ticks(self, *mocks):
+        self.meter.missed_tick_policy = 'catch-up'
+        self.assertEqual(self.meter.next_deadline(10), 12)
+        self.assertEqual(self.meter.missed_ticks, 0)
+
+    @patch('pvsim.meters.time.sleep')
+    @patch('pvsim.meters.monotonic')
+    @patch('pvsim.meters.time.time', return_value=1000)
+    def test_publish_periodically_sleeps_until_deadlines(
+        self, time_mock, monotonic_mock, sleep_mock
+    ):
+        # first_deadline, then (sleep, next_deadline) per tick
+        monotonic_mock.side_effect = [10, 10, 12.5, 12.5, 14.5, 16]
+        self.meter.publish = MagicMock(
+            side_effect=[None, None, KeyboardInterrupt]
+        )
+        self.meter.publish_periodically()
+        self.assertEqual(
+            [c[0][0] for c in sleep_mock.call_args_list], [2, 1.5]
+        )
+        self.assertEqual(self.meter.publish.call_count, 3)
+
+    @patch('pvsim.meters.time.sleep')
+    def test_sleep_flushes_broker_at_max_latency(self, sleep_mock):
+        self.broker.flush_due_in.side_effect = [0.1, None]
+        self.meter.sleep(2)
+        self.broker.flush.assert_called_once()
+        self.assertEqual(
+            [c[0][0] for c in sleep_mock.call_args_list], [0.1, 1.9]
+        )
+
+    @patch('pvsim.meters.time.sleep')
+    def test_sleep_leaves_flushing_to_next_tick(self, sleep_mock):
+        self.broker.flush_due_in.return_value = 3
+        self.meter.sleep(2)
+        self.broker.flush.assert_not_called()
+        sleep_mock.assert_called_once_with(2)
+
+    def test_publish_timestamps_with_clock(self):
+        clock = MagicMock()
+        clock.now.return_value = 1509969600
+        meter = GenericMeter(self.measure, self.broker, clock=clock)
+        meter.publish()
+        self.measure.set_clock.assert_called_once_with(clock)
+        self.measure.readout.assert_called_once_with(1509969600)
+
+
+class FleetMeterTestCase(TestCase):
+
+    def setUp(self):
+        self.broker = MagicMock()
+        self.meter = FleetMeter(HPCMeasure(), self.broker, size=50, seed=42)
+
+    def test_init_jitters_each_meter(self):
+        self.assertEqual(len(self.meter.meter_ids), 50)
+        self.assertEqual(self.meter.meter_ids[7], 7)
+        self.assertTrue((abs(self.meter.offsets) <= 1800).all())
+        self.assertTrue((abs(self.meter.scales - 1) <= 0.2).all())
+        self.assertGreater(len(set(self.meter.scales)), 1)
+
+    @patch('pvsim.measures.HPCMeasure.current_seconds_and_time')
+    def test_readouts_computes_all_meters_at_once(self, current_mock):
+        current_mock.return_value = (12 * 3600, '2017-11-06T12:00:00')
+        readings = self.meter.readouts()
+        self.assertEqual(len(readings), 50)
+        self.assertEqual(readings[3]['meter_id'], 3)
+        self.assertEqual(readings[3]['localtime'], '2017-11-06T12:00:00')
+        self.assertTrue(all(reading['power'] > 0 for reading in readings))
+
+    @patch('pvsim.measures.HPCMeasure.current_seconds_and_time')
+    def test_publish_publishes_batch(self, current_mock):
+        current_mock.return_value = (23 * 3600, '2017-11-06T23:00:00')
+        self.meter.publish()
+        bodies = self.broker.publish_many.call_args[0][0]
+        self.assertEqual(len(bodies), 50)
+        message = json.loads(bodies[3])
+        self.assertEqual(message['meter_id'], 3)
+        self.assertEqual(message['localtime'], '2017-11-06T23:00:00')
+        self.assertGreater(message['power'], 0)
+
+    @patch('pvsim.measures.HPCMeasure.current_seconds_and_time')
+    def test_publish_publishes_binary_frames(self, current_mock):
+        current_mock.return_value = (23 * 3600, '2017-11-06T23:00:00')
+        self.meter.serializer = BinarySerializer()
+        self.meter.frame_size = 20
+        self.meter.publish()
+        bodies = self.broker.publish_many.call_args[0][0]
+        self.assertEqual(len(bodies), 3)
+        readings = sum([self.meter.serializer.decode(b) for b in bodies], [])
+        self.assertEqual([r['meter_id'] for r in readings], list(range(50)))
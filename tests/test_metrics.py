@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of pvsim.
+# https://github.com/scorphus/pvism
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/MIT-license
+# Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
+
+import json
+
+from mock import MagicMock, patch
+from pvsim import metrics
+from pvsim.meters import GenericMeter
+from pvsim.metrics import (
+    NULL_METRIC, Counter, Gauge, Histogram, MetricsServer, Registry
+)
+from pvsim.simulators import PVSimulator
+from unittest import TestCase
+
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen  # Python 2
+
+
+class MetricTestCase(TestCase):
+
+    def test_counter_renders_value(self):
+        counter = Counter('pvsim_test_total', 'Test counter')
+        counter.inc()
+        counter.inc(2)
+        self.assertEqual(counter.render(), '\n'.join([
+            '# HELP pvsim_test_total Test counter',
+            '# TYPE pvsim_test_total counter',
+            'pvsim_test_total 3.0',
+        ]))
+
+    def test_gauge_reads_function(self):
+        gauge = Gauge('pvsim_test', 'Test gauge')
+        gauge.set(4)
+        self.assertEqual(gauge.samples(), [('pvsim_test', 4)])
+        gauge.set_function(lambda: 7)
+        self.assertEqual(gauge.samples(), [('pvsim_test', 7)])
+
+    def test_histogram_counts_cumulative_buckets(self):
+        histogram = Histogram('pvsim_test_seconds', 'Test', buckets=(1, 2))
+        for value in (0.5, 1, 1.5, 3):
+            histogram.observe(value)
+        self.assertEqual(histogram.samples(), [
+            ('pvsim_test_seconds_bucket{le="1.0"}', 2),
+            ('pvsim_test_seconds_bucket{le="2.0"}', 3),
+            ('pvsim_test_seconds_bucket{le="+Inf"}', 4),
+            ('pvsim_test_seconds_sum', 6),
+            ('pvsim_test_seconds_count', 4),
+        ])
+
+    @patch('pvsim.metrics.monotonic', side_effect=[10, 10.25])
+    def test_histogram_times_blocks(self, _):
+        histogram = Histogram('pvsim_test_seconds', 'Test')
+        with histogram.time():
+            pass
+        self.assertEqual(histogram.sum, 0.25)
+
+
+class RegistryTestCase(TestCase):
+
+    def tearDown(self):
+        metrics.disable()
+
+    def test_registry_returns_same_metric_by_name(self):
+        registry = Registry()
+        self.assertIs(
+            registry.counter('pvsim_a_total', 'A'),
+            registry.counter('pvsim_a_total', 'A'),
+        )
+
+    def test_registry_renders_metrics_sorted(self):
+        registry = Registry()
+        registry.counter('pvsim_b_total', 'B')
+        registry.gauge('pvsim_a', 'A')
+        rendered = registry.render()
+        self.assertLess(rendered.index('pvsim_a'), rendered.index('pvsim_b'))
+
+    def test_metrics_are_disabled_by_default(self):
+        self.assertFalse(metrics.enabled())
+        self.assertIs(metrics.counter('pvsim_a_total', 'A'), NULL_METRIC)
+        with metrics.histogram('pvsim_a_seconds', 'A').time():
+            pass
+
+    def test_enable_keeps_registry(self):
+        registry = metrics.enable()
+        self.assertIs(metrics.enable(), registry)
+        self.assertIsInstance(metrics.counter('pvsim_a_total', 'A'), Counter)
+
+
+class InstrumentationTestCase(TestCase):
+
+    def setUp(self):
+        self.registry = metrics.enable()
+
+    def tearDown(self):
+        metrics.disable()
+
+    def value(self, name):
+        return self.registry.metrics[name].samples()[-1][1]
+
+    def test_meter_counts_readings_and_failures(self):
+        measure, broker = MagicMock(), MagicMock()
+        measure.readout.return_value = (1234, '2017-11-06T12:00:00')
+        meter = GenericMeter(measure, broker)
+        meter.publish()
+        broker.publish.return_value = False
+        meter.publish()
+        self.assertEqual(self.value('pvsim_meter_readings_total'), 1)
+        self.assertEqual(self.value('pvsim_meter_publish_failures_total'), 1)
+
+    def test_simulator_counts_readings_and_decode_errors(self):
+        pvs = PVSimulator()
+        pvs.set_writer(MagicMock())
+        data = {'localtime': '2017-11-06T12:00:00', 'power': 1234}
+        with patch.object(pvs, 'current_seconds', return_value=12 * 3600 + 3):
+            pvs.message_received(json.dumps(data).encode())
+        pvs.message_received(b'bad')
+        self.assertEqual(self.value('pvsim_simulator_messages_total'), 2)
+        self.assertEqual(self.value('pvsim_simulator_readings_total'), 1)
+        self.assertEqual(self.value('pvsim_simulator_decode_errors_total'), 1)
+        self.assertEqual(self.value('pvsim_simulator_consume_lag_seconds'), 3)
+
+
+class MetricsServerTestCase(TestCase):
+
+    def tearDown(self):
+        metrics.disable()
+
+    def test_server_serves_metrics(self):
+        metrics.enable().counter('pvsim_a_total', 'A').inc()
+        server = MetricsServer(port=0)
+        server.start()
+        try:
+            url = 'http://127.0.0.1:{}/metrics'.format(server.server_port)
+            body = urlopen(url, timeout=5).read().decode()
+        finally:
+            server.stop()
+        self.assertIn('pvsim_a_total 1.0', body)
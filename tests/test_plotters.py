@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of pvsim.
+# https://github.com/scorphus/pvism
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/MIT-license
+# Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
+
+import numpy
+import os
+import shutil
+import tempfile
+
+from mock import patch
+from pvsim import plotters
+from pvsim.measures import HPCMeasure
+from pvsim.plotters import MinMaxDownsampler, Plotter
+from pvsim.simulators import PVSimulator
+from pvsim.writers import CSVWriter, ParquetWriter
+from unittest import TestCase, skipIf
+
+
+def timestamps(start, count, step=1):
+    return numpy.datetime64(start, 's') + numpy.arange(count) * step
+
+
+class MinMaxDownsamplerTestCase(TestCase):
+
+    def test_add_keeps_min_and_max_of_each_bin(self):
+        downsampler = MinMaxDownsampler(bins=4, series=2, bin_width=10)
+        values = numpy.column_stack([numpy.arange(40), -numpy.arange(40)])
+        downsampler.add(timestamps('2017-11-06', 40), values)
+        times, mins, maxs = downsampler.envelope()
+        self.assertEqual(str(times[0]), '2017-11-06T00:00:05')
+        self.assertEqual(mins[:, 0].tolist(), [0, 10, 20, 30])
+        self.assertEqual(maxs[:, 0].tolist(), [9, 19, 29, 39])
+        self.assertEqual(mins[:, 1].tolist(), [-9, -19, -29, -39])
+        self.assertEqual(downsampler.count, 40)
+
+    def test_add_merges_bins_when_outgrown(self):
+        downsampler = MinMaxDownsampler(bins=4, series=1, bin_width=1)
+        downsampler.add(timestamps('2017-11-06', 4), [[1], [2], [3], [4]])
+        downsampler.add(timestamps('2017-11-06T00:00:04', 4), [[5]] * 4)
+        self.assertEqual(downsampler.bin_width, 2)
+        _, mins, maxs = downsampler.envelope()
+        self.assertEqual(mins[:, 0].tolist(), [1, 3, 5, 5])
+        self.assertEqual(maxs[:, 0].tolist(), [2, 4, 5, 5])
+
+    def test_add_does_not_depend_on_chunks(self):
+        values = numpy.random.RandomState(42).random_sample((1000, 3))
+        whole = MinMaxDownsampler(bins=16)
+        whole.add(timestamps('2017-11-06', 1000), values)
+        chunked = MinMaxDownsampler(bins=16)
+        for start in range(0, 1000, 70):
+            chunked.add(
+                timestamps('2017-11-06', 1000)[start:start + 70],
+                values[start:start + 70],
+            )
+        numpy.testing.assert_array_equal(whole.mins, chunked.mins)
+        numpy.testing.assert_array_equal(whole.maxs, chunked.maxs)
+
+    def test_add_accepts_unordered_timestamps(self):
+        downsampler = MinMaxDownsampler(bins=2, series=1, bin_width=10)
+        downsampler.add(timestamps('2017-11-06', 3, 5)[::-1], [[1], [2], [3]])
+        _, mins, maxs = downsampler.envelope()
+        self.assertEqual(mins[:, 0].tolist(), [2, 1])
+        self.assertEqual(maxs[:, 0].tolist(), [3, 1])
+
+    def test_envelope_skips_empty_bins(self):
+        downsampler = MinMaxDownsampler(bins=4, series=1, bin_width=10)
+        self.assertEqual(len(downsampler.envelope()[0]), 0)
+        downsampler.add(timestamps('2017-11-06', 2, 30), [[1], [2]])
+        times, _, _ = downsampler.envelope()
+        self.assertEqual(len(times), 2)
+
+
+@patch('pvsim.plotters.Figure')
+class PlotterTestCase(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.measure, self.simulator = HPCMeasure(), PVSimulator()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def backfill(self, writer):
+        rows = []
+        for chunk_timestamps, powers in plotters.model_chunks(
+            self.measure, self.simulator, '2017-11-06', '2017-11-07', 60
+        ):
+            localtimes = numpy.datetime_as_string(chunk_timestamps, unit='s')
+            rows.extend(
+                [t] + p for t, p in zip(localtimes.tolist(), powers.tolist())
+            )
+        writer.write_many(rows)
+        writer.close()
+        return writer.filepath
+
+    def test_init_requires_matplotlib(self, _):
+        with patch('pvsim.plotters.Figure', None):
+            with self.assertRaises(ImportError):
+                Plotter(self.measure, self.simulator)
+
+    def test_start_and_end_default_to_today(self, _):
+        plotter = Plotter(self.measure, self.simulator)
+        self.assertEqual(
+            plotter.end - plotter.start, numpy.timedelta64(86400, 's')
+        )
+
+    def test_downsample_models_to_width(self, _):
+        plotter = Plotter(
+            self.measure, self.simulator, start='2017-11-06',
+            end='2017-11-13', step=60, width=100,
+        )
+        downsampler = plotter.downsample()
+        self.assertEqual(downsampler.count, 7 * 24 * 60)
+        self.assertEqual(len(downsampler.envelope()[0]), 100)
+
+    def test_downsample_csv_file(self, _):
+        filepath = self.backfill(
+            CSVWriter(os.path.join(self.tmpdir, 'out.csv'))
+        )
+        plotter = Plotter(None, None, filepath=filepath, width=100)
+        self.assertEqual(plotter.downsample().count, 24 * 60)
+
+    def test_downsample_csv_file_without_pyarrow(self, _):
+        filepath = self.backfill(
+            CSVWriter(os.path.join(self.tmpdir, 'out.csv'))
+        )
+        plotter = Plotter(None, None, filepath=filepath, chunk_size=100)
+        expected = plotter.downsample()
+        with patch('pvsim.plotters.pyarrow', None):
+            downsampler = plotter.downsample()
+        self.assertEqual(downsampler.count, 24 * 60)
+        numpy.testing.assert_allclose(downsampler.maxs, expected.maxs)
+
+    @skipIf(plotters.pyarrow is None, 'pyarrow is not installed')
+    def test_downsample_parquet_file(self, _):
+        filepath = self.backfill(
+            ParquetWriter(os.path.join(self.tmpdir, 'out.parquet'))
+        )
+        plotter = Plotter(None, None, filepath=filepath)
+        self.assertEqual(plotter.downsample().count, 24 * 60)
+
+    def test_run_renders_three_curves(self, figure_mock):
+        output = os.path.join(self.tmpdir, 'plot.svg')
+        plotter = Plotter(
+            self.measure, self.simulator, output=output, start='2017-11-06',
+            step=60,
+        )
+        self.assertEqual(plotter.run(), 24 * 60)
+        axes = figure_mock.return_value.add_subplot.return_value
+        self.assertEqual(axes.plot.call_count, 3)
+        figure_mock.return_value.savefig.assert_called_once_with(output)
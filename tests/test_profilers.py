@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of pvsim.
+# https://github.com/scorphus/pvism
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/MIT-license
+# Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
+
+import os
+import shutil
+import signal
+import tempfile
+import threading
+
+from mock import MagicMock, call, patch
+from pvsim import serializers, writers
+from pvsim.measures import HPCMeasure
+from pvsim.profilers import SamplingProfiler, frame_name, stage_of
+from unittest import TestCase
+
+
+def outer():
+    pass
+
+
+class StageOfTestCase(TestCase):
+
+    def test_stage_of_innermost_pvsim_frame(self):
+        stack = (
+            writers.CSVWriter.flush.__code__,
+            HPCMeasure.power_at.__code__,
+            outer.__code__,
+        )
+        self.assertEqual(stage_of(stack), 'measure')
+
+    def test_stage_of_function_overrides_module(self):
+        self.assertEqual(
+            stage_of((serializers.JSONSerializer.decode.__code__,)), 'decode'
+        )
+        self.assertEqual(
+            stage_of((serializers.JSONSerializer.encode.__code__,)), 'encode'
+        )
+
+    def test_stage_of_foreign_stack(self):
+        self.assertEqual(stage_of((outer.__code__,)), 'other')
+
+    def test_stage_of_waiting_stack(self):
+        stack = (
+            writers.ThreadedWriter._run.__code__,
+            threading.Condition.wait.__code__,
+        )
+        self.assertEqual(stage_of(stack), 'idle')
+        self.assertEqual(stage_of(stack[:1]), 'write')
+
+    def test_frame_name(self):
+        self.assertEqual(
+            frame_name(HPCMeasure.power_at.__code__).split('.')[-1],
+            'power_at',
+        )
+        self.assertTrue(frame_name(outer.__code__).startswith('test_'))
+
+
+class SamplingProfilerTestCase(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.output = os.path.join(self.tmpdir, 'profile')
+        self.profiler = SamplingProfiler(self.output)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_sample_counts_stacks(self):
+        self.profiler.sample()
+        self.profiler.sample()
+        self.assertEqual(self.profiler.samples, 2)
+        self.assertTrue(self.profiler.stacks)
+
+    def test_folded_lines_start_with_stage(self):
+        self.profiler.sample()
+        for line in self.profiler.folded():
+            stack, count = line.rsplit(' ', 1)
+            self.assertIn(stack.split(';')[0], (
+                'measure', 'encode', 'publish', 'consume', 'decode',
+                'compute', 'write', 'schedule', 'idle', 'other',
+            ))
+            self.assertGreater(int(count), 0)
+
+    def test_stats_count_self_and_total_samples(self):
+        self.profiler.sample()
+        stages, functions = self.profiler.stats()
+        name = frame_name(self.test_stats_count_self_and_total_samples
+                          .__code__)
+        own, total = functions[name]
+        self.assertEqual(own, 0)
+        self.assertEqual(total, 1)
+        self.assertEqual(sum(stages.values()), len(self.profiler.stacks))
+
+    def test_sample_skips_helper_threads(self):
+        stop = threading.Event()
+        helper = threading.Thread(target=stop.wait, name='compressor')
+        worker = threading.Thread(target=stop.wait, name='writer')
+        helper.start()
+        worker.start()
+        try:
+            self.profiler.sample()
+        finally:
+            stop.set()
+            helper.join()
+            worker.join()
+        waits = [
+            stack for stack in self.profiler.stacks
+            if frame_name(stack[0]).endswith('Thread._bootstrap')
+        ]
+        self.assertEqual(len(waits), 1)
+        self.assertEqual(stage_of(waits[0]), 'idle')
+
+    def test_report_leaves_idle_samples_out(self):
+        idle = (outer.__code__, threading.Condition.wait.__code__)
+        busy = (HPCMeasure.power_at.__code__,)
+        self.profiler.stacks = {idle: 3, busy: 1}
+        stages, functions = self.profiler.stats()
+        self.assertEqual(stages, {'idle': 3, 'measure': 1})
+        self.assertNotIn(frame_name(outer.__code__), functions)
+        report = self.profiler.report()
+        self.assertIn('       1  100.0%  measure', report)
+        self.assertIn('       3       -  idle', report)
+
+    def test_dump_writes_files(self):
+        self.profiler.sample()
+        self.profiler.dump()
+        with open(self.output + '.folded') as fp:
+            self.assertIn(';', fp.read())
+        with open(self.output + '.txt') as fp:
+            self.assertIn('function', fp.read())
+
+    @patch('pvsim.profilers.os.kill')
+    def test_run_interrupts_main_thread_after_duration(self, kill_mock):
+        profiler = SamplingProfiler(self.output, duration=0.01, interval=0.001)
+        profiler.start()
+        profiler._thread.join(5)
+        self.assertTrue(profiler.expired)
+        kill_mock.assert_called_once()
+        profiler.stop()
+        self.assertTrue(os.path.exists(self.output + '.txt'))
+
+    @patch('pvsim.profilers.multiprocessing.active_children')
+    @patch('pvsim.profilers.os.kill')
+    def test_interrupt_reaches_child_processes(self, kill_mock,
+                                               children_mock):
+        children_mock.return_value = [MagicMock(pid=101), MagicMock(pid=102)]
+        self.profiler.interrupt()
+        self.assertEqual(kill_mock.call_args_list, [
+            call(101, signal.SIGINT),
+            call(102, signal.SIGINT),
+            call(os.getpid(), signal.SIGINT),
+        ])
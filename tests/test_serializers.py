@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of pvsim.
+# https://github.com/scorphus/pvism
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/MIT-license
+# Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
+
+import json
+import struct
+
+from datetime import datetime
+from pvsim.clocks import RealClock, ZoneInfo
+from pvsim.serializers import (
+    BinarySerializer, JSONSerializer, Serializer, get_serializer,
+    serializer_for,
+)
+from unittest import TestCase, skipIf
+
+
+READING = {
+    'timestamp': 1509969600.0,
+    'localtime': datetime.fromtimestamp(1509969600).isoformat(),
+    'power': 1234.5,
+    'meter_id': 7,
+}
+
+
+class SerializerTestCase(TestCase):
+
+    def test_methods_raise_not_implemented(self):
+        serializer = Serializer()
+        with self.assertRaises(NotImplementedError):
+            serializer.encode(READING)
+        with self.assertRaises(NotImplementedError):
+            serializer.encode_many([READING])
+        with self.assertRaises(NotImplementedError):
+            serializer.decode(b'')
+
+    def test_get_serializer(self):
+        self.assertIsInstance(get_serializer('json'), JSONSerializer)
+        self.assertIsInstance(get_serializer('binary'), BinarySerializer)
+        with self.assertRaises(ValueError):
+            get_serializer('xml')
+
+    def test_serializer_for_recognizes_frames(self):
+        body = BinarySerializer().encode(READING)
+        self.assertIsInstance(serializer_for(body), BinarySerializer)
+        self.assertIsInstance(serializer_for(b'{}'), JSONSerializer)
+        self.assertIs(serializer_for(body), serializer_for(body))
+
+
+class JSONSerializerTestCase(TestCase):
+
+    def setUp(self):
+        self.serializer = JSONSerializer()
+
+    def test_encode_keeps_compatible_message(self):
+        reading = dict(READING, timestamp=None, meter_id=None)
+        self.assertEqual(json.loads(self.serializer.encode(reading)), {
+            'localtime': READING['localtime'], 'power': 1234.5,
+        })
+
+    def test_encode_keeps_timestamp(self):
+        message = json.loads(self.serializer.encode(READING))
+        self.assertEqual(message['timestamp'], READING['timestamp'])
+
+    def test_encode_many_and_decode(self):
+        body = self.serializer.encode_many([READING, READING]).encode()
+        readings = self.serializer.decode(body)
+        self.assertEqual(len(readings), 2)
+        self.assertEqual(readings[0]['meter_id'], 7)
+
+    def test_decode_single_message(self):
+        body = self.serializer.encode(READING).encode()
+        self.assertEqual(self.serializer.decode(body)[0]['power'], 1234.5)
+
+
+class BinarySerializerTestCase(TestCase):
+
+    def setUp(self):
+        self.serializer = BinarySerializer()
+
+    def test_init_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            BinarySerializer('q')
+
+    def test_encode_is_fixed_width(self):
+        body = self.serializer.encode(READING)
+        self.assertEqual(len(body), 9 + 20)
+        self.assertEqual(len(BinarySerializer('f').encode(READING)), 9 + 16)
+
+    def test_encode_many_and_decode(self):
+        body = self.serializer.encode_many([READING, READING, READING])
+        readings = self.serializer.decode(body)
+        self.assertEqual(readings, [READING] * 3)
+
+    def test_decode_float32_frame(self):
+        body = BinarySerializer('f').encode(READING)
+        reading, = self.serializer.decode(body)
+        self.assertEqual(reading['power'], 1234.5)
+
+    def test_decode_raises_on_bad_frames(self):
+        body = self.serializer.encode(READING)
+        with self.assertRaises(struct.error):
+            self.serializer.decode(body[:-1])
+        with self.assertRaises(struct.error):
+            self.serializer.decode(b'XYZ' + body[3:])
+        with self.assertRaises(struct.error):
+            self.serializer.decode(b'PV')
+
+    def test_decode_raises_on_unknown_power_format(self):
+        body = self.serializer.encode(READING)
+        for power_format in (b'x', b'\xff'):
+            with self.assertRaises(struct.error):
+                self.serializer.decode(body[:4] + power_format + body[5:])
+
+    @skipIf(ZoneInfo is None, 'time zones require Python 3.9+')
+    def test_decode_converts_timestamps_with_clock(self):
+        clock = RealClock('Asia/Tokyo')
+        reading = dict(READING, timestamp=1498014000)  # 12:00 in Tokyo
+        body = self.serializer.encode(reading)
+        decoded, = self.serializer.decode(body, clock)
+        self.assertEqual(decoded['localtime'], '2017-06-21T12:00:00')
+        decoded, = self.serializer.decode(body, RealClock('UTC'))
+        self.assertEqual(decoded['localtime'], '2017-06-21T03:00:00')
@@ -9,10 +9,15 @@
 # Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
 
 import json
+import numpy
 
 from mock import MagicMock, patch
-from pvsim.simulators import PVSimulator
-from unittest import TestCase
+from pvsim.clocks import RealClock, SimulatedClock, ZoneInfo
+from pvsim.measures import HPCMeasure
+from pvsim.meters import GenericMeter
+from pvsim.serializers import BinarySerializer
+from pvsim.simulators import PVSimulator, SolarPVSimulator
+from unittest import TestCase, skipIf
 
 
 class PVSimulatorTestCase(TestCase):
@@ -43,11 +48,163 @@ class PVSimulatorTestCase(TestCase):
         power = self.pvs.power_at(noon)
         self.assertGreater(power, 0)
 
+    @patch('pvsim.simulators.PVSimulator.random_array')
+    @patch('pvsim.simulators.PVSimulator.random', return_value=1)
+    def test_power_curve_matches_power_at(self, _, random_array_mock):
+        random_array_mock.side_effect = lambda size, **kwargs: numpy.ones(size)
+        seconds = numpy.arange(0, self.pvs.day_length, 60)
+        curve = self.pvs.power_curve(seconds)
+        expected = [self.pvs.power_at(s) for s in seconds]
+        numpy.testing.assert_allclose(curve, expected)
+
+    def test_power_curve_is_reproducible(self):
+        seconds = self.pvs.day_range(1)
+        curve_a = self.pvs.power_curve(seconds, random_state=42)
+        curve_b = self.pvs.power_curve(seconds, random_state=42)
+        self.assertEqual(curve_a.shape, (self.pvs.day_length,))
+        numpy.testing.assert_array_equal(curve_a, curve_b)
+
+    @patch('pvsim.simulators.PVSimulator.random', return_value=1)
+    def test_cached_power_at_matches_power_at(self, _):
+        for seconds in range(0, self.pvs.day_length, 60):
+            self.assertAlmostEqual(
+                self.pvs.cached_power_at(seconds),
+                self.pvs.power_at(seconds),
+                places=3,
+            )
+
+    def test_profile_is_computed_once(self):
+        profile = self.pvs.profile
+        self.assertEqual(profile.shape, (self.pvs.day_length,))
+        self.assertEqual(profile.dtype, numpy.float32)
+        self.assertIs(self.pvs.profile, profile)
+
+    def test_profile_is_invalidated_when_parameters_change(self):
+        profile = self.pvs.profile
+        self.pvs.sunset = 18 * 3600
+        self.assertIsNot(self.pvs.profile, profile)
+        self.assertEqual(self.pvs.profile[19 * 3600], 0)
+        self.assertGreater(profile[19 * 3600], 0)
+
+    @patch('pvsim.simulators.PVSimulator.current_power_and_time')
+    @patch('pvsim.clocks.Clock.seconds_and_localtime')
+    def test_message_received_skips_time_formatting(self, *mocks):
+        data = {'localtime': '2017-11-06', 'power': 1234}
+        self.pvs.set_writer(MagicMock())
+        self.pvs.message_received(json.dumps(data).encode())
+        for mock in mocks:
+            self.assertEqual(mock.call_count, 0)
+
     def test_consume_from_broker_starts_comsuming(self):
-        broker = MagicMock()
+        broker = MagicMock(consume_batch_size=1)
         self.pvs.consume_from_broker(broker)
         broker.start_consuming.assert_called_once()
 
+    def test_consume_from_broker_starts_consuming_batches(self):
+        broker = MagicMock(consume_batch_size=100)
+        self.pvs.consume_from_broker(broker)
+        broker.start_consuming_batches.assert_called_once_with(
+            self.pvs.messages_received
+        )
+        self.assertEqual(broker.start_consuming.call_count, 0)
+        self.assertIs(self.pvs.sync_batches, broker.acks_batches)
+
+    def test_consume_from_broker_syncs_only_acked_batches(self):
+        for acks_batches in (False, True):
+            broker = MagicMock(
+                consume_batch_size=100, acks_batches=acks_batches
+            )
+            self.pvs.consume_from_broker(broker)
+            self.assertIs(self.pvs.sync_batches, acks_batches)
+
+    def test_consume_from_broker_drains_writer_on_interrupt(self):
+        broker = MagicMock(consume_batch_size=1)
+        broker.start_consuming.side_effect = KeyboardInterrupt
+        writer = MagicMock()
+        self.pvs.set_writer(writer)
+        self.pvs.consume_from_broker(broker)
+        writer.flush.assert_called_once()
+
+    @patch('pvsim.simulators.logging.error')
+    def test_messages_received_writes_and_syncs_batch(self, error_mock):
+        data = {'localtime': '2017-11-06', 'power': 1234}
+        writer = MagicMock()
+        self.pvs.set_writer(writer)
+        self.pvs.sync_batches = True
+        self.pvs.messages_received([json.dumps(data).encode(), b'bad'])
+        rows = writer.write_many.call_args[0][0]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0][:2], ['2017-11-06', 1.234])
+        writer.sync.assert_called_once()
+        error_mock.assert_called_once()
+
+    def test_messages_received_leaves_unacked_batches_unsynced(self):
+        data = {'localtime': '2017-11-06', 'power': 1234}
+        writer = MagicMock()
+        self.pvs.set_writer(writer)
+        self.pvs.messages_received([json.dumps(data).encode()])
+        writer.write_many.assert_called_once()
+        self.assertEqual(writer.sync.call_count, 0)
+
+    @skipIf(ZoneInfo is None, 'time zones require Python 3.9+')
+    def test_message_received_decodes_binary_in_clock_time_zone(self):
+        self.pvs.set_clock(RealClock('Asia/Tokyo'))
+        writer = MagicMock()
+        self.pvs.set_writer(writer)
+        body = BinarySerializer().encode(
+            {'timestamp': 1498014000, 'power': 1234}  # 12:00 in Tokyo
+        )
+        self.pvs.message_received(body)
+        row = writer.write.call_args[0][0]
+        self.assertEqual(row[0], '2017-06-21T12:00:00')
+        self.assertGreater(row[2], 0)
+
+    @patch('pvsim.simulators.logging.error')
+    def test_message_received_drops_unknown_power_format(self, error_mock):
+        writer = MagicMock()
+        self.pvs.set_writer(writer)
+        body = BinarySerializer().encode({'timestamp': 0, 'power': 1})
+        self.pvs.message_received(body[:4] + b'x' + body[5:])
+        writer.write.assert_not_called()
+        error_mock.assert_called_once()
+
+    @patch('pvsim.simulators.PVSimulator.random', return_value=1)
+    def test_message_received_uses_time_of_reading(self, _):
+        data = {'localtime': '2017-11-06T13:15:00', 'power': 1234}
+        writer = MagicMock()
+        self.pvs.set_writer(writer)
+        with patch.object(self.pvs, 'current_seconds') as seconds_mock:
+            self.pvs.message_received(json.dumps(data).encode())
+        self.assertEqual(seconds_mock.call_count, 0)
+        self.assertAlmostEqual(
+            writer.write.call_args[0][0][2],
+            self.pvs.power_at(13 * 3600 + 15 * 60) / 1000,
+            places=3,
+        )
+
+    def test_generated_power_does_not_depend_on_partitioning(self):
+        localtimes = [
+            '2017-11-06T12:00:{:02d}'.format(second) for second in range(6)
+        ]
+        simulator = PVSimulator(seed=42)
+        whole = [
+            simulator.generated_power_at(localtime) for localtime in localtimes
+        ]
+        workers = [PVSimulator(seed=42), PVSimulator(seed=42)]
+        split = [
+            workers[i % 2].generated_power_at(localtime)
+            for i, localtime in reversed(list(enumerate(localtimes)))
+        ]
+        self.assertEqual(split[::-1], whole)
+        batch = PVSimulator(seed=42).power_curve_at(
+            numpy.array(localtimes, 'datetime64[s]')
+        )
+        numpy.testing.assert_allclose(whole, batch, rtol=1e-6)
+
+    def test_generated_power_at_falls_back_to_now(self):
+        with patch.object(self.pvs, 'current_seconds', return_value=0):
+            self.assertEqual(self.pvs.generated_power_at('2017-11-06'), 0)
+
     def test_message_received_writes_to_writer(self):
         data = {'localtime': '2017-11-06', 'power': 1234}
         writer = MagicMock()
@@ -55,6 +212,29 @@ class PVSimulatorTestCase(TestCase):
         self.pvs.message_received(json.dumps(data).encode())
         writer.write.assert_called_once()
 
+    def test_message_received_writes_binary_frames(self):
+        serializer = BinarySerializer()
+        body = serializer.encode_many([
+            {'timestamp': 1509969600, 'power': 1000, 'meter_id': 1},
+            {'timestamp': 1509969602, 'power': 2000, 'meter_id': 2},
+        ])
+        writer = MagicMock()
+        self.pvs.set_writer(writer)
+        self.pvs.message_received(body)
+        self.assertEqual(writer.write.call_count, 2)
+        self.assertEqual(writer.write.call_args[0][0][1], 2)
+
+    @patch('pvsim.simulators.logging.error')
+    def test_message_received_errs_on_truncated_frame(self, error_mock):
+        body = BinarySerializer().encode(
+            {'timestamp': 1509969600, 'power': 1000}
+        )
+        writer = MagicMock()
+        self.pvs.set_writer(writer)
+        self.pvs.message_received(body[:-2])
+        self.assertEqual(writer.write.call_count, 0)
+        self.assertIn('Could not unpack message', error_mock.call_args[0][0])
+
     @patch('pvsim.simulators.logging.error')
     def test_message_received_errs_on_decode_error(self, error_mock):
         writer = MagicMock()
@@ -88,3 +268,120 @@ class PVSimulatorTestCase(TestCase):
         self.pvs.message_received(json.dumps(data).encode())
         self.assertEqual(writer.write.call_count, 0)
         self.assertIn('Message is incompatible', error_mock.call_args[0][0])
+
+
+class SolarPVSimulatorTestCase(TestCase):
+
+    def setUp(self):
+        self.spvs = SolarPVSimulator(latitude=52.52, longitude=15, tilt=30)
+
+    def test_init_raises_value_error(self):
+        with self.assertRaises(ValueError) as e:
+            SolarPVSimulator(latitude=91)
+        self.assertIn('latitude', e.exception.args[0])
+        with self.assertRaises(ValueError) as e:
+            SolarPVSimulator(tilt=-1)
+        self.assertIn('tilt', e.exception.args[0])
+
+    def test_days_are_longer_in_summer(self):
+        summer_sunrise, summer_sunset, _ = self.spvs.day(172)
+        winter_sunrise, winter_sunset, _ = self.spvs.day(355)
+        self.assertLess(summer_sunrise, 4 * 3600)
+        self.assertGreater(summer_sunset, 20 * 3600)
+        self.assertGreater(winter_sunrise, 8 * 3600)
+        self.assertLess(winter_sunset, 16 * 3600)
+
+    def test_equinox_has_twelve_hours_of_daylight(self):
+        sunrise, sunset, _ = SolarPVSimulator(latitude=0).day(80)
+        self.assertAlmostEqual((sunset - sunrise) / 3600, 12, places=1)
+
+    def test_clear_sky_curve_is_zero_at_night(self):
+        sunrise, sunset, curve = self.spvs.day(172)
+        self.assertEqual(curve[sunrise - 60], 0)
+        self.assertEqual(curve[sunset + 60], 0)
+        self.assertGreater(curve[12 * 3600], 0.8 * self.spvs.max_power)
+
+    def test_panel_faces_the_equator_in_southern_hemisphere(self):
+        south = SolarPVSimulator(latitude=-33.9, longitude=18.4, utc_offset=2)
+        north = SolarPVSimulator(latitude=33.9, longitude=18.4, utc_offset=2)
+        self.assertAlmostEqual(
+            south.day(172)[2].max(), north.day(355)[2].max(), places=3
+        )
+        self.assertGreater(south.day(172)[2].max(), 2000)
+        east = SolarPVSimulator(latitude=-33.9, azimuth=-90)
+        self.assertLess(east.day(172)[2].argmax(), 12 * 3600)
+
+    def test_tilted_panel_generates_more_in_winter(self):
+        flat = SolarPVSimulator(latitude=52.52, longitude=15, tilt=0)
+        self.assertGreater(self.spvs.day(355)[2].sum(), flat.day(355)[2].sum())
+
+    def test_day_is_cached(self):
+        self.spvs.cache_days = 2
+        curve = self.spvs.day(1)[2]
+        self.assertIs(self.spvs.day(1)[2], curve)
+        self.spvs.day(2)
+        self.spvs.day(3)
+        self.assertEqual(len(self.spvs._days), 2)
+        self.assertIsNot(self.spvs.day(1)[2], curve)
+
+    def test_day_is_invalidated_when_parameters_change(self):
+        curve = self.spvs.day(1)[2]
+        self.spvs.tilt = 60
+        self.assertIsNot(self.spvs.day(1)[2], curve)
+
+    @patch('pvsim.simulators.SolarPVSimulator.random', return_value=1)
+    def test_power_at_uses_todays_curve(self, _):
+        with patch('pvsim.simulators.SolarPVSimulator.today', 172):
+            self.assertEqual(self.spvs.power_at(2 * 3600), 0)
+            self.assertAlmostEqual(
+                self.spvs.power_at(12 * 3600),
+                self.spvs.day(172)[2][12 * 3600],
+                places=3,
+            )
+
+    @patch('pvsim.simulators.SolarPVSimulator.random', return_value=1)
+    def test_generated_power_at_uses_date_of_reading(self, _):
+        self.assertGreater(
+            self.spvs.generated_power_at('2017-06-21T18:00:00'), 0
+        )
+        self.assertEqual(
+            self.spvs.generated_power_at('2017-12-21T18:00:00'), 0
+        )
+
+    @patch('pvsim.simulators.SolarPVSimulator.random', return_value=1)
+    def test_generated_power_at_uses_standard_time_of_timestamp(self, _):
+        # 12:00 CEST in Berlin is 11:00 in standard time
+        self.assertAlmostEqual(
+            self.spvs.generated_power_at('2017-06-21T12:00:00', 1498039200),
+            self.spvs.day(172)[2][11 * 3600],
+            places=3,
+        )
+        # 00:30 UTC on New Year's Day is 01:30 the same day in standard time
+        self.assertEqual(self.spvs.standard_time_of(1483230600), (1, 5400))
+
+    @skipIf(ZoneInfo is None, 'time zones require Python 3.9+')
+    @patch('pvsim.simulators.SolarPVSimulator.random', return_value=1)
+    def test_message_received_uses_standard_time_of_json_readings(self, _):
+        clock = SimulatedClock(
+            '2017-06-21T12:00:00', speed=1e-9, timezone='Europe/Berlin'
+        )
+        broker = MagicMock()
+        GenericMeter(HPCMeasure(), broker, clock=clock).publish()
+        writer = MagicMock()
+        self.spvs.set_writer(writer)
+        self.spvs.message_received(broker.publish.call_args[0][0].encode())
+        row = writer.write.call_args[0][0]
+        self.assertEqual(row[0], '2017-06-21T12:00:00')
+        self.assertAlmostEqual(
+            row[2], self.spvs.day(172)[2][11 * 3600] / 1000,
+            places=3,
+        )
+
+    def test_power_curve_at_uses_date_of_each_timestamp(self):
+        timestamps = numpy.array(
+            ['2017-06-21T18:00:00', '2017-12-21T18:00:00'],
+            dtype='datetime64[s]',
+        )
+        power = self.spvs.power_curve_at(timestamps, random_state=42)
+        self.assertGreater(power[0], 0)
+        self.assertEqual(power[1], 0)
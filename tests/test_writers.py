@@ -0,0 +1,467 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of pvsim.
+# https://github.com/scorphus/pvism
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/MIT-license
+# Copyright (c) 2017, Pablo Santiago Blum de Aguiar <pablo.aguiar@gmail.com>
+
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from mock import MagicMock, patch
+from pvsim.writers import (
+    CSVWriter, ParquetWriter, RotatingCSVWriter, StdoutWriter, ThreadedWriter,
+    Writer, pyarrow,
+)
+from unittest import TestCase, skipIf
+
+
+class WriterTestCase(TestCase):
+
+    def test_write_raises_not_implemented(self):
+        with self.assertRaises(NotImplementedError):
+            Writer().write([])
+
+    def test_write_many_calls_write(self):
+        writer = Writer()
+        writer.write = MagicMock()
+        writer.write_many([[1], [2]])
+        self.assertEqual(writer.write.call_count, 2)
+
+
+class StdoutWriterTestCase(TestCase):
+
+    @patch('pvsim.writers.sys.stdout')
+    def test_write_writes_to_stdout(self, stdout_mock):
+        StdoutWriter().write([1, 2])
+        stdout_mock.write.assert_called_once_with('[1, 2]')
+
+
+class CSVWriterTestCase(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmpdir, 'output.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_lines(self):
+        if not os.path.exists(self.filepath):
+            return []
+        with open(self.filepath) as fp:
+            return fp.read().splitlines()
+
+    def test_write_buffers_until_buffer_size(self):
+        writer = CSVWriter(self.filepath, buffer_size=2, flush_interval=60)
+        writer.write(['2017-11-06', 1, 2, 1])
+        self.assertEqual(self.read_lines(), [])
+        writer.write(['2017-11-07', 3, 4, 1])
+        self.assertEqual(
+            self.read_lines(), ['2017-11-06,1,2,1', '2017-11-07,3,4,1']
+        )
+        writer.close()
+
+    def test_write_flushes_after_flush_interval(self):
+        writer = CSVWriter(self.filepath, buffer_size=100, flush_interval=0)
+        writer.write(['2017-11-06', 1, 2, 1])
+        self.assertEqual(self.read_lines(), ['2017-11-06,1,2,1'])
+        writer.close()
+
+    def test_write_many_appends_all_rows(self):
+        writer = CSVWriter(self.filepath, buffer_size=2, flush_interval=60)
+        writer.write_many([[1], [2], [3]])
+        self.assertEqual(self.read_lines(), ['1', '2', '3'])
+        writer.close()
+
+    def test_close_flushes_and_closes_file(self):
+        writer = CSVWriter(self.filepath, buffer_size=100, flush_interval=60)
+        writer.write([1])
+        writer.close()
+        self.assertEqual(self.read_lines(), ['1'])
+        self.assertIsNone(writer._fp)
+
+    def test_file_is_opened_once(self):
+        writer = CSVWriter(self.filepath, buffer_size=1)
+        with patch('pvsim.writers.open', create=True, wraps=open) as open_mock:
+            writer.write([1])
+            writer.write([2])
+        open_mock.assert_called_once_with(self.filepath, 'a')
+        writer.close()
+
+    @patch('pvsim.writers.os.fsync')
+    def test_fsync_every_n_rows(self, fsync_mock):
+        writer = CSVWriter(self.filepath, buffer_size=1, fsync_every=2)
+        writer.write([1])
+        self.assertEqual(fsync_mock.call_count, 0)
+        writer.write([2])
+        self.assertEqual(fsync_mock.call_count, 1)
+        writer.write([3])
+        writer.close()
+        self.assertEqual(fsync_mock.call_count, 2)
+
+    @patch('pvsim.writers.os.fsync')
+    def test_sync_flushes_and_fsyncs(self, fsync_mock):
+        writer = CSVWriter(self.filepath, flush_interval=60)
+        writer.sync()
+        fsync_mock.assert_not_called()
+        writer.write([1])
+        writer.sync()
+        self.assertEqual(self.read_lines(), ['1'])
+        fsync_mock.assert_called_once()
+        writer.close()
+        fsync_mock.assert_called_once()
+
+
+@skipIf(pyarrow is None, 'pyarrow is not installed')
+class ParquetWriterTestCase(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmpdir, 'output.parquet')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_table(self):
+        return pyarrow.parquet.read_table(self.filepath)
+
+    def test_sync_is_not_durable(self):
+        self.assertFalse(ParquetWriter(self.filepath).durable_sync)
+
+    def test_write_emits_row_groups(self):
+        writer = ParquetWriter(
+            self.filepath, row_group_size=2, flush_interval=60
+        )
+        writer.write(['2017-11-06T12:00:00', 1.5, 2.5, 1.0])
+        writer.write(['2017-11-06T12:00:02', 1.0, 2.0, 1.0])
+        writer.write_many([['2017-11-06T12:00:04', 2.0, 1.0, -1.0]])
+        writer.close()
+        parquet_file = pyarrow.parquet.ParquetFile(self.filepath)
+        self.assertEqual(parquet_file.num_row_groups, 2)
+        table = self.read_table()
+        self.assertEqual(table.column_names, list(ParquetWriter.columns))
+        self.assertEqual(table.column('consumed').to_pylist(), [1.5, 1, 2])
+        self.assertEqual(
+            str(table.column('localtime')[0]), '2017-11-06 12:00:00'
+        )
+
+    @patch('pvsim.writers.logging.error')
+    def test_flush_drops_rows_with_invalid_localtime(self, error_mock):
+        writer = ParquetWriter(self.filepath, row_group_size=1)
+        writer.write(['garbage', 1.0, 2.0, 1.0])
+        writer.write(['2017-11-06T12:00:00', 1.5, 2.5, 1.0])
+        writer.close()
+        table = self.read_table()
+        self.assertEqual(table.column('consumed').to_pylist(), [1.5])
+        error_mock.assert_called_once()
+
+    @patch('pvsim.writers.logging.warning')
+    def test_existing_file_is_not_overwritten(self, warning_mock):
+        for run in range(3):
+            writer = ParquetWriter(self.filepath)
+            writer.write(['2017-11-06T12:00:00', float(run), 2.5, 1.0])
+            writer.close()
+        self.assertEqual(
+            self.read_table().column('consumed').to_pylist(), [0]
+        )
+        for run in (1, 2):
+            table = pyarrow.parquet.read_table(
+                os.path.join(self.tmpdir, 'output.{}.parquet'.format(run))
+            )
+            self.assertEqual(table.column('consumed').to_pylist(), [run])
+        self.assertEqual(warning_mock.call_count, 2)
+
+    def test_close_without_rows_creates_no_file(self):
+        writer = ParquetWriter(self.filepath)
+        writer.close()
+        self.assertFalse(os.path.exists(self.filepath))
+
+    @patch('pvsim.writers.pyarrow', None)
+    def test_init_requires_pyarrow(self):
+        with self.assertRaises(ImportError):
+            ParquetWriter(self.filepath)
+
+
+class StalledWriter(Writer):
+    '''Keeps rows written in memory, stalling until ``resume`` is set'''
+
+    def __init__(self):
+        self.rows = []
+        self.flushes = 0
+        self.closed = False
+        self.resume = threading.Event()
+        self.stalled = threading.Event()
+
+    def write(self, data):
+        self.stalled.set()
+        self.resume.wait(5)
+        self.rows.append(data)
+
+    def flush(self):
+        self.flushes += 1
+
+    def close(self):
+        self.closed = True
+
+
+class ThreadedWriterTestCase(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.spill_path = os.path.join(self.tmpdir, 'spill.jsonl')
+        self.inner = StalledWriter()
+
+    def tearDown(self):
+        self.inner.resume.set()
+        shutil.rmtree(self.tmpdir)
+
+    def stalled_writer(self, **kwargs):
+        '''A ThreadedWriter whose thread is stuck writing the row [0]'''
+        writer = ThreadedWriter(self.inner, queue_size=2, **kwargs)
+        writer.write([0])
+        self.assertTrue(self.inner.stalled.wait(5))
+        return writer
+
+    def test_writes_rows_in_order_and_closes(self):
+        writer = ThreadedWriter(self.inner)
+        self.inner.resume.set()
+        writer.write([1])
+        writer.write_many([[2], [3]])
+        writer.close()
+        self.assertEqual(self.inner.rows, [[1], [2], [3]])
+        self.assertTrue(self.inner.closed)
+
+    def test_sync_is_durable_unless_dropping_rows(self):
+        self.inner.resume.set()
+        for policy, durable in (('block', True), ('drop-oldest', False)):
+            writer = ThreadedWriter(CSVWriter(self.spill_path), policy=policy)
+            self.assertIs(writer.durable_sync, durable)
+            writer.close()
+        writer = ThreadedWriter(self.inner)
+        self.assertFalse(writer.durable_sync)
+        writer.close()
+
+    @patch('pvsim.writers.logging.error')
+    def test_write_failure_is_raised_by_next_flush(self, error_mock):
+        inner = MagicMock()
+        inner.write_many.side_effect = IOError('disk full')
+        writer = ThreadedWriter(inner)
+        writer.write([1])
+        with self.assertRaises(IOError):
+            writer.flush()
+        error_mock.assert_called_once()
+        inner.write_many.side_effect = None
+        writer.write([2])
+        writer.flush()
+        writer.close()
+
+    @patch('pvsim.writers.logging.error')
+    def test_sync_failure_is_raised_by_sync(self, error_mock):
+        inner = MagicMock()
+        inner.sync.side_effect = OSError('I/O error')
+        writer = ThreadedWriter(inner)
+        writer.write([1])
+        with self.assertRaises(OSError):
+            writer.sync()
+        writer.close()
+
+    @patch('pvsim.writers.logging.error')
+    def test_failure_is_raised_by_next_write(self, error_mock):
+        inner = MagicMock()
+        inner.flush.side_effect = IOError('disk full')
+        writer = ThreadedWriter(inner)
+        writer.write([1])
+        with self.assertRaises(IOError):
+            writer.flush()
+        inner.write_many.side_effect = IOError('disk full')
+        writer.write([2])
+        with writer._condition:
+            while writer._done < 2:
+                writer._condition.wait()
+        with self.assertRaises(IOError):
+            writer.write([3])
+        writer.close()
+
+    def test_flush_waits_for_rows_and_flushes(self):
+        writer = ThreadedWriter(self.inner)
+        self.inner.resume.set()
+        writer.write_many([[1], [2]])
+        writer.flush()
+        self.assertEqual(self.inner.rows, [[1], [2]])
+        self.assertEqual(self.inner.flushes, 1)
+        writer.close()
+
+    def test_sync_waits_for_rows_and_syncs(self):
+        self.inner.sync = MagicMock()
+        writer = ThreadedWriter(self.inner)
+        self.inner.resume.set()
+        writer.write([1])
+        writer.sync()
+        self.assertEqual(self.inner.rows, [[1]])
+        self.inner.sync.assert_called_once()
+        self.assertEqual(self.inner.flushes, 0)
+        writer.close()
+
+    def test_write_does_not_wait_for_a_stalled_writer(self):
+        writer = self.stalled_writer()
+        writer.write_many([[1], [2]])
+        self.assertEqual(self.inner.rows, [])
+        self.inner.resume.set()
+        writer.close()
+        self.assertEqual(self.inner.rows, [[0], [1], [2]])
+
+    def test_block_policy_waits_for_room(self):
+        writer = self.stalled_writer()
+        writer.write_many([[1], [2]])
+        blocked = threading.Thread(target=writer.write, args=([3],))
+        blocked.start()
+        blocked.join(0.05)
+        self.assertTrue(blocked.is_alive())
+        self.inner.resume.set()
+        blocked.join(5)
+        writer.close()
+        self.assertEqual(self.inner.rows, [[0], [1], [2], [3]])
+
+    def test_drop_oldest_policy_drops_rows(self):
+        writer = self.stalled_writer(policy='drop-oldest')
+        for i in range(1, 5):
+            writer.write([i])
+        self.assertEqual(writer.dropped, 2)
+        self.inner.resume.set()
+        writer.close()
+        self.assertEqual(self.inner.rows, [[0], [3], [4]])
+
+    def test_spill_policy_spills_rows_in_order(self):
+        writer = self.stalled_writer(
+            policy='spill', spill_path=self.spill_path
+        )
+        for i in range(1, 6):
+            writer.write([i])
+        with open(self.spill_path) as fp:
+            spilled = fp.read().splitlines()
+        self.assertEqual(spilled, ['[[3]]', '[[4]]', '[[5]]'])
+        self.inner.resume.set()
+        writer.close()
+        self.assertEqual(self.inner.rows, [[i] for i in range(6)])
+        self.assertFalse(os.path.exists(self.spill_path))
+
+    def test_write_after_close_raises(self):
+        writer = ThreadedWriter(self.inner)
+        writer.close()
+        with self.assertRaises(ValueError):
+            writer.write([1])
+
+    def test_init_rejects_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            ThreadedWriter(self.inner, policy='ignore')
+
+
+class RotatingCSVWriterTestCase(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.directory = os.path.join(self.tmpdir, 'output')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def rotating_writer(self, **kwargs):
+        kwargs.setdefault('buffer_size', 1000)
+        kwargs.setdefault('flush_interval', 60)
+        return RotatingCSVWriter(self.directory, **kwargs)
+
+    def read_manifest(self, name):
+        with open(os.path.join(self.directory, name)) as fp:
+            return json.load(fp)
+
+    def read_lines(self, name):
+        with gzip.open(os.path.join(self.directory, name), 'rt') as fp:
+            return fp.read().splitlines()
+
+    def test_write_partitions_rows_by_hour(self):
+        writer = self.rotating_writer()
+        writer.write_many([
+            ['2017-06-21T12:59:58', 1, 2, 1],
+            ['2017-06-21T12:59:59', 1, 2, 1],
+            ['2017-06-21T13:00:00', 1, 2, 1],
+            ['2017-06-21T12:59:57', 1, 2, 1],  # late: stays in 13's file
+        ])
+        writer.close()
+        self.assertEqual(sorted(os.listdir(self.directory)), [
+            '2017-06-21T12.csv.gz', '2017-06-21T12.manifest.json',
+            '2017-06-21T13.csv.gz', '2017-06-21T13.manifest.json',
+        ])
+        self.assertEqual(len(self.read_lines('2017-06-21T12.csv.gz')), 2)
+        manifest = self.read_manifest('2017-06-21T13.manifest.json')
+        self.assertEqual(manifest['file'], '2017-06-21T13.csv.gz')
+        self.assertEqual(manifest['rows'], 2)
+        self.assertEqual(manifest['first_localtime'], '2017-06-21T12:59:57')
+        self.assertEqual(manifest['last_localtime'], '2017-06-21T13:00:00')
+        self.assertEqual(manifest['compression'], 'gzip')
+
+    def test_write_partitions_rows_by_day_uncompressed(self):
+        writer = self.rotating_writer(partition='day', compression='')
+        writer.write(['2017-06-21T23:59:59', 1, 2, 1])
+        writer.write(['2017-06-22T00:00:00', 1, 2, 1])
+        writer.close()
+        self.assertEqual(sorted(os.listdir(self.directory)), [
+            '2017-06-21.csv', '2017-06-21.manifest.json',
+            '2017-06-22.csv', '2017-06-22.manifest.json',
+        ])
+        manifest = self.read_manifest('2017-06-22.manifest.json')
+        self.assertIsNone(manifest['compression'])
+
+    def test_write_rotates_at_max_bytes(self):
+        writer = self.rotating_writer(
+            partition='size', max_bytes=10, buffer_size=1
+        )
+        writer.write(['2017-06-21T12:00:00', 1, 2, 1])
+        writer.write(['2017-06-21T12:00:02', 1, 2, 1])
+        writer.close()
+        self.assertEqual(sorted(os.listdir(self.directory)), [
+            '2017-06-21T120000.csv.gz', '2017-06-21T120000.manifest.json',
+            '2017-06-21T120002.csv.gz', '2017-06-21T120002.manifest.json',
+        ])
+
+    def test_write_does_not_overwrite_closed_files(self):
+        for _ in range(2):
+            writer = self.rotating_writer()
+            writer.write(['2017-06-21T12:00:00', 1, 2, 1])
+            writer.close()
+        manifest = self.read_manifest('2017-06-21T12.1.manifest.json')
+        self.assertEqual(manifest['file'], '2017-06-21T12.1.csv.gz')
+        self.assertEqual(len(self.read_lines('2017-06-21T12.csv.gz')), 1)
+
+    @patch('pvsim.writers.os.fsync')
+    def test_sync_fsyncs_files_rotated_meanwhile(self, fsync_mock):
+        writer = self.rotating_writer()
+        writer.write(['2017-06-21T12:00:00', 1, 2, 1])
+        writer.write(['2017-06-21T13:00:00', 1, 2, 1])
+        writer.sync()
+        self.assertEqual(fsync_mock.call_count, 2)
+        writer.close()
+
+    def test_close_without_rows_creates_no_file(self):
+        self.rotating_writer().close()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_init_rejects_inappropriate_values(self):
+        with self.assertRaises(ValueError):
+            self.rotating_writer(partition='minute')
+        with self.assertRaises(ValueError):
+            self.rotating_writer(partition='size')
+        with self.assertRaises(ValueError):
+            self.rotating_writer(compression='lzma')
+
+    @patch('pvsim.writers.zstandard', None)
+    def test_init_requires_zstandard_for_zstd(self):
+        with self.assertRaises(ImportError):
+            self.rotating_writer(compression='zstd')